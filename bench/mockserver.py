@@ -0,0 +1,845 @@
+#!/usr/bin/env python3
+
+#
+# Copyright (c) 2022 Palo Alto Networks, Inc.
+#
+# Permission to use, copy, modify, and distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+#
+
+import collections
+import functools
+import getopt
+import hashlib
+import http.server
+import json
+import os
+import random
+import re
+import struct
+import sys
+import threading
+import time
+import urllib.parse
+
+BASE_PATH = '/service/v1'
+API_KEY_HEADER = 'x-api-key'
+MAX_LIMIT = 1000
+MAX_ITEMS = 100
+DAY_LIMIT = 1000000
+
+IPS_TYPES = ('fileformat', 'spyware', 'vulnerability')
+VIRUS_TYPES = ('antivirus', 'dns', 'spywarec2')
+TYPES = IPS_TYPES + VIRUS_TYPES
+# first threat ID by type
+ID_BASE = {x: (i + 1) * 1000000 for i, x in enumerate(TYPES)}
+
+EDL_NAMES = (
+    'panw-known-ip-list',
+    'panw-highrisk-ip-list',
+    'panw-torexit-ip-list',
+    'panw-bulletproof-ip-list',
+)
+
+CONTENT_VERSION = 8600
+EDL_VERSION = 500
+EDL_VERSIONS = 3
+RELEASE_TIME = 1700000000
+
+
+def _time(t):
+    return time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(t))
+
+
+def _hash(x, name='sha256'):
+    return hashlib.new(name, str(x).encode()).hexdigest()
+
+
+class Dataset:
+    # Deterministic mock data.  count is the number of threats of each
+    # type and the size of the larger EDLs.
+    def __init__(self, count=5000):
+        self.count = count
+        self.threats = {x: [self._threat(x, i) for i in range(count)]
+                        for x in TYPES}
+        self.by_id = {}
+        self.by_hash = collections.defaultdict(list)
+        for type_, threats in self.threats.items():
+            for x in threats:
+                self.by_id[x['id']] = (type_, x)
+                for k in ('sha256', 'md5'):
+                    if k in x:
+                        self.by_hash[x[k]].append((type_, x))
+                for y in x.get('related_sha256_hashes', []):
+                    self.by_hash[y].append((type_, x))
+
+    def _threat(self, type_, i):
+        id_ = ID_BASE[type_] + i
+        x = {
+            'id': str(id_),
+            'name': 'Mock %s threat %d' % (type_.capitalize(), i),
+            'description': 'Mock %s signature %d for offline '
+            'benchmarks.' % (type_, i),
+            'category': type_,
+            'severity': ('low', 'medium', 'high', 'critical')[i % 4],
+            'status': 'released',
+            'default_action': ('alert', 'reset-both', 'drop')[i % 3],
+            # about 50 signatures per content release
+            'latest_release_version': str(CONTENT_VERSION -
+                                          (self.count - i) // 50),
+            'latest_release_time': _time(RELEASE_TIME + i * 60),
+        }
+        if type_ in IPS_TYPES:
+            x['cve'] = ['CVE-%d-%04d' % (2015 + i % 10, i)]
+            x['vendor'] = []
+            x['reference'] = ['https://example.com/advisory/%d' % id_]
+        else:
+            x['sha256'] = _hash(id_)
+            x['md5'] = _hash(id_, 'md5')
+            x['related_sha256_hashes'] = [_hash(-id_)]
+            x['release'] = {
+                'antivirus': {
+                    'first_release_version': '4000',
+                    'first_release_time': _time(RELEASE_TIME),
+                    'last_release_version': '4400',
+                    'last_release_time': _time(RELEASE_TIME + i * 60),
+                },
+            }
+
+        return x
+
+    def threat_types(self, type_):
+        if type_ is None:
+            return TYPES
+        if type_ == 'ips':
+            return IPS_TYPES
+        if type_ in TYPES:
+            return (type_,)
+
+    def history(self, id_):
+        # a few release versions per threat
+        n = 2 + int(id_) % 5
+        return [{
+            'version': '%d' % (4000 + j * 100),
+            'build_time': _time(RELEASE_TIME + j * 86400),
+            'release_time': _time(RELEASE_TIME + j * 86400 + 3600),
+            'status': 'released',
+        } for j in range(n)]
+
+    def edl_size(self, name):
+        if name == 'panw-bulletproof-ip-list':
+            return max(self.count // 10, 1)
+        return self.count
+
+    def edl(self, name, version):
+        # Consecutive lists overlap by half, and each version drops the
+        # oldest entries and adds new ones.
+        j = EDL_NAMES.index(name)
+        shift = max(self.edl_size(name) // 100, 1)
+        start = (j + 2) * self.count // 2 + (version - EDL_VERSION) * shift
+
+        end = start + self.edl_size(name)
+
+        return [_edl_entry(i) for i in range(start, end)]
+
+    @functools.lru_cache(maxsize=64)
+    def edl_set(self, name, version):
+        return frozenset(self.edl(name, version))
+
+
+def _edl_entry(i):
+    # every tenth entry is IPv6, every 16th IPv4 is a network
+    if i % 10 == 9:
+        return '2001:db8:%x:%x::1' % (i >> 16, i & 0xffff)
+    x = '10.%d.%d.%d' % ((i >> 16) & 0xff, (i >> 8) & 0xff, i & 0xff)
+    if i % 16 == 0:
+        n = i >> 4
+        x = '10.%d.%d.%d/28' % (128 + ((n >> 12) & 0x7f), (n >> 4) & 0xff,
+                                (n & 0xf) << 4)
+
+    return x
+
+
+class RateLimit:
+    def __init__(self, *,
+                 limit=None,
+                 day_limit=None,
+                 window=60):
+        self.limit = limit
+        self.day_limit = day_limit
+        self.window = window
+        self.lock = threading.Lock()
+        self.reset = 0
+        self.remaining = limit
+        self.day_reset = 0
+        self.day_remaining = day_limit
+
+    def check(self):
+        now = time.time()
+        with self.lock:
+            if now >= self.reset:
+                self.reset = (int(now) // self.window + 1) * self.window
+                self.remaining = self.limit
+            if now >= self.day_reset:
+                self.day_reset = (int(now) // 86400 + 1) * 86400
+                self.day_remaining = self.day_limit
+
+            ok = True
+            if self.limit is not None:
+                if self.remaining < 1:
+                    ok = False
+                else:
+                    self.remaining -= 1
+            if self.day_limit is not None and ok:
+                if self.day_remaining < 1:
+                    ok = False
+                else:
+                    self.day_remaining -= 1
+
+            headers = {}
+            if self.limit is not None:
+                headers.update({
+                    'X-Minute-RateLimit-Limit': self.limit,
+                    'X-Minute-RateLimit-Remaining': self.remaining,
+                    'X-Minute-RateLimit-Reset': self.reset,
+                })
+            if self.day_limit is not None:
+                headers.update({
+                    'X-Day-RateLimit-Limit': self.day_limit,
+                    'X-Day-RateLimit-Remaining': self.day_remaining,
+                    'X-Day-RateLimit-Reset': self.day_reset,
+                })
+            elif self.limit is not None:
+                # the API sends both; clients retry HTTP 429 only with
+                # day requests remaining
+                headers.update({
+                    'X-Day-RateLimit-Limit': DAY_LIMIT,
+                    'X-Day-RateLimit-Remaining': DAY_LIMIT,
+                    'X-Day-RateLimit-Reset': self.day_reset,
+                })
+
+        return ok, headers
+
+
+class _Error(Exception):
+    def __init__(self, status, message):
+        self.status = status
+        self.message = message
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server_version = 'mockserver/1.0'
+    # headers and body are separate writes
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        if self.server.options['verbose']:
+            super().log_message(format, *args)
+
+    def send_body(self, status, body, content_type, headers):
+        self.server.count_response(self.command, self.path_, status)
+        self.send_response(status)
+        self.send_header('content-type', content_type)
+        self.send_header('content-length', str(len(body)))
+        for k, v in headers.items():
+            self.send_header(k, str(v))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def send_json(self, status, obj, headers):
+        body = obj if isinstance(obj, bytes) else json.dumps(obj).encode()
+        etag = '"%s"' % hashlib.md5(body).hexdigest()
+        if status == 200:
+            headers = dict(headers, ETag=etag)
+            if self.headers.get('if-none-match') == etag:
+                self.server.count_response(self.command, self.path_, 304)
+                self.send_response(304)
+                for k, v in headers.items():
+                    self.send_header(k, str(v))
+                self.send_header('content-length', '0')
+                self.end_headers()
+                return
+        self.send_body(status, body, 'application/json', headers)
+
+    def do_GET(self):
+        self.request_()
+
+    def do_POST(self):
+        self.request_()
+
+    def request_(self):
+        url = urllib.parse.urlsplit(self.path)
+        self.path_ = url.path
+        query = {}
+        for k, v in urllib.parse.parse_qsl(url.query,
+                                           keep_blank_values=True):
+            query[k] = v
+        body = None
+        length = int(self.headers.get('content-length') or 0)
+        if length:
+            body = self.rfile.read(length)
+
+        options = self.server.options
+        delay = options['latency']
+        if options['jitter']:
+            delay += random.uniform(0, options['jitter'])
+        if delay:
+            time.sleep(delay)
+
+        if self.headers.get(API_KEY_HEADER) is None:
+            self.send_json(401, {'success': False,
+                                 'message': 'Missing API key'}, {})
+            return
+
+        ok, headers = self.server.rate_limit.check()
+        if (not ok or (options['error_rate'] and
+                       random.random() < options['error_rate'])):
+            self.send_json(429, {'success': False,
+                                 'message': 'API rate limit exceeded'},
+                           headers)
+            return
+
+        routes = {
+            ('GET', '/threats'): self.threats,
+            ('POST', '/threats'): self.threats2,
+            ('GET', '/threats/history'): self.threats_history,
+            ('GET', '/release-notes'): self.release_notes,
+            ('GET', '/edl'): self.edl,
+            ('POST', '/atp/reports'): self.atp_reports,
+            ('GET', '/atp/reports/pcaps'): self.atp_reports_pcaps,
+        }
+        path = url.path
+        if path.startswith(BASE_PATH):
+            path = path[len(BASE_PATH):]
+        func = routes.get((self.command, path))
+        if func is None:
+            self.send_json(404, {'success': False,
+                                 'message': 'Not Found'}, headers)
+            return
+
+        try:
+            if self.command == 'POST':
+                try:
+                    obj = json.loads(body or b'')
+                except ValueError:
+                    raise _Error(400, 'JSON parse error')
+                if not isinstance(obj, dict):
+                    raise _Error(400, 'Invalid data')
+                x = func(obj)
+            else:
+                x = func(query)
+        except _Error as e:
+            self.send_json(e.status, {'success': False,
+                                      'message': e.message}, headers)
+            return
+
+        if isinstance(x, tuple):
+            # binary content
+            content_type, body = x
+            self.send_body(200, body, content_type, headers)
+        else:
+            self.send_json(200, x, headers)
+
+    def dataset(self):
+        return self.server.dataset
+
+    def threats(self, query):
+        return self.server.threats_page(tuple(sorted(query.items())))
+
+    def threats2(self, obj):
+        args = [k for k in ('id', 'name', 'sha256', 'md5') if k in obj]
+        if len(args) != 1:
+            raise _Error(400, 'One of id, name, sha256 or md5 is required')
+        key = args[0]
+        values = obj[key]
+        if not isinstance(values, list):
+            raise _Error(400, '%s: Expected a list of items but got type '
+                         '"%s".' % (key, type(values).__name__))
+        if len(values) > MAX_ITEMS:
+            raise _Error(400, '%s: Ensure this field has no more than '
+                         '%d elements.' % (key, MAX_ITEMS))
+        types = self.dataset().threat_types(obj.get('type'))
+        if types is None:
+            raise _Error(400, 'type: Value is invalid.')
+
+        data = collections.defaultdict(list)
+        for value in values:
+            value = str(value)
+            if key == 'id':
+                matches = [self.dataset().by_id[value]] \
+                    if value in self.dataset().by_id else []
+            elif key == 'name':
+                matches = [(t, x) for t in types
+                           for x in self.dataset().threats[t]
+                           if x['name'] == value]
+            else:
+                matches = self.dataset().by_hash.get(value.lower(), [])
+            for t, x in matches:
+                if t in types:
+                    data[t].append(x)
+
+        if not data:
+            raise _Error(404, 'Not Found')
+
+        return {
+            'success': True,
+            'count': sum(len(x) for x in data.values()),
+            'data': data,
+            'message': 'Successful',
+        }
+
+    def threats_history(self, query):
+        if query.get('type') not in ('antivirus', 'wildfire'):
+            raise _Error(400, 'type: Value is invalid.')
+        if 'id' not in query:
+            raise _Error(400, 'id: This field is required.')
+        if query['id'] not in self.dataset().by_id:
+            raise _Error(404, 'Not Found')
+        order = query.get('order', 'asc')
+        if order not in ('asc', 'desc'):
+            raise _Error(400, 'order: Value is invalid.')
+        offset, limit = _paging(query)
+
+        items = self.dataset().history(query['id'])
+        if order == 'desc':
+            items.reverse()
+
+        return {
+            'success': True,
+            'count': len(items),
+            'data': items[offset:offset + limit],
+            'message': 'Successful',
+        }
+
+    def release_notes(self, query):
+        if query.get('type') != 'content':
+            raise _Error(400, 'type: Value is invalid.')
+        version = query.get('version')
+        if version is None:
+            raise _Error(400, 'version: This field is required.')
+        if version == 'latest':
+            n = CONTENT_VERSION
+        else:
+            r = re.search(r'^(\d+)(-\d+)?$', version)
+            if r is None:
+                raise _Error(400, 'version: Value is invalid.')
+            n = int(r.group(1))
+            if not CONTENT_VERSION - 100 < n <= CONTENT_VERSION:
+                raise _Error(404, 'Not Found')
+
+        return {
+            'success': True,
+            'count': 1,
+            'data': [{
+                'content_version': '%d-%d' % (n, n - 1200),
+                'release_time': _time(RELEASE_TIME +
+                                      (n - CONTENT_VERSION) * 86400),
+                'notes': ['Mock release notes for content %d.' % n],
+                'release_notes': {
+                    'spyware': {'new': [], 'modified': []},
+                    'vulnerability': {'new': [], 'modified': []},
+                },
+            }],
+            'message': 'Successful',
+        }
+
+    def edl(self, query):
+        name = query.get('name')
+        ipaddr = query.get('ipaddr')
+        if name is None and ipaddr is None:
+            raise _Error(400, "'name' or 'ipaddr' should be provided")
+        if query.get('listformat') not in (None, 'array'):
+            raise _Error(400, 'listformat: Value is invalid.')
+        if ipaddr is not None:
+            return self.edl_ipaddr(ipaddr, query)
+        if not name.strip():
+            raise _Error(400, 'name: This field may not be blank.')
+        if name not in EDL_NAMES:
+            raise _Error(400, 'name: Value is invalid.')
+
+        return self.server.edl_page(tuple(sorted(query.items())))
+
+    def edl_ipaddr(self, ipaddr, query):
+        if not re.search(r'^[0-9a-fA-F.:/]+$', ipaddr):
+            raise _Error(400, 'ipaddr: Value is invalid.')
+        if 'version' in query:
+            versions = [_edl_version(query)]
+        else:
+            versions = range(EDL_VERSION, EDL_VERSION - EDL_VERSIONS, -1)
+        offset, limit = _paging(query)
+
+        items = []
+        for version in versions:
+            for name in EDL_NAMES:
+                if ipaddr in self.dataset().edl_set(name, version):
+                    items.append({
+                        'ipaddr': ipaddr,
+                        'name': name,
+                        'version': str(version),
+                    })
+        if not items:
+            raise _Error(404, 'Not Found')
+
+        return {
+            'success': True,
+            'count': len(items),
+            'data': items[offset:offset + limit],
+            'message': 'Successful',
+        }
+
+    def atp_reports(self, obj):
+        ids = obj.get('id')
+        if ids is None:
+            raise _Error(400, 'id: This field is required.')
+        if not isinstance(ids, list):
+            raise _Error(400, 'id: Expected a list of items but got type '
+                         '"%s".' % type(ids).__name__)
+        if len(ids) > MAX_ITEMS:
+            raise _Error(400, 'id: Ensure this field has no more than '
+                         '%d elements.' % MAX_ITEMS)
+        for x in ids:
+            if not _report_id(x):
+                raise _Error(400, 'id: Value is invalid.')
+
+        # report IDs ending in an even hex digit exist
+        data = [{
+            'report_id': x,
+            'session_time': _time(RELEASE_TIME),
+            'detection': 'Mock Advanced Threat Prevention detection',
+            'category': 'spyware',
+        } for x in ids if int(x[-1], 16) % 2 == 0]
+        if not data:
+            raise _Error(404, 'Not Found')
+
+        return {
+            'success': True,
+            'count': len(data),
+            'data': data,
+            'message': 'Successful',
+        }
+
+    def atp_reports_pcaps(self, query):
+        id_ = query.get('id')
+        if id_ is None:
+            raise _Error(400, 'id: This field is required.')
+        if not _report_id(id_):
+            raise _Error(400, 'id: Value is invalid.')
+        if int(id_[-1], 16) % 2:
+            raise _Error(404, 'Not Found')
+
+        # empty pcap file: global header only
+        pcap = struct.pack('<IHHiIII', 0xa1b2c3d4, 2, 4, 0, 0, 65535, 1)
+
+        return 'application/octet-stream', pcap
+
+
+def _paging(query):
+    try:
+        offset = int(query.get('offset', 0))
+        if offset < 0:
+            raise ValueError
+    except ValueError:
+        raise _Error(400, 'offset: Value is invalid.')
+    try:
+        limit = int(query.get('limit', MAX_LIMIT))
+        if limit < 1:
+            raise ValueError
+    except ValueError:
+        raise _Error(400, 'limit: Value is invalid.')
+    if limit > MAX_LIMIT:
+        raise _Error(400, 'limit: Ensure this value is less than '
+                     'or equal to %d.' % MAX_LIMIT)
+
+    return offset, limit
+
+
+def _edl_version(query):
+    version = query.get('version')
+    if version is None or version == 'latest':
+        return EDL_VERSION
+    try:
+        version = int(version)
+    except ValueError:
+        raise _Error(400, 'version: Value is invalid.')
+    if not EDL_VERSION - EDL_VERSIONS < version <= EDL_VERSION:
+        raise _Error(404, 'Not Found')
+
+    return version
+
+
+def _report_id(x):
+    return isinstance(x, str) and re.search(r'^[0-9a-fA-F]+$', x)
+
+
+class _HTTPServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, address, options):
+        super().__init__(address, Handler)
+        self.options = options
+        self.dataset = Dataset(options['count'])
+        self.rate_limit = RateLimit(limit=options['rate_limit'],
+                                    day_limit=options['day_limit'],
+                                    window=options['window'])
+        self.stats_lock = threading.Lock()
+        self.stats = collections.Counter()
+
+    def count_response(self, method, path, status):
+        with self.stats_lock:
+            self.stats[(method, path, status)] += 1
+
+    # Encoded pages are cached so the server is not the bottleneck
+    # when measuring client throughput.
+    @functools.lru_cache(maxsize=4096)
+    def threats_page(self, query):
+        query = dict(query)
+        types = self.dataset.threat_types(query.get('type'))
+        if types is None:
+            raise _Error(400, 'type: Value is invalid.')
+        offset, limit = _paging(query)
+
+        filters = []
+        if 'id' in query:
+            filters.append(lambda x: x['id'] == query['id'])
+        if 'name' in query:
+            words = re.findall(r'\w+', query['name'].lower())
+            filters.append(lambda x: all(w in x['name'].lower()
+                                         for w in words))
+        if 'cve' in query:
+            cve = query['cve'].upper()
+            filters.append(lambda x: any(y == cve or
+                                         y.startswith(cve + '-')
+                                         for y in x.get('cve', [])))
+        for k in ('sha256', 'md5'):
+            if k in query:
+                v = query[k].lower()
+                filters.append(lambda x, k=k, v=v: x.get(k) == v)
+        for k, op in (('fromReleaseVersion', int.__ge__),
+                      ('toReleaseVersion', int.__le__),
+                      ('releaseVersion', int.__eq__)):
+            if k in query:
+                try:
+                    v = int(query[k])
+                except ValueError:
+                    raise _Error(400, '%s: Value is invalid.' % k)
+                filters.append(
+                    lambda x, op=op, v=v:
+                    op(int(x['latest_release_version']), v))
+        for k, op in (('fromReleaseDate', str.__ge__),
+                      ('toReleaseDate', str.__le__),
+                      ('releaseDate', str.__eq__)):
+            if k in query:
+                if not re.search(r'^\d{4}-\d{2}-\d{2}$', query[k]):
+                    raise _Error(400, '%s: Value is invalid.' % k)
+                filters.append(
+                    lambda x, op=op, v=query[k]:
+                    op(x['latest_release_time'][:10], v))
+
+        if 'id' in query:
+            # indexed lookup
+            candidates = [self.dataset.by_id[query['id']]] \
+                if query['id'] in self.dataset.by_id else []
+        else:
+            candidates = ((t, x) for t in types
+                          for x in self.dataset.threats[t])
+        matches = [(t, x) for t, x in candidates
+                   if t in types and all(f(x) for f in filters)]
+        if not matches:
+            raise _Error(404, 'Not Found')
+
+        data = {}
+        for t, x in matches[offset:offset + limit]:
+            data.setdefault(t, []).append(x)
+
+        return json.dumps({
+            'success': True,
+            'link': {'next': None, 'previous': None},
+            'count': len(matches),
+            'data': data,
+            'message': 'Successful',
+        }).encode()
+
+    @functools.lru_cache(maxsize=4096)
+    def edl_page(self, query):
+        query = dict(query)
+        version = _edl_version(query)
+        offset, limit = _paging(query)
+        items = self.dataset.edl(query['name'], version)
+        page = items[offset:offset + limit]
+
+        if query.get('listformat') == 'array':
+            data = {'ipaddr': page}
+        else:
+            data = [{'ipaddr': x, 'version': str(version)} for x in page]
+
+        return json.dumps({
+            'success': True,
+            'count': len(items),
+            'data': data,
+            'message': 'Successful',
+        }).encode()
+
+
+class MockServer:
+    def __init__(self, *,
+                 host='127.0.0.1',
+                 port=0,
+                 count=5000,
+                 latency=0,
+                 jitter=0,
+                 rate_limit=None,
+                 day_limit=None,
+                 window=60,
+                 error_rate=0,
+                 verbose=False):
+        options = {
+            'count': count,
+            'latency': latency,
+            'jitter': jitter,
+            'rate_limit': rate_limit,
+            'day_limit': day_limit,
+            'window': window,
+            'error_rate': error_rate,
+            'verbose': verbose,
+        }
+        self.httpd = _HTTPServer((host, port), options)
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return 'http://%s:%d' % (host, port)
+
+    @property
+    def stats(self):
+        # (method, path, status): count
+        with self.httpd.stats_lock:
+            return collections.Counter(self.httpd.stats)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever,
+                                       name='mockserver', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        if self.thread is not None:
+            self.thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+
+def main():
+    options = parse_opts()
+    try:
+        server = MockServer(**options)
+    except OSError as e:
+        print('%s: %s' % (options['port'], e), file=sys.stderr)
+        sys.exit(1)
+    print(server.url, flush=True)
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+
+
+def parse_opts():
+    options = {
+        'host': '127.0.0.1',
+        'port': 8080,
+        'count': 5000,
+        'latency': 0,
+        'jitter': 0,
+        'rate_limit': None,
+        'day_limit': None,
+        'window': 60,
+        'error_rate': 0,
+        'verbose': False,
+    }
+
+    short_options = 'v'
+    long_options = ['help', 'host=', 'port=', 'count=',
+                    'latency=', 'jitter=', 'rate-limit=', 'day-limit=',
+                    'window=', 'error-rate=']
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:],
+                                   short_options,
+                                   long_options)
+    except getopt.GetoptError as error:
+        print(error, file=sys.stderr)
+        sys.exit(1)
+
+    for opt, arg in opts:
+        try:
+            if opt == '--host':
+                options['host'] = arg
+            elif opt == '--port':
+                options['port'] = int(arg)
+            elif opt == '--count':
+                options['count'] = int(arg)
+            elif opt == '--latency':
+                options['latency'] = float(arg) / 1000
+            elif opt == '--jitter':
+                options['jitter'] = float(arg) / 1000
+            elif opt == '--rate-limit':
+                options['rate_limit'] = int(arg)
+            elif opt == '--day-limit':
+                options['day_limit'] = int(arg)
+            elif opt == '--window':
+                options['window'] = int(arg)
+            elif opt == '--error-rate':
+                options['error_rate'] = float(arg)
+            elif opt == '-v':
+                options['verbose'] = True
+            elif opt == '--help':
+                usage()
+                sys.exit(0)
+            else:
+                assert False, 'unhandled option %s' % opt
+        except ValueError as e:
+            print('Invalid %s: %s' % (opt, e), file=sys.stderr)
+            sys.exit(1)
+
+    return options
+
+
+def usage():
+    usage = '''%s [options]
+    --host host                listen address (default 127.0.0.1)
+    --port port                listen port (default 8080, 0 for any)
+    --count num                threats per type, EDL size (default 5000)
+    --latency ms               response latency
+    --jitter ms                additional random latency (0-ms)
+    --rate-limit num           requests per window (default no limit)
+    --day-limit num            requests per day (default no limit)
+    --window sec               rate limit window (default 60)
+    --error-rate fraction      random HTTP 429 responses (0-1)
+    -v                         log requests
+    --help                     display usage
+'''
+    print(usage % os.path.basename(sys.argv[0]), end='')
+
+
+if __name__ == '__main__':
+    main()
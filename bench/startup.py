@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+
+#
+# Copyright (c) 2022 Palo Alto Networks, Inc.
+#
+# Permission to use, copy, modify, and distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+#
+
+import getopt
+import json
+import os
+import platform
+import re
+import statistics
+import subprocess
+import sys
+import time
+
+libpath = os.path.dirname(os.path.abspath(__file__))
+toppath = os.path.join(libpath, os.pardir)
+sys.path[:0] = [toppath]
+
+import pantv  # noqa: E402
+from mockserver import MockServer  # noqa: E402
+
+TVAPI = os.path.join(toppath, 'bin', 'tvapi.py')
+
+CONSTRUCT_SYNC = '''
+import time
+t = time.perf_counter()
+import pantv
+api = pantv.ThreatVaultApi(api_key='x')
+print(time.perf_counter() - t)
+api.session.close()
+'''
+
+CONSTRUCT_AIO = '''
+import time
+t = time.perf_counter()
+import asyncio
+import pantv
+
+
+async def main():
+    api = pantv.ThreatVaultApi(api_key='x')
+    print(time.perf_counter() - t)
+    await api.session.close()
+
+asyncio.run(main())
+'''
+
+
+def benchmarks(url):
+    # name: (argv, how the in-process time is measured)
+    return {
+        'python': (['-c', 'pass'], None),
+        'import_pantv': (['-X', 'importtime', '-c', 'import pantv'],
+                         'importtime:pantv'),
+        'import_v1api': (['-X', 'importtime', '-c', 'import pantv.v1api'],
+                         'importtime:pantv.v1api'),
+        'import_v1aioapi': (['-X', 'importtime', '-c',
+                             'import pantv.v1aioapi'],
+                            'importtime:pantv.v1aioapi'),
+        'construct_sync': (['-c', CONSTRUCT_SYNC], 'stdout'),
+        'construct_aio': (['-c', CONSTRUCT_AIO], 'stdout'),
+        'tvapi_threats_aio': ([TVAPI, '--url', url, '--api-key', 'x',
+                               '--threats', '--id', '3000001'], None),
+        'tvapi_threats_noaio': ([TVAPI, '--url', url, '--api-key', 'x',
+                                 '--threats', '--id', '3000001',
+                                 '--noaio'], None),
+    }
+
+
+def run(python, argv, measure):
+    env = dict(os.environ, PYTHONPATH=toppath)
+    env.pop('PYTHONSTARTUP', None)
+
+    t = time.perf_counter()
+    proc = subprocess.run([python] + argv, env=env,
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                          text=True)
+    wall = time.perf_counter() - t
+    if proc.returncode != 0:
+        raise RuntimeError('%s: exit %d: %s' % (' '.join(argv[:2]),
+                                                proc.returncode,
+                                                proc.stderr.strip()))
+
+    if measure is None:
+        return wall, None
+    if measure == 'stdout':
+        return wall, float(proc.stdout.split()[0])
+
+    # import time: self [us] | cumulative | imported package
+    module = measure.split(':', 1)[1]
+    for line in proc.stderr.splitlines():
+        r = re.search(r'^import time:\s+\d+ \|\s+(\d+) \| (\s*)(\S+)$',
+                      line)
+        if r is not None and r.group(3) == module and not r.group(2):
+            return wall, int(r.group(1)) / 1e6
+
+    raise RuntimeError('%s: no import time for %s' % (measure, module))
+
+
+def stats(samples):
+    return {
+        'samples': samples,
+        'min': min(samples),
+        'median': statistics.median(samples),
+        'mean': statistics.mean(samples),
+        'max': max(samples),
+    }
+
+
+def bench(options):
+    results = {}
+    with MockServer(count=100) as server:
+        all_ = benchmarks(server.url)
+        names = options['benchmarks'] or list(all_)
+        for name in names:
+            if name not in all_:
+                print('Invalid benchmark: %s' % name, file=sys.stderr)
+                sys.exit(1)
+            argv, measure = all_[name]
+
+            # warm the filesystem and bytecode caches
+            run(options['python'], argv, measure)
+
+            wall = []
+            self_ = []
+            for i in range(options['repeat']):
+                x, y = run(options['python'], argv, measure)
+                wall.append(x)
+                if y is not None:
+                    self_.append(y)
+
+            results[name] = {'wall': stats(wall)}
+            if self_:
+                results[name]['self'] = stats(self_)
+            print('%-22s wall %8.2fms' % (name,
+                                          results[name]['wall']['median'] *
+                                          1000),
+                  end='', file=sys.stderr)
+            if self_:
+                print('  self %8.2fms' % (results[name]['self']['median'] *
+                                          1000),
+                      end='', file=sys.stderr)
+            print(file=sys.stderr)
+
+    return {
+        'meta': {
+            'benchmark': 'startup',
+            'time': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'pantv': pantv.__version__,
+            'python': sys.version.split()[0],
+            'implementation': platform.python_implementation(),
+            'platform': platform.platform(),
+            'repeat': options['repeat'],
+        },
+        'results': results,
+    }
+
+
+def compare(baseline, current, threshold):
+    regressions = 0
+    for name, x in current['results'].items():
+        if name not in baseline['results']:
+            continue
+        y = baseline['results'][name]
+        # compare in-process time when available, it has less noise
+        key = 'self' if 'self' in x and 'self' in y else 'wall'
+        old = y[key]['median']
+        new = x[key]['median']
+        change = (new - old) / old * 100 if old else 0
+        flag = ''
+        if change > threshold:
+            flag = ' REGRESSION'
+            regressions += 1
+        print('%-22s %-4s %8.2fms -> %8.2fms %+7.1f%%%s' % (
+            name, key, old * 1000, new * 1000, change, flag))
+
+    return regressions
+
+
+def main():
+    options = parse_opts()
+
+    result = bench(options)
+    x = json.dumps(result, indent=4)
+    if options['output'] is None:
+        print(x)
+    else:
+        try:
+            with open(options['output'], 'w') as f:
+                f.write(x + '\n')
+        except OSError as e:
+            print('%s: %s' % (options['output'], e), file=sys.stderr)
+            sys.exit(1)
+
+    if options['compare'] is not None:
+        try:
+            with open(options['compare']) as f:
+                baseline = json.load(f)
+        except (OSError, ValueError) as e:
+            print('%s: %s' % (options['compare'], e), file=sys.stderr)
+            sys.exit(1)
+        if compare(baseline, result, options['threshold']):
+            sys.exit(1)
+
+
+def parse_opts():
+    options = {
+        'repeat': 10,
+        'benchmarks': [],
+        'output': None,
+        'compare': None,
+        'threshold': 10.0,
+        'python': sys.executable,
+    }
+
+    short_options = 'n:o:'
+    long_options = ['help', 'benchmark=', 'compare=', 'threshold=',
+                    'python=', 'list']
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:],
+                                   short_options,
+                                   long_options)
+    except getopt.GetoptError as error:
+        print(error, file=sys.stderr)
+        sys.exit(1)
+
+    for opt, arg in opts:
+        if opt == '-n':
+            try:
+                options['repeat'] = int(arg)
+                if options['repeat'] < 1:
+                    raise ValueError
+            except ValueError:
+                print('Invalid repeat:', arg, file=sys.stderr)
+                sys.exit(1)
+        elif opt == '-o':
+            options['output'] = arg
+        elif opt == '--benchmark':
+            options['benchmarks'].append(arg)
+        elif opt == '--compare':
+            options['compare'] = arg
+        elif opt == '--threshold':
+            try:
+                options['threshold'] = float(arg)
+            except ValueError:
+                print('Invalid threshold:', arg, file=sys.stderr)
+                sys.exit(1)
+        elif opt == '--python':
+            options['python'] = arg
+        elif opt == '--list':
+            for x in benchmarks(''):
+                print(x)
+            sys.exit(0)
+        elif opt == '--help':
+            usage()
+            sys.exit(0)
+        else:
+            assert False, 'unhandled option %s' % opt
+
+    return options
+
+
+def usage():
+    usage = '''%s [options]
+    -n num                     repetitions per benchmark (default 10)
+    -o path                    write JSON results to path (default stdout)
+    --benchmark name           run benchmark (multiple allowed, default all)
+    --list                     list benchmarks
+    --compare path             compare to JSON results in path
+    --threshold percent        regression threshold (default 10)
+    --python path              Python interpreter to benchmark
+    --help                     display usage
+'''
+    print(usage % os.path.basename(sys.argv[0]), end='')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,463 @@
+#!/usr/bin/env python3
+
+#
+# Copyright (c) 2022 Palo Alto Networks, Inc.
+#
+# Permission to use, copy, modify, and distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+#
+
+import getopt
+import itertools
+import json
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import threading
+import time
+
+libpath = os.path.dirname(os.path.abspath(__file__))
+toppath = os.path.join(libpath, os.pardir)
+sys.path[:0] = [toppath]
+
+import pantv  # noqa: E402
+
+MOCKSERVER = os.path.join(libpath, 'mockserver.py')
+EDL_NAME = 'panw-known-ip-list'
+
+
+class Timer:
+    # Sum of elapsed times, from multiple threads for concurrent
+    # requests.
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.total = 0
+
+    def add(self, t):
+        with self.lock:
+            self.total += t
+
+
+def instrument(api, aio, stream, endpoint, request, decode):
+    # Wrap the page request and the JSON decode of the page; the
+    # _all() generators call the instance attributes.
+    from pantv import jsonstream
+
+    def timed_json(resp):
+        json_ = resp.json
+        if aio:
+            async def f(*args, **kwargs):
+                t = time.perf_counter()
+                x = await json_(*args, **kwargs)
+                decode.add(time.perf_counter() - t)
+                return x
+        else:
+            def f(*args, **kwargs):
+                t = time.perf_counter()
+                x = json_(*args, **kwargs)
+                decode.add(time.perf_counter() - t)
+                return x
+        resp.json = f
+
+    func = getattr(api, endpoint)
+    if aio:
+        async def wrapper(**kwargs):
+            t = time.perf_counter()
+            resp = await func(**kwargs)
+            if not stream:
+                # so decode is not also waiting for the body
+                await resp.read()
+            request.add(time.perf_counter() - t)
+            timed_json(resp)
+            return resp
+    else:
+        def wrapper(**kwargs):
+            t = time.perf_counter()
+            resp = func(**kwargs)
+            request.add(time.perf_counter() - t)
+            timed_json(resp)
+            return resp
+    setattr(api, endpoint, wrapper)
+
+    class PageParser(jsonstream.PageParser):
+        def feed(self, data):
+            t = time.perf_counter()
+            x = super().feed(data)
+            decode.add(time.perf_counter() - t)
+            return x
+
+        def close(self):
+            t = time.perf_counter()
+            x = super().close()
+            decode.add(time.perf_counter() - t)
+            return x
+
+    jsonstream.PageParser = PageParser
+
+
+def run_case(case):
+    # Runs in a new interpreter process so peak RSS is per case.
+    aio = case['backend'] == 'aio'
+    request = Timer()
+    decode = Timer()
+    kwargs = {
+        'limit': case['limit'],
+        'concurrency': case['concurrency'],
+        'stream': case['stream'],
+        'retry': True,
+    }
+    if case['endpoint'] == 'edl':
+        kwargs['name'] = EDL_NAME
+    result = {}
+
+    def start():
+        result['start'] = time.perf_counter()
+        result['records'] = 0
+
+    def record(ok, x):
+        if not ok:
+            raise RuntimeError('HTTP %s' % (x.status if aio
+                                            else x.status_code))
+        if not result['records']:
+            result['ttfr'] = time.perf_counter() - result['start']
+        result['records'] += 1
+
+    if aio:
+        import asyncio
+
+        async def main():
+            async with pantv.ThreatVaultApi(url=case['url'],
+                                            api_key='x') as api:
+                instrument(api, aio, case['stream'], case['endpoint'],
+                           request, decode)
+                func = getattr(api, case['endpoint'] + '_all')
+                start()
+                async for ok, x in func(**kwargs):
+                    record(ok, x)
+                result['wall'] = time.perf_counter() - result['start']
+
+        asyncio.run(main())
+    else:
+        with pantv.ThreatVaultApi(url=case['url'], api_key='x') as api:
+            instrument(api, aio, case['stream'], case['endpoint'],
+                       request, decode)
+            func = getattr(api, case['endpoint'] + '_all')
+            start()
+            for ok, x in func(**kwargs):
+                record(ok, x)
+            result['wall'] = time.perf_counter() - result['start']
+
+    wall = result['wall']
+    x = {
+        'records': result['records'],
+        'wall': wall,
+        'records_s': result['records'] / wall,
+        'ttfr': result['ttfr'],
+        # Linux: kilobytes
+        'peak_rss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+        'request': request.total,
+        'decode': decode.total,
+    }
+    if case['concurrency'] == 1:
+        # time in the generators not waiting for a page or decoding;
+        # includes reading a streamed body
+        x['other'] = max(wall - request.total - decode.total, 0)
+
+    return x
+
+
+def cases(options, url):
+    x = {}
+    for backend, endpoint, limit, concurrency in itertools.product(
+            options['backends'], options['endpoints'], options['limits'],
+            options['concurrency']):
+        name = '%s_%s_l%d_c%d' % (endpoint, backend, limit, concurrency)
+        if options['stream']:
+            name += '_stream'
+        x[name] = {
+            'url': url,
+            'backend': backend,
+            'endpoint': endpoint,
+            'limit': limit,
+            'concurrency': concurrency,
+            'stream': options['stream'],
+        }
+
+    return x
+
+
+def run(python, case):
+    env = dict(os.environ, PYTHONPATH=toppath)
+    proc = subprocess.run([python, os.path.abspath(__file__),
+                           '--case', json.dumps(case)], env=env,
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                          text=True)
+    if proc.returncode != 0:
+        raise RuntimeError('exit %d: %s' % (proc.returncode,
+                                            proc.stderr.strip()))
+
+    return json.loads(proc.stdout)
+
+
+def stats(samples):
+    return {
+        'samples': samples,
+        'min': min(samples),
+        'median': statistics.median(samples),
+        'mean': statistics.mean(samples),
+        'max': max(samples),
+    }
+
+
+class Server:
+    # mock server in a separate process so it does not compete with
+    # the client for the GIL
+    def __init__(self, python, count, latency):
+        argv = [python, MOCKSERVER, '--port', '0', '--count', str(count),
+                '--latency', str(latency)]
+        self.proc = subprocess.Popen(argv, stdout=subprocess.PIPE,
+                                     text=True)
+        self.url = self.proc.stdout.readline().strip()
+        if not self.url:
+            self.proc.wait()
+            raise RuntimeError('mockserver exit %d' % self.proc.returncode)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.proc.terminate()
+        self.proc.wait()
+
+
+def bench(options):
+    results = {}
+    with Server(options['python'], options['count'],
+                options['latency']) as server:
+        for name, case in cases(options, server.url).items():
+            # warm the server page cache
+            run(options['python'], case)
+
+            samples = [run(options['python'], case)
+                       for i in range(options['repeat'])]
+            results[name] = {'records': samples[0]['records']}
+            for k in ('records_s', 'ttfr', 'peak_rss', 'wall',
+                      'request', 'decode', 'other'):
+                if k in samples[0]:
+                    results[name][k] = stats([x[k] for x in samples])
+
+            x = results[name]
+            print('%-28s %9.0f rec/s  ttfr %7.2fms  rss %6.1fMB  '
+                  'request %6.3fs  decode %6.3fs' % (
+                      name, x['records_s']['median'],
+                      x['ttfr']['median'] * 1000,
+                      x['peak_rss']['median'] / 2**20,
+                      x['request']['median'], x['decode']['median']),
+                  end='', file=sys.stderr)
+            if 'other' in x:
+                print('  other %6.3fs' % x['other']['median'],
+                      end='', file=sys.stderr)
+            print(file=sys.stderr)
+
+    return {
+        'meta': {
+            'benchmark': 'throughput',
+            'time': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'pantv': pantv.__version__,
+            'python': sys.version.split()[0],
+            'implementation': platform.python_implementation(),
+            'platform': platform.platform(),
+            'repeat': options['repeat'],
+            'count': options['count'],
+            'latency': options['latency'],
+        },
+        'results': results,
+    }
+
+
+def compare(baseline, current, threshold):
+    regressions = 0
+    for name, x in current['results'].items():
+        if name not in baseline['results']:
+            continue
+        old = baseline['results'][name]['records_s']['median']
+        new = x['records_s']['median']
+        change = (new - old) / old * 100 if old else 0
+        flag = ''
+        if -change > threshold:
+            flag = ' REGRESSION'
+            regressions += 1
+        print('%-28s %9.0f -> %9.0f rec/s %+7.1f%%%s' % (
+            name, old, new, change, flag))
+
+    return regressions
+
+
+def main():
+    options = parse_opts()
+
+    if options['case'] is not None:
+        print(json.dumps(run_case(options['case'])))
+        sys.exit(0)
+
+    result = bench(options)
+    x = json.dumps(result, indent=4)
+    if options['output'] is None:
+        print(x)
+    else:
+        try:
+            with open(options['output'], 'w') as f:
+                f.write(x + '\n')
+        except OSError as e:
+            print('%s: %s' % (options['output'], e), file=sys.stderr)
+            sys.exit(1)
+
+    if options['compare'] is not None:
+        try:
+            with open(options['compare']) as f:
+                baseline = json.load(f)
+        except (OSError, ValueError) as e:
+            print('%s: %s' % (options['compare'], e), file=sys.stderr)
+            sys.exit(1)
+        if compare(baseline, result, options['threshold']):
+            sys.exit(1)
+
+
+def parse_opts():
+    options = {
+        'repeat': 3,
+        'count': 20000,
+        'latency': 0,
+        'backends': [],
+        'endpoints': [],
+        'limits': [],
+        'concurrency': [],
+        'stream': False,
+        'output': None,
+        'compare': None,
+        'threshold': 10.0,
+        'python': sys.executable,
+        'case': None,
+    }
+
+    short_options = 'n:o:'
+    long_options = ['help', 'count=', 'latency=', 'backend=',
+                    'endpoint=', 'limit=', 'concurrency=', 'stream',
+                    'compare=', 'threshold=', 'python=', 'case=']
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:],
+                                   short_options,
+                                   long_options)
+    except getopt.GetoptError as error:
+        print(error, file=sys.stderr)
+        sys.exit(1)
+
+    def positive(opt, arg):
+        try:
+            x = int(arg)
+            if x < 1:
+                raise ValueError
+        except ValueError:
+            print('Invalid %s: %s' % (opt, arg), file=sys.stderr)
+            sys.exit(1)
+        return x
+
+    for opt, arg in opts:
+        if opt == '-n':
+            options['repeat'] = positive(opt, arg)
+        elif opt == '-o':
+            options['output'] = arg
+        elif opt == '--count':
+            options['count'] = positive(opt, arg)
+        elif opt == '--latency':
+            try:
+                options['latency'] = float(arg)
+            except ValueError:
+                print('Invalid latency:', arg, file=sys.stderr)
+                sys.exit(1)
+        elif opt == '--backend':
+            if arg not in ('sync', 'aio'):
+                print('Invalid backend:', arg, file=sys.stderr)
+                sys.exit(1)
+            options['backends'].append(arg)
+        elif opt == '--endpoint':
+            if arg not in ('threats', 'edl'):
+                print('Invalid endpoint:', arg, file=sys.stderr)
+                sys.exit(1)
+            options['endpoints'].append(arg)
+        elif opt == '--limit':
+            x = positive(opt, arg)
+            if x > 1000:
+                print('Invalid limit:', arg, file=sys.stderr)
+                sys.exit(1)
+            options['limits'].append(x)
+        elif opt == '--concurrency':
+            options['concurrency'].append(positive(opt, arg))
+        elif opt == '--stream':
+            options['stream'] = True
+        elif opt == '--compare':
+            options['compare'] = arg
+        elif opt == '--threshold':
+            try:
+                options['threshold'] = float(arg)
+            except ValueError:
+                print('Invalid threshold:', arg, file=sys.stderr)
+                sys.exit(1)
+        elif opt == '--python':
+            options['python'] = arg
+        elif opt == '--case':
+            options['case'] = json.loads(arg)
+        elif opt == '--help':
+            usage()
+            sys.exit(0)
+        else:
+            assert False, 'unhandled option %s' % opt
+
+    for k, v in (('backends', ['sync', 'aio']),
+                 ('endpoints', ['threats', 'edl']),
+                 ('limits', [100, 1000]),
+                 ('concurrency', [1, 4])):
+        if not options[k]:
+            options[k] = v
+
+    return options
+
+
+def usage():
+    usage = '''%s [options]
+    -n num                     repetitions per case (default 3)
+    -o path                    write JSON results to path (default stdout)
+    --count num                mock server threats per type and EDL size
+                               (default 20000)
+    --latency ms               mock server response latency
+    --backend sync|aio         backend (multiple allowed, default both)
+    --endpoint threats|edl     threats_all() or edl_all() (multiple
+                               allowed, default both)
+    --limit num                page size (multiple allowed,
+                               default 100 and 1000)
+    --concurrency num          concurrent page requests (multiple
+                               allowed, default 1 and 4)
+    --stream                   incremental page parsing
+    --compare path             compare to JSON results in path
+    --threshold percent        regression threshold (default 10)
+    --python path              Python interpreter to benchmark
+    --help                     display usage
+'''
+    print(usage % os.path.basename(sys.argv[0]), end='')
+
+
+if __name__ == '__main__':
+    main()
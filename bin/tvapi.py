@@ -16,21 +16,13 @@
 # OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
 #
 
-import asyncio
-import copy
+# modules only needed for some options are imported on use
 import getopt
 import json
 import logging
 import os
-import pprint
 import sys
 import time
-import traceback
-try:
-    import jmespath
-    have_jmespath = True
-except ImportError:
-    have_jmespath = False
 
 libpath = os.path.dirname(os.path.abspath(__file__))
 sys.path[:0] = [os.path.join(libpath, os.pardir)]
@@ -81,13 +73,25 @@ def main():
             k = x.replace('-', '_')
             kwargs[k] = options[x]
 
+    if options['cache'] is not None:
+        from pantv.cache import DiskCache
+        try:
+            kwargs['cache'] = DiskCache(options['cache'])
+        except ArgsError as e:
+            print('DiskCache: %s' % e, file=sys.stderr)
+            sys.exit(1)
+
     try:
         if options['aio']:
+            import asyncio
             asyncio.run(aioapi_request(kwargs, options))
         else:
             api_request(kwargs, options)
     except KeyboardInterrupt:
         sys.exit(0)
+    finally:
+        if 'cache' in kwargs:
+            kwargs['cache'].close()
 
 
 def print_exception(exc, debug):
@@ -96,16 +100,27 @@ def print_exception(exc, debug):
         limit = -1
     elif debug > 1:
         limit = None
+    import traceback
     x = traceback.format_exception(None, exc, exc.__traceback__, limit=limit)
     print(''.join(x), end='', file=sys.stderr)
     sys.exit(1)
 
 
+def broken_pipe():
+    # stdout closed by reader (e.g., -N | head); avoid a second
+    # BrokenPipeError when the interpreter flushes stdout at exit
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(devnull, sys.stdout.fileno())
+    sys.exit(1)
+
+
 def api_request(kwargs, options):
     try:
         with ThreatVaultApi(**kwargs) as api:
             request(api, options)
 
+    except BrokenPipeError:
+        broken_pipe()
     except Exception as e:
         print_exception(e, options['debug'])
 
@@ -115,6 +130,8 @@ async def aioapi_request(kwargs, options):
         async with ThreatVaultApi(**kwargs) as api:
             await aiorequest(api, options)
 
+    except BrokenPipeError:
+        broken_pipe()
     except Exception as e:
         print_exception(e, options['debug'])
 
@@ -162,6 +179,8 @@ def request(api, options):
         if options['all'] and options['opt_json']:
             # only allowed with noaio
             kwargs['retry'] = True
+            kwargs['concurrency'] = options['concurrency']
+            kwargs['stream'] = True
             threats = GeneratorList(generator=api.threats_all, **kwargs)
             for x in json.JSONEncoder().iterencode(threats):
                 if options['print_json']:
@@ -170,14 +189,21 @@ def request(api, options):
 
         elif options['all']:
             obj = {'data': []}
-            for ok, x in api.threats_all(retry=True, **kwargs):
-                if ok:
+            for ok, x in api.threats_all(
+                    retry=True,
+                    concurrency=options['concurrency'],
+                    stream=options['ndjson'],
+                    **kwargs):
+                if ok and options['ndjson']:
+                    print_ndjson(options, x)
+                elif ok:
                     obj['data'].append(x)
                 else:
                     print_status('threats_all', x)
                     print_response(options, x)
                     x.raise_for_status()
-            print_json_response(options, obj)
+            if not options['ndjson']:
+                print_json_response(options, obj)
 
         else:
             resp = api.threats(**kwargs)
@@ -185,6 +211,22 @@ def request(api, options):
             print_response(options, resp)
             resp.raise_for_status()
 
+    elif options['threats2'] and options['all']:
+        obj = api.threats2_bulk(
+            type=options['type'],
+            id=options['id'],
+            name=options['name'],
+            sha256=options['sha256'],
+            md5=options['md5'],
+            concurrency=options['concurrency'],
+            query_string=options['query_string_obj'],
+            retry=True)
+        if options['ndjson']:
+            for k, v in obj.items():
+                print_ndjson(options, {'value': k, 'data': v})
+        else:
+            print_json_response(options, {'data': obj})
+
     elif options['threats2']:
         resp = api.threats2(
             type=options['type'],
@@ -232,9 +274,30 @@ def request(api, options):
             'query_string': options['query_string_obj'],
         }
 
-        if options['all'] and options['opt_json']:
+        if options['all'] and len(options['name'] or []) > 1:
+            results = api.edl_multi(
+                names=options['name'],
+                version=options['content-version'],
+                page_concurrency=options['concurrency'],
+                query_string=options['query_string_obj'],
+                retry=True)
+            print_edl_multi(options, results)
+
+        elif options['all'] and options['dst'] is not None:
+            from pantv.edl import EdlWriter
+            writer = EdlWriter(edl_path(name, options['dst']),
+                               collapse=options['collapse'])
+            x = writer.export(api,
+                              name=name,
+                              version=options['content-version'],
+                              concurrency=options['concurrency'])
+            print_edl_file(x)
+
+        elif options['all'] and options['opt_json']:
             # only allowed with noaio
             kwargs['retry'] = True
+            kwargs['concurrency'] = options['concurrency']
+            kwargs['stream'] = True
             edl = GeneratorList(generator=api.edl_all, **kwargs)
             for x in json.JSONEncoder().iterencode(edl):
                 if options['print_json']:
@@ -243,14 +306,21 @@ def request(api, options):
 
         elif options['all']:
             obj = {'data': []}
-            for ok, x in api.edl_all(retry=True, **kwargs):
-                if ok:
+            for ok, x in api.edl_all(
+                    retry=True,
+                    concurrency=options['concurrency'],
+                    stream=options['ndjson'],
+                    **kwargs):
+                if ok and options['ndjson']:
+                    print_ndjson(options, x)
+                elif ok:
                     obj['data'].append(x)
                 else:
                     print_status('edl_all', x)
                     print_response(options, x)
                     x.raise_for_status()
-            print_json_response(options, obj)
+            if not options['ndjson']:
+                print_json_response(options, obj)
 
         else:
             resp = api.edl(**kwargs)
@@ -298,14 +368,21 @@ async def aiorequest(api, options):
 
         if options['all']:
             obj = {'data': []}
-            async for ok, x in api.threats_all(retry=True, **kwargs):
-                if ok:
+            async for ok, x in api.threats_all(
+                    retry=True,
+                    concurrency=options['concurrency'],
+                    stream=options['ndjson'],
+                    **kwargs):
+                if ok and options['ndjson']:
+                    print_ndjson(options, x)
+                elif ok:
                     obj['data'].append(x)
                 else:
                     print_status('threats_all', x)
                     await aioprint_response(options, x)
                     x.raise_for_status()
-            print_json_response(options, obj)
+            if not options['ndjson']:
+                print_json_response(options, obj)
 
         else:
             resp = await api.threats(**kwargs)
@@ -313,6 +390,22 @@ async def aiorequest(api, options):
             await aioprint_response(options, resp)
             resp.raise_for_status()
 
+    elif options['threats2'] and options['all']:
+        obj = await api.threats2_bulk(
+            type=options['type'],
+            id=options['id'],
+            name=options['name'],
+            sha256=options['sha256'],
+            md5=options['md5'],
+            concurrency=options['concurrency'],
+            query_string=options['query_string_obj'],
+            retry=True)
+        if options['ndjson']:
+            for k, v in obj.items():
+                print_ndjson(options, {'value': k, 'data': v})
+        else:
+            print_json_response(options, {'data': obj})
+
     elif options['threats2']:
         resp = await api.threats2(
             type=options['type'],
@@ -360,16 +453,42 @@ async def aiorequest(api, options):
             'query_string': options['query_string_obj'],
         }
 
-        if options['all']:
+        if options['all'] and len(options['name'] or []) > 1:
+            results = await api.edl_multi(
+                names=options['name'],
+                version=options['content-version'],
+                page_concurrency=options['concurrency'],
+                query_string=options['query_string_obj'],
+                retry=True)
+            print_edl_multi(options, results)
+
+        elif options['all'] and options['dst'] is not None:
+            from pantv.edl import EdlWriter
+            writer = EdlWriter(edl_path(name, options['dst']),
+                               collapse=options['collapse'])
+            x = await writer.aioexport(api,
+                                       name=name,
+                                       version=options['content-version'],
+                                       concurrency=options['concurrency'])
+            print_edl_file(x)
+
+        elif options['all']:
             obj = {'data': []}
-            async for ok, x in api.edl_all(retry=True, **kwargs):
-                if ok:
+            async for ok, x in api.edl_all(
+                    retry=True,
+                    concurrency=options['concurrency'],
+                    stream=options['ndjson'],
+                    **kwargs):
+                if ok and options['ndjson']:
+                    print_ndjson(options, x)
+                elif ok:
                     obj['data'].append(x)
                 else:
                     print_status('edl_all', x)
                     await aioprint_response(options, x)
                     x.raise_for_status()
-            print_json_response(options, obj)
+            if not options['ndjson']:
+                print_json_response(options, obj)
 
         else:
             resp = await api.edl(**kwargs)
@@ -470,6 +589,7 @@ async def aioprint_response(options, resp):
 
 def print_json_response(options, x):
     if options['jmespath'] is not None:
+        import jmespath
         try:
             x = jmespath.search(options['jmespath'], x)
         except jmespath.exceptions.JMESPathError as e:
@@ -478,12 +598,26 @@ def print_json_response(options, x):
             sys.exit(1)
 
     if options['print_python']:
+        import pprint
         print(pprint.pformat(x))
 
     if options['print_json']:
         print(json.dumps(x, sort_keys=True, indent=INDENT))
 
 
+def print_ndjson(options, x):
+    if options['jmespath'] is not None:
+        import jmespath
+        try:
+            x = jmespath.search(options['jmespath'], x)
+        except jmespath.exceptions.JMESPathError as e:
+            print('JMESPath %s: %s' % (e.__class__.__name__, e),
+                  file=sys.stderr)
+            sys.exit(1)
+
+    print(json.dumps(x, separators=(',', ':')))
+
+
 def save_pcap(body, name, dst):
     filename = name + '.pcap'
     if dst is not None:
@@ -503,6 +637,39 @@ def save_pcap(body, name, dst):
     print('pcap saved to %s' % path, file=sys.stderr)
 
 
+def edl_path(name, dst):
+    path = dst
+    if os.path.isdir(path):
+        path = os.path.join(path, '%s.txt' % name)
+
+    return path
+
+
+def print_edl_file(x):
+    if x.changed:
+        print('edl saved to %s: %d entries' % (x.path, x.count),
+              file=sys.stderr)
+    else:
+        print('edl unchanged %s: %d entries' % (x.path, x.count),
+              file=sys.stderr)
+
+
+def print_edl_multi(options, results):
+    if options['dst'] is not None:
+        from pantv.edl import EdlWriter
+        for name, items in results.items():
+            with EdlWriter(edl_path(name, options['dst']),
+                           collapse=options['collapse']) as writer:
+                writer.write(items)
+                x = writer.close()
+            print_edl_file(x)
+    elif options['ndjson']:
+        for name, items in results.items():
+            print_ndjson(options, {'name': name, 'data': items})
+    else:
+        print_json_response(options, {'data': results})
+
+
 def process_arg(arg, string=False):
     stdin_char = '-'
 
@@ -560,6 +727,7 @@ def parse_opts():
         'data': None,
         'offset': None,
         'limit': None,
+        'concurrency': None,
         'query_strings': [],
         'query_string_obj': None,
         'verify': None,
@@ -568,14 +736,17 @@ def parse_opts():
         'print_python': False,
         'print_rate_limits': False,
         'dst': None,
+        'collapse': False,
+        'cache': None,
         'jmespath': None,
         'opt_json': False,
+        'ndjson': False,
         'timeout': None,
         'debug': 0,
         'dtime': False,
     }
 
-    short_options = 'F:J:jOpQ:'
+    short_options = 'F:J:jNOpQ:'
     long_options = [
         'help', 'version', 'debug=', 'dtime',
         'api-version=', 'url=', 'api-key=',
@@ -584,9 +755,9 @@ def parse_opts():
         'atp-reports', 'atp-pcaps',
         'all', 'id=', 'name=', 'cve=', 'sha256=', 'md5=',
         'type=', 'content-version=', 'note-version=', 'data=',
-        'offset=', 'limit=',
-        'rate-limits', 'dst=', 'verify=', 'aio', 'noaio',
-        'timeout=',
+        'offset=', 'limit=', 'concurrency=',
+        'rate-limits', 'dst=', 'collapse', 'cache=', 'verify=',
+        'aio', 'noaio', 'timeout=',
     ]
 
     try:
@@ -660,6 +831,8 @@ def parse_opts():
             options['offset'] = arg
         elif opt == '--limit':
             options['limit'] = arg
+        elif opt == '--concurrency':
+            options['concurrency'] = arg
         elif opt == '-Q':
             options['query_strings'].append(process_arg(arg, string=True))
         elif opt == '--verify':
@@ -684,14 +857,21 @@ def parse_opts():
             options['print_rate_limits'] = True
         elif opt == '--dst':
             options['dst'] = arg
+        elif opt == '--collapse':
+            options['collapse'] = True
+        elif opt == '--cache':
+            options['cache'] = arg
         elif opt == '-J':
-            if not have_jmespath:
+            import importlib.util
+            if importlib.util.find_spec('jmespath') is None:
                 print('Install JMESPath for -J support: http://jmespath.org/',
                       file=sys.stderr)
                 sys.exit(1)
             options['jmespath'] = arg
         elif opt == '-O':
             options['opt_json'] = True
+        elif opt == '-N':
+            options['ndjson'] = True
         elif opt == '--debug':
             try:
                 options['debug'] = int(arg)
@@ -718,6 +898,21 @@ def parse_opts():
         print('Must use --noaio with --all -O', file=sys.stderr)
         sys.exit(0)
 
+    if (options['edl'] and options['all'] and
+       len(options['name'] or []) > 1 and
+       options['dst'] is not None and not os.path.isdir(options['dst'])):
+        print('Must use directory --dst with multiple --name',
+              file=sys.stderr)
+        sys.exit(1)
+
+    if options['collapse'] and options['dst'] is None:
+        print('Must use --dst with --collapse', file=sys.stderr)
+        sys.exit(1)
+
+    if options['opt_json'] and options['ndjson']:
+        print('Only one of -O and -N allowed', file=sys.stderr)
+        sys.exit(1)
+
     for x in ['api-version', 'url', 'api-key']:
         if x in options['config'] and options[x] is None:
             options[x] = options['config'][x]
@@ -744,6 +939,8 @@ def parse_opts():
         options['query_string_obj'] = obj
 
     if options['debug'] > 2:
+        import copy
+        import pprint
         x = copy.deepcopy(options)
         if x['api-key'] is not None:
             x['api-key'] = '*' * 6
@@ -766,9 +963,11 @@ def usage():
     --atp-reports              ATP reports API request
     --atp-pcaps                ATP reports pcaps API request
     --all                      get all threats, EDL entries
+                               threats2 bulk lookup in batches
     --id id                    signature/report ID (multiple --id's allowed)
     --name name                signature name (multiple --name's allowed)
-                               EDL name
+                               EDL name (multiple --name's allowed
+                               with --all)
     --cve id                   CVE ID
     --sha256 hash              SHA-256 hash (multiple --sha256's allowed)
     --md5 hash                 MD5 hash (multiple --md5's allowed)
@@ -776,6 +975,7 @@ def usage():
     --content-version version  content version for release-notes, EDL
     --offset num               items offset
     --limit num                number of items to return
+    --concurrency num          --all concurrent page requests
     -Q json                    URL query string (multiple -Q's allowed)
     --data json                threats2, atp-reports POST data
     --url url                  API URL
@@ -787,9 +987,12 @@ def usage():
     -j                         print JSON
     -p                         print Python
     --rate-limits              print response header rate limits
-    --dst dst                  save pcap to directory or path
+    --dst dst                  save pcap, EDL --all to directory or path
+    --collapse                 collapse EDL addresses to CIDR networks
+    --cache path               persistent response cache database
     -J expression              JMESPath expression for JSON response data
     -O                         optimized get all with JSON only output
+    -N                         get all with newline-delimited JSON output
     --timeout timeout          connect, read timeout
     -F path                    JSON options (multiple -F's allowed)
     --debug level              debug level (0-3)
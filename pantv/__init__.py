@@ -14,7 +14,6 @@
 # OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
 #
 
-import asyncio
 from collections import namedtuple
 import logging
 import re
@@ -28,6 +27,14 @@ DEFAULT_API_VERSION = 'v%d' % _default_api_version
 
 DEFAULT_URL = 'https://api.threatvault.paloaltonetworks.com'
 
+# predefined EDLs
+EDL_NAMES = (
+    'panw-known-ip-list',
+    'panw-highrisk-ip-list',
+    'panw-torexit-ip-list',
+    'panw-bulletproof-ip-list',
+)
+
 DEBUG1 = logging.DEBUG
 DEBUG2 = DEBUG1 - 1
 DEBUG3 = DEBUG2 - 1
@@ -55,6 +62,10 @@ class ApiVersion(namedtuple('api_version',
 
 
 def _isaio():
+    # there is no running event loop if asyncio has not been imported
+    asyncio = sys.modules.get('asyncio')
+    if asyncio is None:
+        return False
     try:
         asyncio.get_running_loop()
         return True
@@ -0,0 +1,273 @@
+#
+# Copyright (c) 2022 Palo Alto Networks, Inc.
+#
+# Permission to use, copy, modify, and distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+#
+
+import aiohttp
+import asyncio
+import json
+import logging
+from multidict import CIMultiDict, CIMultiDictProxy
+import ssl
+import time
+
+from . import ArgsError, DEBUG1, DEBUG2, DEBUG3
+from .mixin import _MixinShared, API_KEY_HEADER
+
+
+class AioMixin(_MixinShared):
+    async def __aenter__(self):
+        self._log(DEBUG2, '%s', '__aenter__')
+        return self
+
+    async def __aexit__(self, *args):
+        self._log(DEBUG2, '%s', '__aexit__')
+        if self._revalidations:
+            self._log(DEBUG1, 'waiting for %d cache revalidations',
+                      len(self._revalidations))
+            await asyncio.gather(*self._revalidations,
+                                 return_exceptions=True)
+        if not self.session.closed:
+            self._log(DEBUG1, 'closing aiohttp session')
+            await self.session.close()
+
+    def _timeout(self, timeout):
+        if timeout is None:
+            return
+
+        if isinstance(timeout, tuple):
+            if len(timeout) != 2:
+                raise ArgsError('timeout tuple length must be 2')
+            x = aiohttp.ClientTimeout(sock_connect=timeout[0],
+                                      sock_read=timeout[1])
+        else:
+            x = aiohttp.ClientTimeout(total=timeout)
+
+        return x
+
+    def _ssl_context(self, verify):
+        context = ssl.create_default_context(purpose=ssl.Purpose.SERVER_AUTH)
+
+        if isinstance(verify, bool):
+            if not verify:
+                context.check_hostname = False
+                context.verify_mode = ssl.CERT_NONE
+        elif verify is not None:
+            try:
+                context.load_verify_locations(cafile=verify)
+            except (FileNotFoundError, ssl.SSLError) as e:
+                raise ValueError('%s: %s' % (verify, e))
+
+        return context
+
+    def _metrics_trace_config(self):
+        # timing is passed as trace_request_ctx
+        async def on_request_start(session, trace_config_ctx, params):
+            trace_config_ctx.start = time.perf_counter()
+
+        async def on_connection_create_start(session, trace_config_ctx,
+                                             params):
+            trace_config_ctx.connect_start = time.perf_counter()
+
+        async def on_connection_create_end(session, trace_config_ctx,
+                                           params):
+            timing = trace_config_ctx.trace_request_ctx
+            if timing is not None:
+                timing['connect'] = (time.perf_counter() -
+                                     trace_config_ctx.connect_start)
+
+        async def on_request_chunk_sent(session, trace_config_ctx, params):
+            timing = trace_config_ctx.trace_request_ctx
+            if timing is not None and params.chunk:
+                timing['bytes_sent'] = (timing.get('bytes_sent', 0) +
+                                        len(params.chunk))
+
+        async def on_request_end(session, trace_config_ctx, params):
+            timing = trace_config_ctx.trace_request_ctx
+            if timing is not None:
+                timing['ttfb'] = (time.perf_counter() -
+                                  trace_config_ctx.start)
+
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_request_start.append(on_request_start)
+        trace_config.on_connection_create_start.append(
+            on_connection_create_start)
+        trace_config.on_connection_create_end.append(
+            on_connection_create_end)
+        trace_config.on_request_chunk_sent.append(on_request_chunk_sent)
+        trace_config.on_request_end.append(on_request_end)
+
+        return trace_config
+
+    def _metrics_request(self, func, kwargs, resp, start, timing):
+        method, endpoint = self._endpoint(func, kwargs)
+        try:
+            bytes_received = int(resp.headers['content-length'])
+        except (KeyError, ValueError):
+            # body not read yet, length unknown
+            bytes_received = None
+
+        self.metrics.request(method=method,
+                             endpoint=endpoint,
+                             status=resp.status,
+                             connect=timing.get('connect'),
+                             ttfb=timing.get('ttfb'),
+                             total=time.perf_counter() - start,
+                             bytes_sent=timing.get('bytes_sent', 0),
+                             bytes_received=bytes_received)
+
+    def _connector(self, *,
+                   connector=None,
+                   limit=None,
+                   limit_per_host=None,
+                   keepalive_timeout=None,
+                   ttl_dns_cache=None,
+                   force_close=None):
+        args = (limit, limit_per_host, keepalive_timeout, ttl_dns_cache,
+                force_close)
+        if connector is not None:
+            if any(x is not None for x in args):
+                raise ArgsError('connector options not allowed '
+                                'with connector')
+            if not isinstance(connector, aiohttp.BaseConnector):
+                raise ArgsError('connector must be aiohttp.BaseConnector')
+            return connector
+
+        kwargs = {'ssl': self.ssl}
+        for k, v in (('limit', limit), ('limit_per_host', limit_per_host)):
+            if v is None:
+                continue
+            try:
+                v = int(v)
+            except ValueError:
+                raise ArgsError('%s not int' % k)
+            if v < 0:
+                raise ArgsError('%s must be 0 (no limit) or greater' % k)
+            kwargs[k] = v
+        for k, v in (('keepalive_timeout', keepalive_timeout),
+                     ('ttl_dns_cache', ttl_dns_cache)):
+            if v is None:
+                continue
+            try:
+                v = float(v)
+            except ValueError:
+                raise ArgsError('%s not float' % k)
+            if v < 0:
+                raise ArgsError('%s must be 0 or greater' % k)
+            kwargs[k] = v
+        if force_close is not None:
+            kwargs['force_close'] = bool(force_close)
+            if force_close and keepalive_timeout is not None:
+                raise ArgsError('keepalive_timeout not allowed '
+                                'with force_close')
+        self._log(DEBUG2, 'connector: %s', kwargs)
+
+        return aiohttp.TCPConnector(**kwargs)
+
+    def _session(self, auth=None, timeout=None, metrics=False,
+                 connector=None, connector_owner=True):
+        async def on_request_start(session, trace_config_ctx, params):
+            log = logging.getLogger(__name__).log
+            log(DEBUG2, '%s %s', params.method, params.url)
+            for k, v in params.headers.items():
+                x = '*' * 6 if k == API_KEY_HEADER else v
+                log(DEBUG3, '%s: %s', k, x)
+
+        async def on_request_chunk_sent(session, trace_config_ctx, params):
+            log = logging.getLogger(__name__).log
+            if params.chunk:
+                log(DEBUG3, '%s', params.chunk)
+
+        async def on_request_end(session, trace_config_ctx, params):
+            log = logging.getLogger(__name__).log
+            log(DEBUG1, '%s %s %s %s %s',
+                params.method,
+                params.url,
+                params.response.status,
+                params.response.reason,
+                params.response.headers.get('content-length'))
+            for k, v in params.response.headers.items():
+                log(DEBUG3, '%s: %s', k, v)
+
+        kwargs = {}
+        if auth is not None:
+            kwargs['headers'] = auth
+        if timeout is not None:
+            kwargs['timeout'] = timeout
+        if connector is not None:
+            kwargs['connector'] = connector
+            kwargs['connector_owner'] = connector_owner
+
+        trace_configs = []
+        if (logging.getLogger(__name__).getEffectiveLevel() in
+           [DEBUG1, DEBUG2, DEBUG3]):
+            trace_config = aiohttp.TraceConfig()
+            trace_config.on_request_start.append(on_request_start)
+            trace_config.on_request_chunk_sent.append(on_request_chunk_sent)
+            trace_config.on_request_end.append(on_request_end)
+            trace_configs.append(trace_config)
+        if metrics:
+            trace_configs.append(self._metrics_trace_config())
+        if trace_configs:
+            kwargs['trace_configs'] = trace_configs
+
+        return aiohttp.ClientSession(**kwargs)
+
+    def _cached_response(self, entry, url):
+        return _CachedClientResponse(entry, url)
+
+
+class _CachedClientResponse:
+    # subset of aiohttp.ClientResponse for a cached response
+    def __init__(self, entry, url):
+        self.status = entry.status
+        self.reason = entry.reason
+        self.headers = CIMultiDictProxy(CIMultiDict(entry.headers))
+        self.url = url
+        self.closed = True
+        self._body = entry.body
+        self.content = _CachedStreamReader(entry.body)
+
+    @property
+    def ok(self):
+        return self.status < 400
+
+    async def read(self):
+        return self._body
+
+    async def text(self, encoding=None, errors='strict'):
+        return self._body.decode(encoding or 'utf-8', errors)
+
+    async def json(self, *,
+                   encoding=None,
+                   loads=json.loads,
+                   content_type='application/json'):
+        return loads(self._body.decode(encoding or 'utf-8'))
+
+    def raise_for_status(self):
+        # only successful responses are cached
+        pass
+
+    def release(self):
+        pass
+
+
+class _CachedStreamReader:
+    # subset of aiohttp.StreamReader for a cached response body
+    def __init__(self, body):
+        self._body = body
+
+    async def iter_chunked(self, n):
+        for i in range(0, len(self._body), n):
+            yield self._body[i:i + n]
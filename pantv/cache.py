@@ -0,0 +1,298 @@
+#
+# Copyright (c) 2022 Palo Alto Networks, Inc.
+#
+# Permission to use, copy, modify, and distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+#
+
+from collections import namedtuple, OrderedDict
+import json
+import logging
+import re
+import sqlite3
+import threading
+import time
+
+from . import ArgsError, DEBUG3
+
+# seconds, by API resource path
+DEFAULT_TTL = {
+    '/threats': 3600,
+    '/release-notes': 3600,
+    '/edl': 300,
+}
+
+
+class CacheEntry(namedtuple('cache_entry',
+                            ['status', 'reason', 'headers', 'body',
+                             'time', 'ttl'])):
+    def fresh(self, now=None):
+        if now is None:
+            now = time.time()
+        return now < self.time + self.ttl
+
+    def validators(self):
+        headers = {k.lower(): v for k, v in self.headers.items()}
+        x = {}
+        if 'etag' in headers:
+            x['If-None-Match'] = headers['etag']
+        if 'last-modified' in headers:
+            x['If-Modified-Since'] = headers['last-modified']
+
+        return x
+
+    def revalidated(self, headers):
+        # 304 Not Modified: refresh time and validators
+        headers_ = dict(self.headers)
+        lower = {k.lower(): k for k in headers_}
+        for k in ('ETag', 'Last-Modified', 'Date'):
+            if k in headers:
+                headers_[lower.get(k.lower(), k)] = headers[k]
+
+        return self._replace(headers=headers_, time=time.time())
+
+
+class ResponseCache:
+    def __init__(self, *,
+                 maxsize=1024,
+                 maxbytes=64 * 1024 * 1024,
+                 ttl=None,
+                 max_stale=0):
+        self._log = logging.getLogger(__name__).log
+        try:
+            self.maxsize = int(maxsize)
+        except ValueError:
+            raise ArgsError('maxsize not int')
+        if self.maxsize < 1:
+            raise ArgsError('maxsize must be greater than 0')
+        try:
+            self.maxbytes = int(maxbytes)
+        except ValueError:
+            raise ArgsError('maxbytes not int')
+        try:
+            self.max_stale = float(max_stale)
+        except ValueError:
+            raise ArgsError('max_stale not float')
+        self.ttl = dict(DEFAULT_TTL)
+        if ttl is not None:
+            self.ttl.update(ttl)
+
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.nbytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._revalidating = set()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _ttl(self, path):
+        # /service/v1/edl -> /edl
+        return self.ttl.get(re.sub(r'^/service/v\d+', '', path))
+
+    def key(self, method, path, params, body=None):
+        if method != 'GET' or self._ttl(path) is None:
+            return
+
+        params_ = []
+        for k, v in (params or {}).items():
+            if v is None:
+                continue
+            if isinstance(v, (list, tuple)):
+                v = [str(x) for x in v]
+            else:
+                v = str(v)
+            params_.append((k, v))
+
+        return json.dumps([method, path, sorted(params_), body],
+                          separators=(',', ':'))
+
+    def entry(self, key, status, reason, headers, body):
+        path = json.loads(key)[1]
+        return CacheEntry(status=status,
+                          reason=reason,
+                          headers=dict(headers),
+                          body=body,
+                          time=time.time(),
+                          ttl=self._ttl(path))
+
+    def _expired(self, entry, now):
+        return now >= entry.time + entry.ttl + self.max_stale
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = self._load(key)
+                if entry is not None and not self._expired(entry, now):
+                    self._put(key, entry)
+            if entry is not None and self._expired(entry, now):
+                self._delete(key)
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                self._log(DEBUG3, 'cache miss: %s', key)
+                return
+            self._entries.move_to_end(key)
+            if entry.fresh(now):
+                self.hits += 1
+                self._log(DEBUG3, 'cache hit: %s', key)
+            else:
+                self.stale += 1
+                self._log(DEBUG3, 'cache stale: %s', key)
+
+        return entry
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        self.nbytes -= len(entry.body)
+
+    def _put(self, key, entry):
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = entry
+        self.nbytes += len(entry.body)
+        while (len(self._entries) > self.maxsize or
+               self.nbytes > self.maxbytes):
+            self._remove(next(iter(self._entries)))
+
+    def put(self, key, entry):
+        if len(entry.body) > self.maxbytes:
+            return
+        with self._lock:
+            self._put(key, entry)
+            self._store(key, entry)
+
+    def _delete(self, key):
+        if key in self._entries:
+            self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+    # persistent storage, overridden by subclasses
+    def _load(self, key):
+        return
+
+    def _store(self, key, entry):
+        pass
+
+    def claim(self, key):
+        # only one background revalidation per key
+        with self._lock:
+            if key in self._revalidating:
+                return False
+            self._revalidating.add(key)
+            return True
+
+    def release(self, key):
+        with self._lock:
+            self._revalidating.discard(key)
+
+
+class DiskCache(ResponseCache):
+    def __init__(self, path, *,
+                 maxsize=1024,
+                 maxbytes=64 * 1024 * 1024,
+                 ttl=None,
+                 max_stale=86400):
+        super().__init__(maxsize=maxsize,
+                         maxbytes=maxbytes,
+                         ttl=ttl,
+                         max_stale=max_stale)
+        self.path = path
+        try:
+            self.db = sqlite3.connect(path, check_same_thread=False)
+            self.db.executescript(_SCHEMA)
+        except sqlite3.Error as e:
+            raise ArgsError('%s: %s' % (path, e))
+        self.purge()
+        with self._lock, self.db:
+            self._trim()
+
+    def close(self):
+        with self._lock:
+            self.db.close()
+
+    def _load(self, key):
+        row = self.db.execute('SELECT status, reason, headers, body, '
+                              'time, ttl FROM entries WHERE key = ?',
+                              (key,)).fetchone()
+        if row is None:
+            return
+        self._log(DEBUG3, 'cache load: %s', key)
+
+        return CacheEntry(status=row[0],
+                          reason=row[1],
+                          headers=json.loads(row[2]),
+                          body=bytes(row[3]),
+                          time=row[4],
+                          ttl=row[5])
+
+    def _store(self, key, entry):
+        with self.db:
+            self.db.execute('INSERT OR REPLACE INTO entries '
+                            'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                            (key, entry.status, entry.reason,
+                             json.dumps(entry.headers), entry.body,
+                             entry.time, entry.ttl))
+            self._trim()
+
+    def _trim(self):
+        # evicted entries are not removed from disk; limit the database
+        # to the maxsize and maxbytes most recently stored entries
+        cursor = self.db.execute(
+            'DELETE FROM entries WHERE key IN ('
+            'SELECT key FROM (SELECT key, '
+            'ROW_NUMBER() OVER w AS n, SUM(LENGTH(body)) OVER w AS nbytes '
+            'FROM entries WINDOW w AS (ORDER BY time DESC, key)) '
+            'WHERE n > ? OR nbytes > ?)', (self.maxsize, self.maxbytes))
+        if cursor.rowcount > 0:
+            self._log(DEBUG3, 'cache trim: %d entries', cursor.rowcount)
+
+    def _delete(self, key):
+        super()._delete(key)
+        with self.db:
+            self.db.execute('DELETE FROM entries WHERE key = ?', (key,))
+
+    def clear(self):
+        super().clear()
+        with self._lock, self.db:
+            self.db.execute('DELETE FROM entries')
+
+    def purge(self):
+        # remove expired entries from disk
+        with self._lock, self.db:
+            cursor = self.db.execute('DELETE FROM entries '
+                                     'WHERE time + ttl + ? <= ?',
+                                     (self.max_stale, time.time()))
+        return cursor.rowcount
+
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    status INTEGER NOT NULL,
+    reason TEXT,
+    headers TEXT NOT NULL,
+    body BLOB NOT NULL,
+    time REAL NOT NULL,
+    ttl REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_time ON entries (time);
+'''
@@ -0,0 +1,139 @@
+#
+# Copyright (c) 2022 Palo Alto Networks, Inc.
+#
+# Permission to use, copy, modify, and distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+#
+
+import asyncio
+import logging
+
+from . import ApiError, ArgsError, DEBUG1, DEBUG2
+from .mixin import THREATS2_BATCH_SIZE, _threats2_merge, _threats2_value
+
+
+class ThreatsCoalescer:
+    def __init__(self, api, *,
+                 type=None,
+                 delay=0.01,
+                 batch_size=None,
+                 retry=True):
+        self._log = logging.getLogger(__name__).log
+        self.api = api
+        self.type = type
+        self.retry = retry
+        try:
+            self.delay = float(delay)
+        except ValueError:
+            raise ArgsError('delay not float')
+        if batch_size is None:
+            self.batch_size = THREATS2_BATCH_SIZE
+        else:
+            try:
+                self.batch_size = int(batch_size)
+            except ValueError:
+                raise ArgsError('batch_size not int')
+            if self.batch_size < 1:
+                raise ArgsError('batch_size must be greater than 0')
+
+        self.requests = 0
+        self.lookups = 0
+        self._pending = {}
+        self._timers = {}
+        self._tasks = set()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+    async def threats(self, *,
+                      id=None,
+                      name=None,
+                      sha256=None,
+                      md5=None):
+        args = [(k, v) for k, v in (('id', id), ('name', name),
+                                    ('sha256', sha256), ('md5', md5))
+                if v is not None]
+        if len(args) != 1:
+            raise ArgsError('one of id, name, sha256 or md5 required')
+        key, value = args[0]
+        value = _threats2_value(key, value)
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        pending = self._pending.setdefault(key, {})
+        pending.setdefault(value, []).append(future)
+        self.lookups += 1
+
+        if len(pending) >= self.batch_size:
+            self._flush(key)
+        elif key not in self._timers:
+            self._timers[key] = loop.call_later(self.delay,
+                                                self._flush, key)
+
+        return await future
+
+    def _flush(self, key):
+        timer = self._timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+        pending = self._pending.pop(key, None)
+        if not pending:
+            return
+
+        task = asyncio.ensure_future(self._send(key, pending))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _send(self, key, pending):
+        self._log(DEBUG2, 'coalesce: %s batch %d', key, len(pending))
+        self.requests += 1
+        results = {x: [] for x in pending}
+        try:
+            resp = await self.api.threats2(type=self.type,
+                                           retry=self.retry,
+                                           **{key: list(pending)})
+            if resp.status == 200:
+                obj = await resp.json(content_type=None)
+                _threats2_merge(key, obj, results)
+            elif resp.status == 404:
+                # no threats found for batch
+                resp.release()
+            else:
+                raise ApiError('threats2: %s %s: %s' % (
+                    resp.status, resp.reason, await resp.text()))
+        except asyncio.CancelledError:
+            for futures in pending.values():
+                for future in futures:
+                    future.cancel()
+            raise
+        except Exception as e:
+            for futures in pending.values():
+                for future in futures:
+                    if not future.done():
+                        future.set_exception(e)
+            return
+
+        for value, futures in pending.items():
+            for future in futures:
+                if not future.done():
+                    future.set_result(list(results[value]))
+
+    async def close(self):
+        for key in list(self._pending):
+            self._flush(key)
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._log(DEBUG1, 'coalesce: %d lookups %d requests',
+                  self.lookups, self.requests)
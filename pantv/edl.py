@@ -0,0 +1,717 @@
+#
+# Copyright (c) 2022 Palo Alto Networks, Inc.
+#
+# Permission to use, copy, modify, and distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+#
+
+import array
+import bisect
+from collections import namedtuple
+import hashlib
+import ipaddress
+import logging
+import os
+import socket
+import sqlite3
+import struct
+import sys
+import tempfile
+import time
+
+from . import ApiError, ArgsError, DEBUG1, DEBUG2
+
+_LO_MASK = (1 << 64) - 1
+
+# smallest unsigned typecode which holds an IPv4 address
+_V4_TYPE = 'I' if array.array('I').itemsize >= 4 else 'L'
+
+# tobytes() header: format, IPv4 item size, array lengths
+_HEADER = struct.Struct('<BB6Q')
+_FORMAT = 1
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS edls (
+    name TEXT PRIMARY KEY,
+    version TEXT NOT NULL,
+    time REAL NOT NULL,
+    data BLOB NOT NULL
+);
+'''
+
+# EdlWriter lines per write
+_LINES = 8192
+_BUFSIZE = 1024 * 1024
+
+_AF_INET = socket.AF_INET
+_inet_pton = socket.inet_pton
+_from_bytes = int.from_bytes
+
+
+def _parse_address(x):
+    # (version, int) using inet_pton(), which is faster than
+    # ipaddress.ip_address() for bulk input
+    try:
+        return 4, int.from_bytes(socket.inet_pton(socket.AF_INET, x), 'big')
+    except OSError:
+        pass
+    try:
+        return 6, int.from_bytes(socket.inet_pton(socket.AF_INET6, x), 'big')
+    except OSError:
+        pass
+    # scoped IPv6, etc.
+    try:
+        ip = ipaddress.ip_address(x)
+    except ValueError:
+        raise ArgsError('invalid IP address: %s' % x)
+    return ip.version, int(ip)
+
+
+def _address(x):
+    if isinstance(x, (ipaddress.IPv4Address, ipaddress.IPv6Address)):
+        return x.version, int(x)
+    if not isinstance(x, str):
+        raise ArgsError('invalid IP address: %s' % (x,))
+    return _parse_address(x.strip())
+
+
+def _range(x):
+    # (version, start, end) for an address, CIDR network or
+    # start-end address range
+    if isinstance(x, (ipaddress.IPv4Address, ipaddress.IPv6Address)):
+        return x.version, int(x), int(x)
+    if isinstance(x, (ipaddress.IPv4Network, ipaddress.IPv6Network)):
+        return (x.version, int(x.network_address),
+                int(x.broadcast_address))
+    if not isinstance(x, str):
+        raise ArgsError('invalid EDL entry: %s' % (x,))
+
+    x = x.strip()
+    if '/' in x:
+        try:
+            net = ipaddress.ip_network(x, strict=False)
+        except ValueError:
+            raise ArgsError('invalid EDL entry: %s' % x)
+        return (net.version, int(net.network_address),
+                int(net.broadcast_address))
+    if '-' in x:
+        start, end = x.split('-', 1)
+        version, start = _parse_address(start.strip())
+        version2, end = _parse_address(end.strip())
+        if version != version2 or start > end:
+            raise ArgsError('invalid EDL entry: %s' % x)
+        return version, start, end
+
+    version, ip = _parse_address(x)
+    return version, ip, ip
+
+
+def _merge(keys, bits):
+    # keys are start << bits | end; sort and merge overlapping and
+    # adjacent ranges
+    keys.sort()
+    mask = (1 << bits) - 1
+    starts, ends = [], []
+    last = -2
+    for key in keys:
+        start, end = key >> bits, key & mask
+        if start <= last + 1:
+            if end > last:
+                ends[-1] = last = end
+        else:
+            starts.append(start)
+            ends.append(end)
+            last = end
+
+    return starts, ends
+
+
+def _subtract(a, b):
+    # sorted-merge difference of sorted non-overlapping (start, end)
+    # ranges
+    starts, ends = [], []
+    b = iter(b)
+    x = next(b, None)
+    for start, end in a:
+        while x is not None and x[1] < start:
+            x = next(b, None)
+        while x is not None and x[0] <= end:
+            if x[0] > start:
+                starts.append(start)
+                ends.append(x[0] - 1)
+            if x[1] >= end:
+                start = end + 1
+                break
+            start = x[1] + 1
+            x = next(b, None)
+        if start <= end:
+            starts.append(start)
+            ends.append(end)
+
+    return starts, ends
+
+
+def _ipaddr(x):
+    # edl_all() item without listformat=array
+    try:
+        return x['ipaddr']
+    except KeyError:
+        raise ApiError('Malformed response, missing key ipaddr')
+
+
+def _keys(items, keys4, keys6):
+    # append start << bits | end range keys for items
+    for x in items:
+        if isinstance(x, dict):
+            x = _ipaddr(x)
+        # fast path for an IPv4 address
+        try:
+            ip = _from_bytes(_inet_pton(_AF_INET, x), 'big')
+        except (OSError, TypeError):
+            pass
+        else:
+            keys4.append(ip << 32 | ip)
+            continue
+        version, start, end = _range(x)
+        if version == 4:
+            keys4.append(start << 32 | end)
+        else:
+            keys6.append(start << 128 | end)
+
+
+class EdlDelta(namedtuple('edl_delta',
+                          ['name', 'old_version', 'version',
+                           'added', 'removed'])):
+    @property
+    def changed(self):
+        return bool(self.added) or bool(self.removed)
+
+
+EdlFile = namedtuple('edl_file', ['path', 'count', 'sha256', 'changed'])
+
+
+class EdlIndex:
+    def __init__(self, items=()):
+        self._log = logging.getLogger(__name__).log
+        keys4, keys6 = [], []
+        _keys(items, keys4, keys6)
+
+        n = len(keys4) + len(keys6)
+        self._set_ranges(_merge(keys4, 32), _merge(keys6, 128))
+        self._log(DEBUG1, 'EdlIndex: %d entries, %d IPv4 %d IPv6 ranges, '
+                  '%d bytes', n, len(self._starts4), len(self._starts6_hi),
+                  self.nbytes)
+
+    def _set_ranges(self, ranges4, ranges6):
+        # packed sorted non-overlapping ranges; IPv6 addresses are
+        # stored as high and low 64-bit halves
+        starts, ends = ranges4
+        self._starts4 = array.array(_V4_TYPE, starts)
+        self._ends4 = array.array(_V4_TYPE, ends)
+        starts, ends = ranges6
+        self._starts6_hi = array.array('Q', (x >> 64 for x in starts))
+        self._starts6_lo = array.array('Q', (x & _LO_MASK for x in starts))
+        self._ends6_hi = array.array('Q', (x >> 64 for x in ends))
+        self._ends6_lo = array.array('Q', (x & _LO_MASK for x in ends))
+
+    def _arrays(self):
+        return (self._starts4, self._ends4,
+                self._starts6_hi, self._starts6_lo,
+                self._ends6_hi, self._ends6_lo)
+
+    @classmethod
+    def _from_ranges(cls, ranges4, ranges6):
+        index = cls.__new__(cls)
+        index._log = logging.getLogger(__name__).log
+        index._set_ranges(ranges4, ranges6)
+        return index
+
+    def tobytes(self):
+        # little-endian arrays with a header
+        arrays = self._arrays()
+        x = [_HEADER.pack(_FORMAT, self._starts4.itemsize,
+                          *[len(a) for a in arrays])]
+        for a in arrays:
+            if sys.byteorder != 'little':
+                a = array.array(a.typecode, a)
+                a.byteswap()
+            x.append(a.tobytes())
+
+        return b''.join(x)
+
+    @classmethod
+    def frombytes(cls, data):
+        try:
+            format_, itemsize, *lengths = _HEADER.unpack_from(data)
+        except struct.error as e:
+            raise ArgsError('EdlIndex: %s' % e)
+        if format_ != _FORMAT:
+            raise ArgsError('EdlIndex: unsupported format %d' % format_)
+        if itemsize != array.array(_V4_TYPE).itemsize:
+            raise ArgsError('EdlIndex: unsupported IPv4 item size %d' %
+                            itemsize)
+
+        index = cls.__new__(cls)
+        index._log = logging.getLogger(__name__).log
+        offset = _HEADER.size
+        arrays = []
+        for typecode, n in zip((_V4_TYPE, _V4_TYPE) + ('Q',) * 4, lengths):
+            a = array.array(typecode)
+            end = offset + n * a.itemsize
+            if end > len(data):
+                raise ArgsError('EdlIndex: data truncated')
+            a.frombytes(data[offset:end])
+            if sys.byteorder != 'little':
+                a.byteswap()
+            arrays.append(a)
+            offset = end
+        (index._starts4, index._ends4,
+         index._starts6_hi, index._starts6_lo,
+         index._ends6_hi, index._ends6_lo) = arrays
+
+        return index
+
+    @classmethod
+    def fetch(cls, api, *,
+              name,
+              version=None,
+              concurrency=None):
+        items = []
+        for ok, x in api.edl_all(name=name, version=version,
+                                 concurrency=concurrency, retry=True):
+            if not ok:
+                raise ApiError('edl_all %s: %s %s' %
+                               (name, x.status_code, x.reason))
+            items.append(x)
+
+        return cls(items)
+
+    @classmethod
+    async def aiofetch(cls, api, *,
+                       name,
+                       version=None,
+                       concurrency=None):
+        items = []
+        async for ok, x in api.edl_all(name=name, version=version,
+                                       concurrency=concurrency, retry=True):
+            if not ok:
+                raise ApiError('edl_all %s: %s %s' %
+                               (name, x.status, x.reason))
+            items.append(x)
+
+        return cls(items)
+
+    def __len__(self):
+        return len(self._starts4) + len(self._starts6_hi)
+
+    def __contains__(self, ip):
+        return self.contains(ip)
+
+    def __eq__(self, other):
+        if not isinstance(other, EdlIndex):
+            return NotImplemented
+        return self._arrays() == other._arrays()
+
+    def __sub__(self, other):
+        return self.difference(other)
+
+    @property
+    def nbytes(self):
+        return sum(len(x) * x.itemsize for x in self._arrays())
+
+    @property
+    def num_addresses(self):
+        return sum(end - start + 1 for _, start, end in self._ranges())
+
+    def _start6(self, i):
+        return self._starts6_hi[i] << 64 | self._starts6_lo[i]
+
+    def _end6(self, i):
+        return self._ends6_hi[i] << 64 | self._ends6_lo[i]
+
+    def _ranges4(self):
+        return zip(self._starts4, self._ends4)
+
+    def _ranges6(self):
+        return ((self._start6(i), self._end6(i))
+                for i in range(len(self._starts6_hi)))
+
+    def _ranges(self):
+        for start, end in self._ranges4():
+            yield 4, start, end
+        for start, end in self._ranges6():
+            yield 6, start, end
+
+    def ranges(self):
+        for version, start, end in self._ranges():
+            cls = (ipaddress.IPv4Address if version == 4
+                   else ipaddress.IPv6Address)
+            yield cls(start), cls(end)
+
+    def networks(self):
+        for start, end in self.ranges():
+            yield from ipaddress.summarize_address_range(start, end)
+
+    def difference(self, other):
+        return self._from_ranges(_subtract(self._ranges4(),
+                                           other._ranges4()),
+                                 _subtract(self._ranges6(),
+                                           other._ranges6()))
+
+    def _find6(self, ip):
+        # index of the last range with start <= ip, or -1
+        hi, lo = ip >> 64, ip & _LO_MASK
+        a = bisect.bisect_left(self._starts6_hi, hi)
+        b = bisect.bisect_right(self._starts6_hi, hi, a)
+        i = bisect.bisect_right(self._starts6_lo, lo, a, b)
+        return i - 1
+
+    def contains(self, ip):
+        version, ip = _address(ip)
+        if version == 4:
+            i = bisect.bisect_right(self._starts4, ip) - 1
+            return i >= 0 and ip <= self._ends4[i]
+
+        i = self._find6(ip)
+        return i >= 0 and ip <= self._end6(i)
+
+    def lookup(self, ips):
+        # sort the addresses and merge with the sorted ranges; the
+        # input position is kept in the low bits of the sort key
+        values4, values6 = [], []
+        n = 0
+        for x in ips:
+            try:
+                ip = _from_bytes(_inet_pton(_AF_INET, x), 'big')
+            except (OSError, TypeError):
+                version, ip = _address(x)
+            else:
+                version = 4
+            if version == 4:
+                values4.append(ip << 64 | n)
+            else:
+                values6.append(ip << 64 | n)
+            n += 1
+
+        results = [False] * n
+
+        merge = [(values4, self._starts4, self._ends4)]
+        if values6:
+            n6 = range(len(self._starts6_hi))
+            merge.append((values6,
+                          [self._start6(i) for i in n6],
+                          [self._end6(i) for i in n6]))
+
+        for values, starts, ends in merge:
+            values.sort()
+            j, last = 0, len(ends)
+            for x in values:
+                ip = x >> 64
+                while j < last and ends[j] < ip:
+                    j += 1
+                if j == last:
+                    break
+                if starts[j] <= ip:
+                    results[x & _LO_MASK] = True
+
+        return results
+
+
+class EdlSnapshot:
+    # last fetched version of EDLs, for version deltas
+    def __init__(self, path):
+        self._log = logging.getLogger(__name__).log
+        self.path = path
+        try:
+            self.db = sqlite3.connect(path)
+            self.db.executescript(_SCHEMA)
+        except sqlite3.Error as e:
+            raise ArgsError('%s: %s' % (path, e))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.db.close()
+
+    def _row(self, name, column):
+        row = self.db.execute('SELECT %s FROM edls WHERE name = ?' %
+                              column, (name,)).fetchone()
+        return None if row is None else row[0]
+
+    def version(self, name):
+        return self._row(name, 'version')
+
+    def last_sync(self, name):
+        return self._row(name, 'time')
+
+    def index(self, name):
+        x = self._row(name, 'data')
+        return None if x is None else EdlIndex.frombytes(x)
+
+    def names(self):
+        return [x[0] for x in
+                self.db.execute('SELECT name FROM edls ORDER BY name')]
+
+    def _latest_version(self, name, status, reason, obj):
+        if status != 200:
+            raise ApiError('edl %s: %s %s' % (name, status, reason))
+        try:
+            version = str(obj['data'][0]['version'])
+        except (KeyError, IndexError, TypeError) as e:
+            raise ApiError('Malformed response, '
+                           'missing key %s' % e)
+        self._log(DEBUG1, 'edl %s: latest version %s, snapshot %s',
+                  name, version, self.version(name))
+
+        return version
+
+    def _unchanged(self, name, version):
+        with self.db:
+            self.db.execute('UPDATE edls SET time = ? WHERE name = ?',
+                            (time.time(), name))
+
+        return EdlDelta(name=name,
+                        old_version=version,
+                        version=version,
+                        added=EdlIndex(),
+                        removed=EdlIndex())
+
+    def _store(self, name, version, index):
+        old_version = self.version(name)
+        old = self.index(name)
+        if old is None:
+            old = EdlIndex()
+        delta = EdlDelta(name=name,
+                         old_version=old_version,
+                         version=version,
+                         added=index - old,
+                         removed=old - index)
+
+        with self.db:
+            self.db.execute('INSERT OR REPLACE INTO edls '
+                            'VALUES (?, ?, ?, ?)',
+                            (name, version, time.time(), index.tobytes()))
+        self._log(DEBUG2, 'edl %s: version %s->%s added %d removed %d',
+                  name, old_version, version,
+                  len(delta.added), len(delta.removed))
+
+        return delta
+
+    def update(self, api, *,
+               name,
+               concurrency=None):
+        resp = api.edl(name=name, version='latest', limit=1, retry=True)
+        version = self._latest_version(name, resp.status_code, resp.reason,
+                                       resp.json()
+                                       if resp.status_code == 200 else None)
+        if version == self.version(name):
+            return self._unchanged(name, version)
+
+        # the version is specified so pages are from the same version
+        index = EdlIndex.fetch(api, name=name, version=version,
+                               concurrency=concurrency)
+
+        return self._store(name, version, index)
+
+    async def aioupdate(self, api, *,
+                        name,
+                        concurrency=None):
+        resp = await api.edl(name=name, version='latest', limit=1,
+                             retry=True)
+        version = self._latest_version(name, resp.status, resp.reason,
+                                       await resp.json(content_type=None)
+                                       if resp.status == 200 else None)
+        if version == self.version(name):
+            return self._unchanged(name, version)
+
+        index = await EdlIndex.aiofetch(api, name=name, version=version,
+                                        concurrency=concurrency)
+
+        return self._store(name, version, index)
+
+
+class EdlWriter:
+    # plain text EDL file written to a temporary file and renamed
+    def __init__(self, path, *,
+                 collapse=False):
+        self._log = logging.getLogger(__name__).log
+        self.path = path
+        self.collapse = collapse
+        dir_, name = os.path.split(os.path.abspath(path))
+        try:
+            fd, self._tmp = tempfile.mkstemp(dir=dir_,
+                                             prefix='.%s.' % name)
+        except OSError as e:
+            raise ArgsError('%s: %s' % (path, e))
+        self._file = open(fd, 'wb', buffering=_BUFSIZE)
+        self._hash = hashlib.sha256()
+        self._lines = []
+        self._keys4, self._keys6 = [], []
+        self.count = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *args):
+        if self._file is None:
+            return
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def _flush(self):
+        if self._lines:
+            self._lines.append('')
+            x = '\n'.join(self._lines).encode()
+            self._file.write(x)
+            self._hash.update(x)
+            self._lines = []
+
+    def _write_lines(self, lines):
+        self._lines.extend(lines)
+        self.count += len(lines)
+        if len(self._lines) >= _LINES:
+            self._flush()
+
+    def write(self, items):
+        if self.collapse:
+            _keys(items, self._keys4, self._keys6)
+            return
+
+        lines = []
+        for x in items:
+            if isinstance(x, dict):
+                x = _ipaddr(x)
+            if not isinstance(x, str) or '\n' in x:
+                raise ApiError('Malformed EDL entry: %r' % (x,))
+            lines.append(x.strip())
+        self._write_lines(lines)
+
+    def _write_networks(self):
+        index = EdlIndex._from_ranges(_merge(self._keys4, 32),
+                                      _merge(self._keys6, 128))
+        self._keys4, self._keys6 = [], []
+        lines = []
+        for x in index.networks():
+            if x.prefixlen == x.max_prefixlen:
+                lines.append(str(x.network_address))
+            else:
+                lines.append(str(x))
+            if len(lines) >= _LINES:
+                self._write_lines(lines)
+                lines = []
+        self._write_lines(lines)
+
+    def _unchanged(self, size, digest):
+        try:
+            if os.path.getsize(self.path) != size:
+                return False
+            x = hashlib.sha256()
+            with open(self.path, 'rb') as f:
+                while True:
+                    buf = f.read(_BUFSIZE)
+                    if not buf:
+                        break
+                    x.update(buf)
+        except OSError:
+            return False
+
+        return x.hexdigest() == digest
+
+    def close(self):
+        if self.collapse:
+            self._write_networks()
+        self._flush()
+        try:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            size = self._file.tell()
+            self._file.close()
+            self._file = None
+            digest = self._hash.hexdigest()
+
+            if self._unchanged(size, digest):
+                os.unlink(self._tmp)
+                changed = False
+            else:
+                try:
+                    mode = os.stat(self.path).st_mode & 0o7777
+                except FileNotFoundError:
+                    mode = 0o644
+                os.chmod(self._tmp, mode)
+                os.replace(self._tmp, self.path)
+                changed = True
+        except OSError as e:
+            self.abort()
+            raise ArgsError('%s: %s' % (self.path, e))
+
+        self._log(DEBUG1, 'EdlWriter: %s %d lines sha256 %s %s',
+                  self.path, self.count, digest,
+                  'replaced' if changed else 'unchanged')
+
+        return EdlFile(path=self.path,
+                       count=self.count,
+                       sha256=digest,
+                       changed=changed)
+
+    def abort(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        try:
+            os.unlink(self._tmp)
+        except FileNotFoundError:
+            pass
+
+    def export(self, api, *,
+               name,
+               version=None,
+               concurrency=None):
+        with self:
+            lines = []
+            for ok, x in api.edl_all(name=name, version=version,
+                                     concurrency=concurrency, retry=True):
+                if not ok:
+                    raise ApiError('edl_all %s: %s %s' %
+                                   (name, x.status_code, x.reason))
+                lines.append(x)
+                if len(lines) >= _LINES:
+                    self.write(lines)
+                    lines = []
+            self.write(lines)
+
+            return self.close()
+
+    async def aioexport(self, api, *,
+                        name,
+                        version=None,
+                        concurrency=None):
+        with self:
+            lines = []
+            async for ok, x in api.edl_all(name=name, version=version,
+                                           concurrency=concurrency,
+                                           retry=True):
+                if not ok:
+                    raise ApiError('edl_all %s: %s %s' %
+                                   (name, x.status, x.reason))
+                lines.append(x)
+                if len(lines) >= _LINES:
+                    self.write(lines)
+                    lines = []
+            self.write(lines)
+
+            return self.close()
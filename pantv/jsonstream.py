@@ -0,0 +1,173 @@
+#
+# Copyright (c) 2022 Palo Alto Networks, Inc.
+#
+# Permission to use, copy, modify, and distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+#
+
+import codecs
+import json
+import re
+
+CHUNK_SIZE = 64 * 1024
+
+_WS = re.compile(r'[ \t\n\r]*')
+
+# parser states
+_START = 0
+_KEY = 1
+_VALUE = 2
+_DATA_KEY = 3
+_DATA_VALUE = 4
+_ARRAY = 5
+_DONE = 6
+
+
+class PageParser:
+    # Incremental parser for a response page of the form:
+    #   {"count": n, "data": [item, ...]}
+    #   {"count": n, "data": {"type": [item, ...], ...}}
+    # Items are returned as they are decoded; other members are
+    # saved in meta, with an empty list for a streamed array.
+    # data_keys limits the streamed arrays of a data object, other
+    # members are saved in meta['data'].
+    def __init__(self, data_keys=None):
+        self.meta = {}
+        self.data_keys = data_keys
+        self._decoder = codecs.getincrementaldecoder('utf-8')()
+        self._json = json.JSONDecoder()
+        self._buf = ''
+        self._pos = 0
+        self._state = _START
+        self._key = None
+        self._in_dict = False
+
+    def feed(self, data):
+        self._buf = self._buf[self._pos:] + self._decoder.decode(data)
+        self._pos = 0
+
+        return list(self._parse(final=False))
+
+    def close(self):
+        self._buf = (self._buf[self._pos:] +
+                     self._decoder.decode(b'', final=True))
+        self._pos = 0
+        items = list(self._parse(final=True))
+        if self._state != _DONE:
+            raise ValueError('incomplete JSON document')
+
+        return items
+
+    def _ws(self):
+        self._pos = _WS.match(self._buf, self._pos).end()
+        return self._buf[self._pos:self._pos + 1]
+
+    def _value(self, final):
+        try:
+            obj, end = self._json.raw_decode(self._buf, self._pos)
+        except json.JSONDecodeError:
+            if final:
+                raise
+            # incomplete value, wait for more data
+            return False, None
+        if (not final and end == len(self._buf) and
+           self._buf[end - 1].isdigit()):
+            # number can continue in the next chunk
+            return False, None
+        self._pos = end
+
+        return True, obj
+
+    def _parse(self, final):
+        while True:
+            c = self._ws()
+            if not c:
+                return
+
+            if self._state == _START:
+                if c != '{':
+                    raise ValueError('JSON document not an object')
+                self._pos += 1
+                self._state = _KEY
+
+            elif self._state in (_KEY, _DATA_KEY):
+                if c == ',':
+                    self._pos += 1
+                    continue
+                if c == '}':
+                    self._pos += 1
+                    self._state = _DONE if self._state == _KEY else _KEY
+                    continue
+                pos = self._pos
+                ok, key = self._value(final)
+                if not ok:
+                    return
+                c = self._ws()
+                if not c:
+                    if final:
+                        raise ValueError('incomplete JSON document')
+                    self._pos = pos
+                    return
+                if c != ':' or not isinstance(key, str):
+                    raise ValueError('invalid object member at %d' % pos)
+                self._pos += 1
+                self._key = key
+                self._state = (_VALUE if self._state == _KEY
+                               else _DATA_VALUE)
+
+            elif self._state == _VALUE:
+                if self._key == 'data' and c == '[':
+                    self._pos += 1
+                    self.meta['data'] = []
+                    self._in_dict = False
+                    self._state = _ARRAY
+                    continue
+                if self._key == 'data' and c == '{':
+                    self._pos += 1
+                    self.meta['data'] = {}
+                    self._state = _DATA_KEY
+                    continue
+                ok, obj = self._value(final)
+                if not ok:
+                    return
+                self.meta[self._key] = obj
+                self._state = _KEY
+
+            elif self._state == _DATA_VALUE:
+                if c == '[' and (self.data_keys is None or
+                                 self._key in self.data_keys):
+                    self._pos += 1
+                    self.meta['data'][self._key] = []
+                    self._in_dict = True
+                    self._state = _ARRAY
+                    continue
+                ok, obj = self._value(final)
+                if not ok:
+                    return
+                self.meta['data'][self._key] = obj
+                self._state = _DATA_KEY
+
+            elif self._state == _ARRAY:
+                if c == ',':
+                    self._pos += 1
+                    continue
+                if c == ']':
+                    self._pos += 1
+                    self._state = _DATA_KEY if self._in_dict else _KEY
+                    continue
+                ok, obj = self._value(final)
+                if not ok:
+                    return
+                yield obj
+
+            else:
+                raise ValueError('extra data at %d' % self._pos)
@@ -0,0 +1,226 @@
+#
+# Copyright (c) 2022 Palo Alto Networks, Inc.
+#
+# Permission to use, copy, modify, and distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+#
+
+import bisect
+import collections
+import threading
+
+from . import ArgsError
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+           1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+PHASES = ('connect', 'ttfb', 'total')
+
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        # last is +Inf
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, x):
+        self.counts[bisect.bisect_left(self.buckets, x)] += 1
+        self.sum += x
+        self.count += 1
+
+    def cumulative(self):
+        n = 0
+        for le, x in zip(self.buckets + (float('inf'),), self.counts):
+            n += x
+            yield le, n
+
+
+class Metrics:
+    def __init__(self, *, callback=None, buckets=None):
+        if callback is not None and not callable(callback):
+            raise ArgsError('callback not callable')
+        self.callback = callback
+        if buckets is None:
+            self.buckets = BUCKETS
+        else:
+            try:
+                self.buckets = tuple(sorted(float(x) for x in buckets))
+            except (TypeError, ValueError):
+                raise ArgsError('buckets must be a list of numbers')
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            # (method, endpoint, status): count
+            self.requests = collections.Counter()
+            # (method, endpoint, phase): Histogram
+            self.latency = {}
+            # (method, endpoint): bytes
+            self.bytes_sent = collections.Counter()
+            self.bytes_received = collections.Counter()
+            # (method, endpoint, reason): count
+            self.retries = collections.Counter()
+            # reason: seconds
+            self.sleep_seconds = collections.Counter()
+            # (method, endpoint): count
+            self.cache_hits = collections.Counter()
+
+    def _event(self, event):
+        if self.callback is not None:
+            self.callback(event)
+
+    def request(self, *,
+                method,
+                endpoint,
+                status,
+                connect=None,
+                ttfb=None,
+                total=None,
+                bytes_sent=0,
+                bytes_received=0):
+        with self._lock:
+            self.requests[(method, endpoint, status)] += 1
+            for phase, x in zip(PHASES, (connect, ttfb, total)):
+                if x is None:
+                    continue
+                key = (method, endpoint, phase)
+                if key not in self.latency:
+                    self.latency[key] = Histogram(self.buckets)
+                self.latency[key].observe(x)
+            self.bytes_sent[(method, endpoint)] += bytes_sent
+            if bytes_received is not None:
+                # None: length unknown
+                self.bytes_received[(method, endpoint)] += bytes_received
+
+        self._event({
+            'event': 'request',
+            'method': method,
+            'endpoint': endpoint,
+            'status': status,
+            'connect': connect,
+            'ttfb': ttfb,
+            'total': total,
+            'bytes_sent': bytes_sent,
+            'bytes_received': bytes_received,
+        })
+
+    def retry(self, *, method, endpoint, reason):
+        with self._lock:
+            self.retries[(method, endpoint, reason)] += 1
+
+        self._event({
+            'event': 'retry',
+            'method': method,
+            'endpoint': endpoint,
+            'reason': reason,
+        })
+
+    def sleep(self, *, reason, seconds):
+        with self._lock:
+            self.sleep_seconds[reason] += seconds
+
+        self._event({
+            'event': 'sleep',
+            'reason': reason,
+            'seconds': seconds,
+        })
+
+    def cache_hit(self, *, method, endpoint):
+        with self._lock:
+            self.cache_hits[(method, endpoint)] += 1
+
+        self._event({
+            'event': 'cache_hit',
+            'method': method,
+            'endpoint': endpoint,
+        })
+
+    def prometheus(self, *, prefix='pantv'):
+        lines = []
+
+        def header(name, type_, help_):
+            lines.append('# HELP %s_%s %s' % (prefix, name, help_))
+            lines.append('# TYPE %s_%s %s' % (prefix, name, type_))
+
+        def sample(name, labels, value):
+            x = ','.join('%s="%s"' % (k, _escape(v)) for k, v in labels)
+            lines.append('%s_%s{%s} %s' % (prefix, name, x, _value(value)))
+
+        with self._lock:
+            header('requests_total', 'counter',
+                   'API requests by endpoint and status code.')
+            for (method, endpoint, status), x in sorted(
+                    self.requests.items()):
+                sample('requests_total', (('method', method),
+                                          ('endpoint', endpoint),
+                                          ('status', status)), x)
+
+            for phase, help_ in (
+                    ('connect', 'Connection setup time.'),
+                    ('ttfb', 'Time to response headers.'),
+                    ('total', 'Time to response.')):
+                name = 'request_%s_seconds' % phase
+                header(name, 'histogram', help_)
+                for (method, endpoint, phase_), h in sorted(
+                        self.latency.items()):
+                    if phase_ != phase:
+                        continue
+                    labels = (('method', method), ('endpoint', endpoint))
+                    for le, x in h.cumulative():
+                        sample(name + '_bucket', labels + (('le', le),), x)
+                    sample(name + '_sum', labels, h.sum)
+                    sample(name + '_count', labels, h.count)
+
+            for name, counter, help_ in (
+                    ('request_bytes_total', self.bytes_sent,
+                     'Request body bytes sent.'),
+                    ('response_bytes_total', self.bytes_received,
+                     'Response body bytes received.'),
+                    ('cache_hits_total', self.cache_hits,
+                     'Responses returned from the cache.')):
+                header(name, 'counter', help_)
+                for (method, endpoint), x in sorted(counter.items()):
+                    sample(name, (('method', method),
+                                  ('endpoint', endpoint)), x)
+
+            header('retries_total', 'counter',
+                   'Request retries by reason.')
+            for (method, endpoint, reason), x in sorted(
+                    self.retries.items()):
+                sample('retries_total', (('method', method),
+                                         ('endpoint', endpoint),
+                                         ('reason', reason)), x)
+
+            header('sleep_seconds_total', 'counter',
+                   'Time spent sleeping before requests by reason.')
+            for reason, x in sorted(self.sleep_seconds.items()):
+                sample('sleep_seconds_total', (('reason', reason),), x)
+
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(x):
+    if isinstance(x, float):
+        return _value(x)
+    return (str(x).replace('\\', r'\\').replace('"', r'\"').
+            replace('\n', r'\n'))
+
+
+def _value(x):
+    if x == float('inf'):
+        return '+Inf'
+    if isinstance(x, float):
+        return repr(x)
+    return str(x)
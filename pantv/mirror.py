@@ -0,0 +1,300 @@
+#
+# Copyright (c) 2022 Palo Alto Networks, Inc.
+#
+# Permission to use, copy, modify, and distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+#
+
+import json
+import logging
+import re
+import sqlite3
+import time
+
+from . import ApiError, ArgsError, DEBUG1, DEBUG2
+
+# signature types which support fromReleaseVersion
+IPS_TYPES = ('fileformat', 'spyware', 'vulnerability')
+DEFAULT_TYPES = IPS_TYPES
+
+_KEYS = {
+    'cve': ('cve',),
+    'sha256': ('sha256', 'related_sha256_hashes'),
+    'md5': ('md5', 'related_md5_hashes'),
+}
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS threats (
+    type TEXT NOT NULL,
+    id TEXT NOT NULL,
+    name TEXT,
+    release_version INTEGER,
+    release_time TEXT,
+    data TEXT NOT NULL,
+    PRIMARY KEY (type, id)
+);
+CREATE INDEX IF NOT EXISTS threats_id ON threats (id);
+CREATE INDEX IF NOT EXISTS threats_name ON threats (name);
+CREATE TABLE IF NOT EXISTS keys (
+    kind TEXT NOT NULL,
+    value TEXT NOT NULL,
+    type TEXT NOT NULL,
+    id TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS keys_value ON keys (kind, value);
+CREATE INDEX IF NOT EXISTS keys_threat ON keys (type, id);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+'''
+
+
+class ThreatMirror:
+    def __init__(self, path):
+        self._log = logging.getLogger(__name__).log
+        self.path = path
+        try:
+            self.db = sqlite3.connect(path)
+            self.db.executescript(_SCHEMA)
+        except sqlite3.Error as e:
+            raise ArgsError('%s: %s' % (path, e))
+        self._log(DEBUG2, 'sqlite: %s %s', sqlite3.sqlite_version, path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.db.close()
+
+    def _meta(self, key):
+        row = self.db.execute('SELECT value FROM meta WHERE key = ?',
+                              (key,)).fetchone()
+        return None if row is None else row[0]
+
+    def _set_meta(self, key, value):
+        self.db.execute('INSERT OR REPLACE INTO meta VALUES (?, ?)',
+                        (key, value))
+
+    def release_version(self, type):
+        x = self._meta('release_version:' + type)
+        return None if x is None else int(x)
+
+    def release_time(self, type):
+        return self._meta('release_time:' + type)
+
+    def last_sync(self, type):
+        x = self._meta('last_sync:' + type)
+        return None if x is None else float(x)
+
+    def _sync_kwargs(self, type, full):
+        kwargs = {
+            'type': type,
+            'retry': True,
+        }
+        if full:
+            # all signatures; ids not received are removed
+            self.db.execute('CREATE TEMP TABLE IF NOT EXISTS seen '
+                            '(id TEXT PRIMARY KEY)')
+            self.db.execute('DELETE FROM seen')
+        elif type in IPS_TYPES:
+            version = self.release_version(type)
+            if version is not None:
+                kwargs['fromReleaseVersion'] = version
+        else:
+            # virus types: from the date of the latest release time,
+            # YYYY-MM-DD
+            x = self.release_time(type)
+            if x is not None:
+                kwargs['fromReleaseDate'] = x[:10]
+        self._log(DEBUG1, 'sync %s: %s', type, kwargs)
+
+        return kwargs
+
+    def _sync_error(self, type, status, reason):
+        # no threats in release range
+        if status == 404:
+            return
+        raise ApiError('threats_all %s: %s %s' % (type, status, reason))
+
+    def _sync_done(self, type, total, full):
+        if full:
+            cur = self.db.execute('DELETE FROM threats WHERE type = ? AND '
+                                  'id NOT IN (SELECT id FROM seen)',
+                                  (type,))
+            self._log(DEBUG1, 'sync %s: %d threats removed', type,
+                      cur.rowcount)
+            self.db.execute('DELETE FROM keys WHERE type = ? AND '
+                            'id NOT IN (SELECT id FROM seen)', (type,))
+            self.db.execute('DELETE FROM seen')
+        row = self.db.execute('SELECT MAX(release_version), '
+                              'MAX(release_time) FROM threats '
+                              'WHERE type = ?', (type,)).fetchone()
+        if row[0] is not None:
+            self._set_meta('release_version:' + type, row[0])
+        if row[1] is not None:
+            self._set_meta('release_time:' + type, row[1])
+        self._set_meta('last_sync:' + type, time.time())
+        self._log(DEBUG1, 'sync %s: %d threats, release_version %s '
+                  'release_time %s', type, total, row[0], row[1])
+
+    def _store(self, type, threat, full):
+        try:
+            id_ = str(threat['id'])
+        except KeyError:
+            raise ApiError('Malformed response, missing key id')
+        if full:
+            self.db.execute('INSERT OR IGNORE INTO seen VALUES (?)', (id_,))
+        try:
+            version = int(threat.get('latest_release_version'))
+        except (TypeError, ValueError):
+            version = None
+
+        self.db.execute('INSERT OR REPLACE INTO threats '
+                        'VALUES (?, ?, ?, ?, ?, ?)',
+                        (type, id_, threat.get('name'), version,
+                         _release_time(threat), json.dumps(threat)))
+        self.db.execute('DELETE FROM keys WHERE type = ? AND id = ?',
+                        (type, id_))
+        self.db.executemany('INSERT INTO keys VALUES (?, ?, ?, ?)',
+                            [(kind, value, type, id_)
+                             for kind, value in _threat_keys(threat)])
+
+    def sync(self, api, *,
+             types=None,
+             concurrency=None,
+             full=False):
+        totals = {}
+        for type_ in DEFAULT_TYPES if types is None else types:
+            kwargs = self._sync_kwargs(type_, full)
+            total = 0
+            with self.db:
+                for ok, x in api.threats_all(concurrency=concurrency,
+                                             **kwargs):
+                    if not ok:
+                        self._sync_error(type_, x.status_code, x.reason)
+                        break
+                    self._store(type_, x, full)
+                    total += 1
+                self._sync_done(type_, total, full)
+            totals[type_] = total
+
+        return totals
+
+    async def aiosync(self, api, *,
+                      types=None,
+                      concurrency=None,
+                      full=False):
+        totals = {}
+        for type_ in DEFAULT_TYPES if types is None else types:
+            kwargs = self._sync_kwargs(type_, full)
+            total = 0
+            with self.db:
+                async for ok, x in api.threats_all(concurrency=concurrency,
+                                                   **kwargs):
+                    if not ok:
+                        self._sync_error(type_, x.status, x.reason)
+                        break
+                    self._store(type_, x, full)
+                    total += 1
+                self._sync_done(type_, total, full)
+            totals[type_] = total
+
+        return totals
+
+    def threats(self, *,
+                type=None,
+                id=None,
+                name=None,
+                cve=None,
+                sha256=None,
+                md5=None):
+        where = []
+        args = []
+
+        if type is not None:
+            where.append('t.type = ?')
+            args.append(type)
+        if id is not None:
+            where.append('t.id = ?')
+            args.append(str(id))
+        if name is not None:
+            where.append('t.name = ?')
+            args.append(name)
+        for kind, value in (('cve', cve), ('sha256', sha256), ('md5', md5)):
+            if value is None:
+                continue
+            value = _normalize(kind, value)
+            sql = ('EXISTS (SELECT 1 FROM keys k WHERE k.kind = ? AND '
+                   'k.type = t.type AND k.id = t.id AND ')
+            if kind == 'cve' and re.search(r'^CVE-\d{4}$', value):
+                # partial CVE ID: CVE-YYYY
+                where.append(sql + 'k.value >= ? AND k.value < ?)')
+                args.extend([kind, value + '-', value + '.'])
+            else:
+                where.append(sql + 'k.value = ?)')
+                args.extend([kind, value])
+
+        if not where:
+            raise ArgsError('type, id, name, cve, sha256 or md5 required')
+
+        sql = ('SELECT t.data FROM threats t WHERE ' +
+               ' AND '.join(where) + ' ORDER BY t.type, t.id')
+
+        return [json.loads(x[0]) for x in self.db.execute(sql, args)]
+
+    def count(self, type=None):
+        if type is None:
+            row = self.db.execute('SELECT COUNT(*) FROM threats').fetchone()
+        else:
+            row = self.db.execute('SELECT COUNT(*) FROM threats '
+                                  'WHERE type = ?', (type,)).fetchone()
+        return row[0]
+
+
+def _normalize(kind, value):
+    value = str(value)
+    if kind == 'cve':
+        return value.upper()
+    return value.lower()
+
+
+def _release_time(threat):
+    # ISO 8601 UTC times compare as strings
+    x = threat.get('latest_release_time')
+    if isinstance(x, str) and x:
+        return x
+    # virus types: last release time by product
+    times = [y.get('last_release_time')
+             for y in (threat.get('release') or {}).values()
+             if isinstance(y, dict)]
+    times = [y for y in times if isinstance(y, str) and y]
+
+    return max(times) if times else None
+
+
+def _threat_keys(threat):
+    keys = set()
+    for kind, fields in _KEYS.items():
+        for field in fields:
+            x = threat.get(field)
+            if not x:
+                continue
+            if isinstance(x, str):
+                x = [x]
+            for value in x:
+                keys.add((kind, _normalize(kind, value)))
+
+    return keys
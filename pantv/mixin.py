@@ -14,15 +14,70 @@
 # OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
 #
 
-import aiohttp
-import logging
-import requests
-import requests.adapters
-import ssl
+import time
 
-from . import ArgsError, DEBUG1, DEBUG2, DEBUG3
+from . import ApiError, ArgsError, DEBUG1, EDL_NAMES
+from . import jsonstream, ratelimit, tracing
 
 API_KEY_HEADER = 'x-api-key'
+THREATS2_BATCH_SIZE = 100
+
+# threat fields with hash values
+_HASH_KEYS = {
+    'sha256': ('sha256', 'related_sha256_hashes'),
+    'md5': ('md5', 'related_md5_hashes'),
+}
+
+# (method, API resource path): span name
+_SPAN_NAMES = {
+    ('GET', 'threats'): 'threats',
+    ('POST', 'threats'): 'threats2',
+    ('GET', 'threats/history'): 'threats_history',
+    ('GET', 'release-notes'): 'release_notes',
+    ('GET', 'edl'): 'edl',
+    ('POST', 'atp/reports'): 'atp_reports',
+    ('GET', 'atp/reports/pcaps'): 'atp_reports_pcaps',
+}
+
+
+def _threats2_value(key, value):
+    if key in ('sha256', 'md5'):
+        return str(value).strip().lower()
+    return str(value)
+
+
+def _threats_page(obj):
+    # count and items of a /threats response
+    try:
+        items = [x for k in obj['data'] for x in obj['data'][k]]
+        count = obj['count']
+    except KeyError as e:
+        raise ApiError('Malformed response, '
+                       'missing key %s' % e)
+
+    return count, items
+
+
+def _threats2_merge(key, obj, results):
+    # append threats in a threats2 response to the results list
+    # of each lookup value
+    count, threats = _threats_page(obj)
+    for threat in threats:
+        if key in ('id', 'name'):
+            values = [threat.get(key)]
+        else:
+            # hash can be in sha256, md5 or related_*_hashes
+            values = []
+            for k in _HASH_KEYS[key]:
+                x = threat.get(k)
+                if isinstance(x, str):
+                    values.append(x)
+                elif isinstance(x, list):
+                    values.extend(y for y in x if isinstance(y, str))
+        for x in set(_threats2_value(key, y) for y in values
+                     if y is not None):
+            if x in results:
+                results[x].append(threat)
 
 
 class _MixinShared:
@@ -32,125 +87,278 @@ class _MixinShared:
 
         return {API_KEY_HEADER: api_key}
 
+    def _rate_limiter(self, rate_limit):
+        if rate_limit is None or rate_limit is False:
+            return
+        if rate_limit is True:
+            return ratelimit.RateLimiter()
+        if isinstance(rate_limit, ratelimit.RateLimiter):
+            return rate_limit
+
+        raise ArgsError('rate_limit must be bool or RateLimiter')
+
+    def _cache(self, cache):
+        if cache is None or cache is False:
+            return
+        from . import cache as cache_
+        if cache is True:
+            return cache_.ResponseCache()
+        if isinstance(cache, cache_.ResponseCache):
+            return cache
+
+        raise ArgsError('cache must be bool or ResponseCache')
+
+    def _metrics(self, metrics):
+        if metrics is None or metrics is False:
+            return
+        from . import metrics as metrics_
+        if metrics is True:
+            return metrics_.Metrics()
+        if isinstance(metrics, metrics_.Metrics):
+            return metrics
+
+        raise ArgsError('metrics must be bool or Metrics')
+
+    def _endpoint(self, func, kwargs):
+        # metrics labels: method, API resource path
+        return func.__name__.upper(), kwargs['url'][len(self.url):]
+
+    def _tracer(self, tracer):
+        if tracer is None:
+            return tracing.NoopTracer()
+        if not hasattr(tracer, 'start_as_current_span'):
+            raise ArgsError('tracer must implement start_as_current_span()')
+
+        return tracer
+
+    def _request_span(self, func, kwargs):
+        method, endpoint = self._endpoint(func, kwargs)
+        # /service/v1/threats/history -> threats/history
+        path = endpoint.split('/', 3)[-1]
+        attributes = {
+            'http.request.method': method,
+            'url.path': endpoint,
+        }
+        params = kwargs.get('params') or {}
+        for k in ('offset', 'limit'):
+            if params.get(k) is not None:
+                attributes['pantv.' + k] = params[k]
+
+        return self.tracer.start_as_current_span(
+            'pantv.' + _SPAN_NAMES.get((method, path), path),
+            attributes=attributes)
+
+    def _page_span(self, func, kwargs):
+        return self.tracer.start_as_current_span(
+            'pantv.%s_all.page' % func.__name__,
+            attributes={
+                'pantv.offset': kwargs['offset'],
+                'pantv.limit': kwargs['limit'],
+            })
 
-class AioMixin(_MixinShared):
-    async def __aenter__(self):
-        self._log(DEBUG2, '%s', '__aenter__')
-        return self
+    def _on_cache(self, span, func, kwargs, state):
+        span.set_attribute('pantv.cache', state)
+        if self.metrics is not None and state != 'revalidated':
+            method, endpoint = self._endpoint(func, kwargs)
+            self.metrics.cache_hit(method=method, endpoint=endpoint)
 
-    async def __aexit__(self, *args):
-        self._log(DEBUG2, '%s', '__aexit__')
-        if not self.session.closed:
-            self._log(DEBUG1, 'closing aiohttp session')
-            await self.session.close()
+    def _on_retry(self, span, counts, func, kwargs, reason):
+        counts['pantv.retries'] = counts.get('pantv.retries', 0) + 1
+        span.set_attribute('pantv.retries', counts['pantv.retries'])
+        span.add_event('retry', {'pantv.reason': reason})
+        if self.metrics is not None:
+            method, endpoint = self._endpoint(func, kwargs)
+            self.metrics.retry(method=method, endpoint=endpoint,
+                               reason=reason)
 
-    def _timeout(self, timeout):
-        if timeout is None:
+    def _on_sleep(self, span, counts, reason, seconds):
+        k = 'pantv.sleep.' + reason
+        counts[k] = counts.get(k, 0) + seconds
+        span.set_attribute(k, counts[k])
+        span.add_event('sleep', {'pantv.reason': reason,
+                                 'pantv.seconds': seconds})
+        if self.metrics is not None:
+            self.metrics.sleep(reason=reason, seconds=seconds)
+
+    def _cache_key(self, func, kwargs):
+        if self.cache is None:
             return
 
-        if isinstance(timeout, tuple):
-            if len(timeout) != 2:
-                raise ArgsError('timeout tuple length must be 2')
-            x = aiohttp.ClientTimeout(sock_connect=timeout[0],
-                                      sock_read=timeout[1])
+        return self.cache.key(func.__name__.upper(),
+                              kwargs['url'][len(self.url):],
+                              kwargs.get('params'),
+                              kwargs.get('json'))
+
+    def _concurrency(self, concurrency):
+        if concurrency is None:
+            return 1
+
+        try:
+            concurrency = int(concurrency)
+        except ValueError:
+            raise ArgsError('concurrency not int')
+        if concurrency < 1:
+            raise ArgsError('concurrency must be greater than 0')
+
+        return concurrency
+
+    def _edl_names(self, names):
+        if names is None:
+            raise ArgsError('names required')
+        if isinstance(names, str):
+            names = [names]
+        # dedupe preserving input order
+        names = list(dict.fromkeys(names))
+        if not names:
+            raise ArgsError('names required')
+
+        return names
+
+    def _edl_lookup_args(self, ipaddrs, names):
+        if ipaddrs is None:
+            raise ArgsError('ipaddrs required')
+        if isinstance(ipaddrs, str):
+            ipaddrs = [ipaddrs]
+        # dedupe preserving input order
+        ipaddrs = list(dict.fromkeys(ipaddrs))
+        if names is not None:
+            names = self._edl_names(names)
+
+        return ipaddrs, names
+
+    def _edl_lookup_snapshot(self, snapshot, ipaddrs, names, max_age):
+        # results from the snapshot for the fresh EDLs, and the fresh
+        # EDL names, or None when all EDLs are fresh
+        results = {x: [] for x in ipaddrs}
+        if snapshot is None:
+            return results, []
+        if names is None:
+            # all EDLs: each predefined EDL must be in the snapshot
+            names = sorted(set(EDL_NAMES).union(snapshot.names()))
+
+        now = time.time()
+        fresh = []
+        for name in names:
+            x = snapshot.last_sync(name)
+            if x is None or (max_age is not None and now - x > max_age):
+                self._log(DEBUG1, 'edl_lookup: %s not fresh in snapshot',
+                          name)
+                continue
+            fresh.append(name)
+
+        for name in sorted(fresh):
+            index = snapshot.index(name)
+            for ipaddr, found in zip(ipaddrs, index.lookup(ipaddrs)):
+                if found:
+                    results[ipaddr].append(name)
+        self._log(DEBUG1, 'edl_lookup: %d addresses from snapshot, '
+                  'EDLs %s', len(ipaddrs), fresh)
+
+        if len(fresh) == len(names):
+            return results, None
+        return results, fresh
+
+    def _edl_lookup_names(self, obj, names, fresh):
+        # EDL names from the API, except those from the snapshot
+        try:
+            x = set(item['name'] for item in obj['data'])
+        except (KeyError, TypeError) as e:
+            raise ApiError('Malformed response, '
+                           'missing key %s' % e)
+        if names is not None:
+            x.intersection_update(names)
+        x.difference_update(fresh)
+
+        return list(x)
+
+    def _threats2_batches(self, *,
+                          id=None,
+                          name=None,
+                          sha256=None,
+                          md5=None,
+                          batch_size=None):
+        args = [(k, v) for k, v in (('id', id), ('name', name),
+                                    ('sha256', sha256), ('md5', md5))
+                if v is not None]
+        if len(args) != 1:
+            raise ArgsError('one of id, name, sha256 or md5 required')
+        key, values = args[0]
+        if isinstance(values, (str, int)):
+            values = [values]
+
+        if batch_size is None:
+            batch_size = THREATS2_BATCH_SIZE
         else:
-            x = aiohttp.ClientTimeout(total=timeout)
+            try:
+                batch_size = int(batch_size)
+            except ValueError:
+                raise ArgsError('batch_size not int')
+            if batch_size < 1:
+                raise ArgsError('batch_size must be greater than 0')
+
+        # dedupe preserving input order
+        values = list(dict.fromkeys(_threats2_value(key, x)
+                                    for x in values))
+        batches = [values[i:i+batch_size]
+                   for i in range(0, len(values), batch_size)]
+        results = {x: [] for x in values}
 
-        return x
+        return key, batches, results
 
-    def _ssl_context(self, verify):
-        context = ssl.create_default_context(purpose=ssl.Purpose.SERVER_AUTH)
+    def _all_parser(self, threats):
+        # EDL data object: only the ipaddr array, as _all_page()
+        return jsonstream.PageParser(None if threats else ('ipaddr',))
 
-        if isinstance(verify, bool):
-            if not verify:
-                context.check_hostname = False
-                context.verify_mode = ssl.CERT_NONE
-        elif verify is not None:
+    def _all_feed(self, parser, chunk):
+        # chunk is None at the end of the response body
+        try:
+            if chunk is None:
+                return parser.close()
+            return parser.feed(chunk)
+        except ValueError as e:
+            raise ApiError('Malformed response, %s' % e)
+
+    def _all_count(self, threats, meta):
+        # count from a streamed page
+        data = meta.get('data')
+        if not (isinstance(data, list) or
+                (isinstance(data, dict) and (threats or 'ipaddr' in data))):
+            raise ApiError('Malformed response, '
+                           'data not list or dict')
+        try:
+            return meta['count']
+        except KeyError as e:
+            raise ApiError('Malformed response, '
+                           'missing key %s' % e)
+
+    def _all_page(self, threats, obj):
+        if threats:
+            count, items = _threats_page(obj)
+        else:
             try:
-                context.load_verify_locations(cafile=verify)
-            except (FileNotFoundError, ssl.SSLError) as e:
-                raise ValueError('%s: %s' % (verify, e))
-
-        return context
-
-    def _session(self, auth=None, timeout=None):
-        async def on_request_start(session, trace_config_ctx, params):
-            log = logging.getLogger(__name__).log
-            log(DEBUG2, '%s %s', params.method, params.url)
-            for k, v in params.headers.items():
-                x = '*' * 6 if k == API_KEY_HEADER else v
-                log(DEBUG3, '%s: %s', k, x)
-
-        async def on_request_chunk_sent(session, trace_config_ctx, params):
-            log = logging.getLogger(__name__).log
-            if params.chunk:
-                log(DEBUG3, '%s', params.chunk)
-
-        async def on_request_end(session, trace_config_ctx, params):
-            log = logging.getLogger(__name__).log
-            log(DEBUG1, '%s %s %s %s %s',
-                params.method,
-                params.url,
-                params.response.status,
-                params.response.reason,
-                params.response.headers.get('content-length'))
-            for k, v in params.response.headers.items():
-                log(DEBUG3, '%s: %s', k, v)
-
-        kwargs = {}
-        if auth is not None:
-            kwargs['headers'] = auth
-        if timeout is not None:
-            kwargs['timeout'] = timeout
-
-        if (logging.getLogger(__name__).getEffectiveLevel() in
-           [DEBUG1, DEBUG2, DEBUG3]):
-            trace_config = aiohttp.TraceConfig()
-            trace_config.on_request_start.append(on_request_start)
-            trace_config.on_request_chunk_sent.append(on_request_chunk_sent)
-            trace_config.on_request_end.append(on_request_end)
-            kwargs['trace_configs'] = [trace_config]
-
-        return aiohttp.ClientSession(**kwargs)
-
-
-class _TimeoutHTTPAdapter(requests.adapters.HTTPAdapter):
-    def __init__(self, *args, **kwargs):
-        self.timeout = None
-        if 'timeout' in kwargs:
-            self.timeout = kwargs['timeout']
-            del kwargs['timeout']
-        super().__init__(*args, **kwargs)
-
-    def send(self, request, **kwargs):
-        timeout = kwargs.get('timeout')
-        if timeout is None:
-            kwargs['timeout'] = self.timeout
-        return super().send(request, **kwargs)
-
-
-class Mixin(_MixinShared):
-    def __enter__(self):
-        self._log(DEBUG2, '%s', '__enter__')
-        return self
-
-    def __exit__(self, *args):
-        self._log(DEBUG2, '%s', '__exit__')
-        self._log(DEBUG1, 'closing requests session')
-        self.session.close()
-
-    def _session(self,
-                 auth=None,
-                 verify=None,
-                 timeout=None):
-        session = requests.Session()
-
-        if auth is not None:
-            session.headers.update(auth)
-        if verify is not None:
-            session.verify = verify
-        if timeout is not None:
-            adapter = _TimeoutHTTPAdapter(timeout=timeout)
-            session.mount("https://", adapter)
-
-        return session
+                if isinstance(obj['data'], list):
+                    items = obj['data']
+                elif (isinstance(obj['data'], dict) and
+                      'ipaddr' in obj['data']):
+                    items = obj['data']['ipaddr']
+                else:
+                    raise ApiError('Malformed response, '
+                                   'data not list or dict')
+                count = obj['count']
+            except KeyError as e:
+                raise ApiError('Malformed response, '
+                               'missing key %s' % e)
+
+        return count, items
+
+
+def __getattr__(name):
+    # transport mixins are imported on use, so only the HTTP client
+    # library for the selected class implementation is loaded
+    if name == 'AioMixin':
+        from . import aiomixin
+        return aiomixin.AioMixin
+    if name == 'Mixin':
+        from . import reqmixin
+        return reqmixin.Mixin
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
@@ -0,0 +1,219 @@
+#
+# Copyright (c) 2022 Palo Alto Networks, Inc.
+#
+# Permission to use, copy, modify, and distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+#
+
+import contextlib
+import json
+import logging
+import os
+import threading
+import time
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from . import ArgsError, DEBUG2, DEBUG3
+
+MINUTE_LIMIT = 'x-minute-ratelimit-limit'
+MINUTE_REMAINING = 'x-minute-ratelimit-remaining'
+MINUTE_RESET = 'x-minute-ratelimit-reset'
+DAY_REMAINING = 'x-day-ratelimit-remaining'
+
+WINDOW = 60
+
+
+def _new_state():
+    return {
+        'limit': None,
+        'remaining': None,
+        'reset': None,
+        'day_remaining': None,
+        'tat': 0.0,
+        # send times of requests without a response
+        'inflight': [],
+    }
+
+
+class RateLimiter:
+    def __init__(self, *, burst=1):
+        self._log = logging.getLogger(__name__).log
+        try:
+            self.burst = int(burst)
+        except ValueError:
+            raise ArgsError('burst not int')
+        if self.burst < 1:
+            raise ArgsError('burst must be greater than 0')
+        self._lock = threading.Lock()
+        self._state = _new_state()
+
+    @contextlib.contextmanager
+    def _locked(self):
+        with self._lock:
+            yield self._state
+
+    def reserve(self):
+        now = time.time()
+        with self._locked() as state:
+            delay = self._reserve(state, now)
+
+        return delay
+
+    async def aioreserve(self):
+        return self.reserve()
+
+    def update(self, headers):
+        # headers is None when the request failed without a response
+        now = time.time()
+        try:
+            limit = int(headers.get(MINUTE_LIMIT))
+            remaining = int(headers.get(MINUTE_REMAINING))
+            reset = int(headers.get(MINUTE_RESET))
+        except (AttributeError, TypeError, ValueError):
+            limit = None
+        try:
+            day_remaining = int(headers.get(DAY_REMAINING))
+        except (AttributeError, TypeError, ValueError):
+            day_remaining = None
+
+        with self._locked() as state:
+            inflight = self._inflight(state, now)
+            if inflight:
+                # responses can arrive out of order, release the
+                # oldest request
+                inflight.pop(0)
+            if limit is not None:
+                self._update(state, limit, remaining, reset,
+                             day_remaining)
+
+    async def aioupdate(self, headers):
+        self.update(headers)
+
+    def _inflight(self, state, now):
+        # requests without a response after a window are assumed lost
+        state['inflight'] = [x for x in state['inflight']
+                             if x > now - WINDOW]
+        return state['inflight']
+
+    def _reserve(self, state, now):
+        inflight = self._inflight(state, now)
+        limit = state['limit']
+        if limit is None or limit < 1:
+            # no quota learned yet; the request is charged when the
+            # first response sets the quota
+            inflight.append(now)
+            return 0
+
+        if state['day_remaining'] is not None:
+            if state['day_remaining'] < 1:
+                # pacing cannot help, let the server respond
+                inflight.append(now)
+                return 0
+            state['day_remaining'] -= 1
+
+        reset = state['reset']
+        while now >= reset:
+            # window rolled over since the last response
+            reset += WINDOW
+            state['remaining'] = limit
+        state['reset'] = reset
+
+        tau = (self.burst - 1) * WINDOW / limit
+        # GCRA: earliest time the request conforms to the rate
+        allowed = max(now, state['tat'] - tau)
+        while state['remaining'] < 1 or allowed >= state['reset']:
+            # budget spent, wait for the next window
+            allowed = max(allowed, state['reset'])
+            state['reset'] += WINDOW
+            state['remaining'] = limit
+        allowed = max(allowed, state['reset'] - WINDOW)
+
+        # spread the remaining requests over the rest of the window
+        tat = max(state['tat'], allowed)
+        interval = max(state['reset'] - tat, 0) / state['remaining']
+        state['tat'] = tat + interval
+        state['remaining'] -= 1
+
+        delay = max(0, allowed - now)
+        inflight.append(now + delay)
+        self._log(DEBUG3, 'rate limit: remaining %d reset %d delay %.2fs '
+                  'inflight %d', state['remaining'], state['reset'], delay,
+                  len(inflight))
+
+        return delay
+
+    def _update(self, state, limit, remaining, reset, day_remaining):
+        state['limit'] = limit
+        # requests reserved after this response was sent are not
+        # counted by the server yet
+        pending = len(state['inflight'])
+        if day_remaining is not None:
+            day_remaining = max(day_remaining - pending, 0)
+        state['day_remaining'] = day_remaining
+        remaining = max(remaining - pending, 0)
+        if state['reset'] is None or reset > state['reset']:
+            self._log(DEBUG2, 'rate limit: limit %d remaining %d reset %d '
+                      'inflight %d', limit, remaining, reset, pending)
+            state['reset'] = reset
+            state['remaining'] = remaining
+        elif reset == state['reset']:
+            # responses can arrive out of order, keep the lower count
+            state['remaining'] = min(state['remaining'], remaining)
+
+
+class SharedRateLimiter(RateLimiter):
+    def __init__(self, path, *, burst=1):
+        if fcntl is None:
+            raise ArgsError('SharedRateLimiter requires fcntl module')
+        super().__init__(burst=burst)
+        self.path = path
+        try:
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        except OSError as e:
+            raise ArgsError('%s: %s' % (path, e))
+        os.close(fd)
+
+    # flock() blocks, so the asyncio methods lock the file in the
+    # default executor
+    async def aioreserve(self):
+        import asyncio
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.reserve)
+
+    async def aioupdate(self, headers):
+        import asyncio
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self.update, headers)
+
+    @contextlib.contextmanager
+    def _locked(self):
+        # open for each use: a descriptor inherited across fork()
+        # shares the flock() lock with the parent
+        with self._lock, open(self.path, 'r+') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                try:
+                    state = json.loads(f.read())
+                    if set(state) != set(_new_state()):
+                        raise ValueError('invalid state')
+                except ValueError:
+                    state = _new_state()
+                yield state
+                f.seek(0)
+                f.truncate()
+                f.write(json.dumps(state))
+                f.flush()
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
@@ -0,0 +1,198 @@
+#
+# Copyright (c) 2022 Palo Alto Networks, Inc.
+#
+# Permission to use, copy, modify, and distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+#
+
+import requests
+import requests.adapters
+import requests.structures
+import threading
+import time
+import urllib3
+import urllib3.connection
+
+from . import ArgsError, DEBUG1, DEBUG2
+from .mixin import _MixinShared
+
+
+# connection setup time of the last request in this thread
+_connect_time = threading.local()
+
+
+class _HTTPConnection(urllib3.connection.HTTPConnection):
+    def connect(self):
+        t = time.perf_counter()
+        super().connect()
+        _connect_time.value = time.perf_counter() - t
+
+
+class _HTTPSConnection(urllib3.connection.HTTPSConnection):
+    def connect(self):
+        t = time.perf_counter()
+        super().connect()
+        _connect_time.value = time.perf_counter() - t
+
+
+class _HTTPConnectionPool(urllib3.HTTPConnectionPool):
+    ConnectionCls = _HTTPConnection
+
+
+class _HTTPSConnectionPool(urllib3.HTTPSConnectionPool):
+    ConnectionCls = _HTTPSConnection
+
+
+class _TimeoutHTTPAdapter(requests.adapters.HTTPAdapter):
+    def __init__(self, *args, **kwargs):
+        self.timeout = None
+        if 'timeout' in kwargs:
+            self.timeout = kwargs['timeout']
+            del kwargs['timeout']
+        self.connect_timing = kwargs.pop('connect_timing', False)
+        super().__init__(*args, **kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        if self.connect_timing:
+            self.poolmanager.pool_classes_by_scheme = {
+                'http': _HTTPConnectionPool,
+                'https': _HTTPSConnectionPool,
+            }
+
+    def send(self, request, **kwargs):
+        timeout = kwargs.get('timeout')
+        if timeout is None:
+            kwargs['timeout'] = self.timeout
+        return super().send(request, **kwargs)
+
+
+class Mixin(_MixinShared):
+    def __enter__(self):
+        self._log(DEBUG2, '%s', '__enter__')
+        return self
+
+    def __exit__(self, *args):
+        self._log(DEBUG2, '%s', '__exit__')
+        if self._revalidations:
+            self._log(DEBUG1, 'waiting for %d cache revalidations',
+                      len(self._revalidations))
+            for thread in list(self._revalidations):
+                thread.join()
+        # closes the adapter shared by thread sessions
+        self._log(DEBUG1, 'closing requests session')
+        self.session.close()
+
+    @property
+    def session(self):
+        if self._local is None:
+            return self._shared_session
+
+        # thread_safe: a session per thread, with a shared adapter
+        # and connection pool
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            self._log(DEBUG2, 'requests session for thread %s',
+                      threading.current_thread().name)
+            session = self._session(**self._session_kwargs)
+            self._local.session = session
+
+        return session
+
+    @session.setter
+    def session(self, session):
+        # session was an attribute; with thread_safe only the current
+        # thread's session is replaced
+        if self._local is None:
+            self._shared_session = session
+        else:
+            self._local.session = session
+
+    def _adapter(self, *,
+                 timeout=None,
+                 connect_timing=False,
+                 pool_connections=None,
+                 pool_maxsize=None,
+                 pool_block=None):
+        kwargs = {}
+        for k, v in (('pool_connections', pool_connections),
+                     ('pool_maxsize', pool_maxsize)):
+            if v is None:
+                continue
+            try:
+                v = int(v)
+            except ValueError:
+                raise ArgsError('%s not int' % k)
+            if v < 1:
+                raise ArgsError('%s must be greater than 0' % k)
+            kwargs[k] = v
+        if pool_block is not None:
+            kwargs['pool_block'] = bool(pool_block)
+        self._log(DEBUG2, 'adapter: timeout %s %s', timeout, kwargs)
+
+        return _TimeoutHTTPAdapter(timeout=timeout,
+                                   connect_timing=connect_timing,
+                                   **kwargs)
+
+    def _session(self,
+                 auth=None,
+                 verify=None,
+                 adapter=None,
+                 keepalive=None):
+        session = requests.Session()
+
+        if auth is not None:
+            session.headers.update(auth)
+        if verify is not None:
+            session.verify = verify
+        if keepalive is not None and not keepalive:
+            session.headers['Connection'] = 'close'
+        if adapter is not None:
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+
+        return session
+
+    def _metrics_request(self, func, kwargs, resp, start):
+        method, endpoint = self._endpoint(func, kwargs)
+        total = time.perf_counter() - start
+        connect = getattr(_connect_time, 'value', None)
+        _connect_time.value = None
+
+        body = resp.request.body if resp.request is not None else None
+        bytes_sent = len(body) if body is not None else 0
+        try:
+            bytes_received = int(resp.headers['content-length'])
+        except (KeyError, ValueError):
+            # stream: body not read yet, length unknown
+            bytes_received = (len(resp.content)
+                              if not kwargs.get('stream') else None)
+
+        self.metrics.request(method=method,
+                             endpoint=endpoint,
+                             status=resp.status_code,
+                             connect=connect,
+                             ttfb=resp.elapsed.total_seconds(),
+                             total=total,
+                             bytes_sent=bytes_sent,
+                             bytes_received=bytes_received)
+
+    def _cached_response(self, entry, url):
+        resp = requests.Response()
+        resp.status_code = entry.status
+        resp.reason = entry.reason
+        resp.headers = requests.structures.CaseInsensitiveDict(entry.headers)
+        resp.url = url
+        resp._content = entry.body
+        resp._content_consumed = True
+
+        return resp
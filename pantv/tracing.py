@@ -0,0 +1,131 @@
+#
+# Copyright (c) 2022 Palo Alto Networks, Inc.
+#
+# Permission to use, copy, modify, and distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+#
+
+# Subset of the OpenTelemetry Tracer and Span API used by
+# ThreatVaultApi; an opentelemetry.trace.Tracer can be used instead.
+
+import contextlib
+import contextvars
+import threading
+import time
+
+
+class NoopSpan:
+    def set_attribute(self, key, value):
+        pass
+
+    def set_attributes(self, attributes):
+        pass
+
+    def add_event(self, name, attributes=None, timestamp=None):
+        pass
+
+    def record_exception(self, exception, attributes=None,
+                         timestamp=None, escaped=False):
+        pass
+
+    def is_recording(self):
+        return False
+
+    def end(self, end_time=None):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+
+_NOOP_SPAN = NoopSpan()
+
+
+class NoopTracer:
+    def start_as_current_span(self, name, context=None, kind=None,
+                              attributes=None, **kwargs):
+        return _NOOP_SPAN
+
+    def start_span(self, name, context=None, kind=None,
+                   attributes=None, **kwargs):
+        return _NOOP_SPAN
+
+
+class RecordedSpan(NoopSpan):
+    def __init__(self, name, parent, attributes):
+        self.name = name
+        self.parent = parent
+        self.attributes = dict(attributes or {})
+        self.events = []
+        self.exception = None
+        self.start_time = time.time()
+        self.end_time = None
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def set_attributes(self, attributes):
+        self.attributes.update(attributes)
+
+    def add_event(self, name, attributes=None, timestamp=None):
+        self.events.append((name, dict(attributes or {}),
+                            time.time() if timestamp is None
+                            else timestamp))
+
+    def record_exception(self, exception, attributes=None,
+                         timestamp=None, escaped=False):
+        self.exception = exception
+
+    def is_recording(self):
+        return self.end_time is None
+
+    def end(self, end_time=None):
+        if self.end_time is None:
+            self.end_time = time.time() if end_time is None else end_time
+
+    @property
+    def duration(self):
+        if self.end_time is None:
+            return
+        return self.end_time - self.start_time
+
+
+class RecordingTracer:
+    # Keeps finished spans in memory, for tests and troubleshooting
+    # without an OpenTelemetry SDK.
+    def __init__(self):
+        self.spans = []
+        self._lock = threading.Lock()
+        self._current = contextvars.ContextVar('pantv_span', default=None)
+
+    def start_span(self, name, context=None, kind=None,
+                   attributes=None, **kwargs):
+        return RecordedSpan(name, self._current.get(), attributes)
+
+    @contextlib.contextmanager
+    def start_as_current_span(self, name, context=None, kind=None,
+                              attributes=None, **kwargs):
+        span = self.start_span(name, attributes=attributes)
+        token = self._current.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.record_exception(e)
+            raise
+        finally:
+            self._current.reset(token)
+            span.end()
+            with self._lock:
+                self.spans.append(span)
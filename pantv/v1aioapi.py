@@ -16,27 +16,40 @@
 
 import aiohttp
 import asyncio
+import collections
+import itertools
 import logging
 import ssl
 import sys
 import time
 
-from . import (mixin, ApiError, ArgsError,
+from . import (aiomixin, jsonstream, ApiError, ArgsError,
                DEBUG1, DEBUG2, DEBUG3,
                title, __version__,
                DEFAULT_URL)
+from .mixin import _threats2_merge
 
 
 BASE_PATH = '/service/v1'
 
 
-class ThreatVaultApi(mixin.AioMixin):
+class ThreatVaultApi(aiomixin.AioMixin):
     def __init__(self, *,
                  api_version=None,
                  url=None,
                  api_key=None,
                  verify=None,
-                 timeout=None):
+                 timeout=None,
+                 rate_limit=None,
+                 cache=None,
+                 metrics=None,
+                 tracer=None,
+                 connector=None,
+                 limit=None,
+                 limit_per_host=None,
+                 keepalive_timeout=None,
+                 ttl_dns_cache=None,
+                 force_close=None):
 
         self._log = logging.getLogger(__name__).log
         self._log(DEBUG2, '%s: %s, ThreatVaultApi: %s',
@@ -59,27 +72,95 @@ class ThreatVaultApi(mixin.AioMixin):
         auth = self._auth(api_key)
         timeout_ = self._timeout(timeout)
         self._log(DEBUG2, 'timeout: %s', timeout_)
-        self.session = self._session(auth=auth, timeout=timeout_)
+        self.metrics = self._metrics(metrics)
+        connector_ = self._connector(connector=connector,
+                                     limit=limit,
+                                     limit_per_host=limit_per_host,
+                                     keepalive_timeout=keepalive_timeout,
+                                     ttl_dns_cache=ttl_dns_cache,
+                                     force_close=force_close)
+        self.session = self._session(auth=auth, timeout=timeout_,
+                                     metrics=self.metrics is not None,
+                                     connector=connector_,
+                                     connector_owner=connector is None)
+        self.rate_limiter = self._rate_limiter(rate_limit)
+        self.cache = self._cache(cache)
+        self.tracer = self._tracer(tracer)
+        self._revalidations = set()
 
     async def _request_retry(self, *,
-                             retry=False,
-                             retry_timeout=False,
                              func=None,
                              **kwargs):
+        with self._request_span(func, kwargs) as span:
+            resp = await self._request_retry_span(span, func=func,
+                                                  **kwargs)
+            span.set_attribute('http.response.status_code', resp.status)
+
+        return resp
+
+    async def _request_retry_span(self, span, *,
+                                  retry=False,
+                                  retry_timeout=False,
+                                  cache=True,
+                                  stream=False,
+                                  func=None,
+                                  **kwargs):
+        # retries and sleep time
+        counts = {}
         if retry_timeout:
             timeout_delay = 5
             timeout_retries = 3
+        # a cached response body is read in full
+        cache_key = None if stream else self._cache_key(func, kwargs)
+        stale = None
+        if cache and cache_key is not None:
+            entry = self.cache.get(cache_key)
+            if entry is not None and entry.fresh():
+                self._on_cache(span, func, kwargs, 'hit')
+                return self._cached_response(entry, kwargs['url'])
+            elif entry is not None and entry.validators():
+                # conditional request
+                stale = entry
+                kwargs['headers'] = {**(kwargs.get('headers') or {}),
+                                     **entry.validators()}
+            elif entry is not None:
+                # serve stale while revalidating
+                self._cache_revalidate(func, kwargs, cache_key)
+                self._on_cache(span, func, kwargs, 'stale')
+                return self._cached_response(entry, kwargs['url'])
+
         while True:
+            if self.rate_limiter is not None:
+                delay = await self.rate_limiter.aioreserve()
+                if delay > 0:
+                    self._log(DEBUG2, 'rate limit, sleep %.2fs', delay)
+                    self._on_sleep(span, counts, 'rate_limit', delay)
+                    await asyncio.sleep(delay)
+            timing = {} if self.metrics is not None else None
+            start = time.perf_counter()
             try:
-                resp = await func(**kwargs)
+                resp = await func(trace_request_ctx=timing, **kwargs)
             except asyncio.TimeoutError:
+                if self.rate_limiter is not None:
+                    # no response
+                    await self.rate_limiter.aioupdate(None)
                 if not (retry_timeout and timeout_retries):
                     raise
                 self._log(DEBUG2, 'timeout, sleep %.2fs', timeout_delay)
+                self._on_retry(span, counts, func, kwargs, 'timeout')
+                self._on_sleep(span, counts, 'timeout', timeout_delay)
                 await asyncio.sleep(timeout_delay)
                 timeout_delay *= 2
                 timeout_retries -= 1
+            except BaseException:
+                if self.rate_limiter is not None:
+                    await self.rate_limiter.aioupdate(None)
+                raise
             else:
+                if self.metrics is not None:
+                    self._metrics_request(func, kwargs, resp, start, timing)
+                if self.rate_limiter is not None:
+                    await self.rate_limiter.aioupdate(resp.headers)
                 if retry and resp.status == 429:
                     now = time.time()
                     day_remaining = \
@@ -97,16 +178,55 @@ class ThreatVaultApi(mixin.AioMixin):
                         self._log(DEBUG1, '%s', e)
                         break
 
+                    # release connection before sleep
+                    resp.release()
+                    self._on_retry(span, counts, func, kwargs, '429')
                     if minute_reset > now:
                         rate_limit_delay = minute_reset - now
                         self._log(DEBUG2, 'status code 429, sleep %.2fs',
                                   rate_limit_delay)
+                        self._on_sleep(span, counts, '429',
+                                       rate_limit_delay)
                         await asyncio.sleep(rate_limit_delay)
                 else:
                     break
 
+        if (cache_key is not None and resp.status == 304 and
+           stale is not None):
+            resp.release()
+            entry = stale.revalidated(resp.headers)
+            self.cache.put(cache_key, entry)
+            self._on_cache(span, func, kwargs, 'revalidated')
+            return self._cached_response(entry, kwargs['url'])
+        if cache_key is not None and resp.status == 200:
+            body = await resp.read()
+            entry = self.cache.entry(cache_key, resp.status,
+                                     resp.reason, resp.headers, body)
+            self.cache.put(cache_key, entry)
+            # body stream is consumed
+            return self._cached_response(entry, kwargs['url'])
+
         return resp
 
+    def _cache_revalidate(self, func, kwargs, cache_key):
+        if not self.cache.claim(cache_key):
+            return
+
+        async def revalidate():
+            try:
+                resp = await self._request_retry(func=func,
+                                                 cache=False,
+                                                 **kwargs)
+                resp.release()
+            except aiohttp.ClientError as e:
+                self._log(DEBUG1, 'revalidate: %s', e)
+            finally:
+                self.cache.release(cache_key)
+
+        task = asyncio.ensure_future(revalidate())
+        self._revalidations.add(task)
+        task.add_done_callback(self._revalidations.discard)
+
     async def threats(self, *,
                       type=None,
                       id=None,
@@ -124,14 +244,15 @@ class ThreatVaultApi(mixin.AioMixin):
                       offset=None,
                       limit=None,
                       query_string=None,
-                      retry=False):
+                      retry=False,
+                      stream=False):
         args = locals()
         path = BASE_PATH + '/threats'
         url = self.url + path
 
         params = {}
         for x in args:
-            if (x not in ('self', 'query_string', 'retry') and
+            if (x not in ('self', 'query_string', 'retry', 'stream') and
                args[x] is not None):
                 params[x] = args[x]
 
@@ -145,6 +266,7 @@ class ThreatVaultApi(mixin.AioMixin):
         }
 
         resp = await self._request_retry(retry=retry,
+                                         stream=stream,
                                          func=self.session.get,
                                          **kwargs)
 
@@ -152,6 +274,8 @@ class ThreatVaultApi(mixin.AioMixin):
 
     async def _all(self, *,
                    func,
+                   concurrency=None,
+                   stream=False,
                    **kwargs):
         assert func == self.threats or func == self.edl, \
             'func not threats() or edl()'
@@ -173,56 +297,125 @@ class ThreatVaultApi(mixin.AioMixin):
             except ValueError as e:
                 raise ArgsError('limit not int')
 
+        concurrency = self._concurrency(concurrency)
+
         total = 0
         while True:
-            resp = await func(**kwargs)
+            with self._page_span(func, kwargs) as span:
+                if stream:
+                    resp = await func(stream=True, **kwargs)
+                else:
+                    resp = await func(**kwargs)
+                if resp.status == 200 and not stream:
+                    await resp.read()
+                    start = time.perf_counter()
+                    obj = await resp.json(content_type=None)
+                    count, items = self._all_page(func == self.threats, obj)
+                    span.set_attributes({
+                        'pantv.count': count,
+                        'pantv.items': len(items),
+                        'pantv.decode_seconds': time.perf_counter() - start,
+                    })
             if resp.status == 200:
-                obj = await resp.json(content_type=None)
-                if func == self.threats:
-                    try:
-                        threats = [obj['data'][k] for k in obj['data']]
-                        count = obj['count']
-                    except KeyError as e:
-                        raise ApiError('Malformed response, '
-                                       'missing key %s' % e)
-                    current = 0
-                    for threat in threats:
-                        current += len(threat)
-                    total += current
-                    self._log(DEBUG1, 'count %d current %d total %d',
-                              count, current, total)
-                    for threat in threats:
-                        for x in threat:
+                if stream:
+                    # yield items as they are decoded from the body
+                    threats = func == self.threats
+                    parser = self._all_parser(threats)
+                    n = 0
+                    async for chunk in resp.content.iter_chunked(
+                            jsonstream.CHUNK_SIZE):
+                        for x in self._all_feed(parser, chunk):
+                            n += 1
                             yield True, x
-
-                elif func == self.edl:
-                    try:
-                        if isinstance(obj['data'], list):
-                            ips = obj['data']
-                        elif (isinstance(obj['data'], dict) and
-                              'ipaddr' in obj['data']):
-                            ips = obj['data']['ipaddr']
-                        else:
-                            raise ApiError('Malformed response, '
-                                           'data not list or dict')
-                        count = obj['count']
-                    except KeyError as e:
-                        raise ApiError('Malformed response, '
-                                       'missing key %s' % e)
-                    current = len(ips)
-                    total += current
-                    self._log(DEBUG1, 'count %d current %d total %d',
-                              count, current, total)
-                    for x in ips:
+                    for x in self._all_feed(parser, None):
+                        n += 1
                         yield True, x
+                    count = self._all_count(threats, parser.meta)
+                else:
+                    n = len(items)
+                    for x in items:
+                        yield True, x
+                total += n
+                self._log(DEBUG1, 'count %d current %d total %d',
+                          count, n, total)
 
                 if total >= count:
                     break
 
                 kwargs['offset'] += limit
+
+                if concurrency > 1:
+                    # remaining offsets are known after the first page
+                    pages = -(-(count - total) // limit)
+                    offsets = [kwargs['offset'] + limit * i
+                               for i in range(pages)]
+                    async for resp, page in self._all_pages(
+                            func=func,
+                            kwargs=kwargs,
+                            offsets=offsets,
+                            concurrency=concurrency):
+                        if page is None:
+                            yield False, resp
+                            continue
+                        count, items = page
+                        total += len(items)
+                        self._log(DEBUG1, 'count %d current %d total %d',
+                                  count, len(items), total)
+                        for x in items:
+                            yield True, x
+
+                    if total >= count:
+                        break
+
+                    kwargs['offset'] += limit * pages
             else:
                 yield False, resp
 
+    async def _all_pages(self, *,
+                         func,
+                         kwargs,
+                         offsets,
+                         concurrency):
+        async def fetch(offset):
+            kwargs_ = dict(kwargs, offset=offset)
+            with self._page_span(func, kwargs_) as span:
+                resp = await func(**kwargs_)
+                if resp.status != 200:
+                    await resp.read()
+                    return resp, None
+                await resp.read()
+                start = time.perf_counter()
+                obj = await resp.json(content_type=None)
+                count, items = self._all_page(func == self.threats, obj)
+                span.set_attributes({
+                    'pantv.count': count,
+                    'pantv.items': len(items),
+                    'pantv.decode_seconds': time.perf_counter() - start,
+                })
+            return resp, (count, items)
+
+        offsets = iter(offsets)
+        pending = collections.deque()
+
+        def schedule(n):
+            for offset in itertools.islice(offsets, n):
+                task = asyncio.ensure_future(fetch(offset))
+                pending.append((offset, task))
+
+        try:
+            schedule(concurrency)
+            while pending:
+                offset, task = pending.popleft()
+                resp, page = await task
+                while page is None:
+                    yield resp, None
+                    resp, page = await fetch(offset)
+                schedule(1)
+                yield resp, page
+        finally:
+            for _, task in pending:
+                task.cancel()
+
     async def threats_all(self,
                           **kwargs):
         async for ok, x in self._all(func=self.threats,
@@ -235,6 +428,93 @@ class ThreatVaultApi(mixin.AioMixin):
                                      **kwargs):
             yield ok, x
 
+    async def edl_multi(self, *,
+                        names,
+                        version=None,
+                        listformat=None,
+                        concurrency=None,
+                        page_concurrency=None,
+                        query_string=None,
+                        retry=False):
+        names = self._edl_names(names)
+        concurrency = (len(names) if concurrency is None
+                       else self._concurrency(concurrency))
+        results = {x: None for x in names}
+
+        async def worker(names):
+            for name in names:
+                items = []
+                async for ok, x in self.edl_all(name=name,
+                                                version=version,
+                                                listformat=listformat,
+                                                concurrency=page_concurrency,
+                                                query_string=query_string,
+                                                retry=retry):
+                    if not ok:
+                        raise ApiError('edl_all %s: %s %s: %s' % (
+                            name, x.status, x.reason, await x.text()))
+                    items.append(x)
+                results[name] = items
+
+        self._log(DEBUG1, 'edl_multi: %d names concurrency %d',
+                  len(names), concurrency)
+        names = iter(names)
+        tasks = [asyncio.ensure_future(worker(names))
+                 for _ in range(concurrency)]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+
+        return results
+
+    async def edl_lookup(self, *,
+                         ipaddrs,
+                         names=None,
+                         version='latest',
+                         snapshot=None,
+                         max_age=300,
+                         concurrency=8,
+                         retry=False):
+        ipaddrs, names = self._edl_lookup_args(ipaddrs, names)
+        results, fresh = self._edl_lookup_snapshot(snapshot, ipaddrs, names,
+                                                   max_age)
+        if fresh is None:
+            return results
+
+        concurrency = self._concurrency(concurrency)
+
+        async def worker(ipaddrs):
+            for ipaddr in ipaddrs:
+                resp = await self.edl(ipaddr=ipaddr,
+                                      version=version,
+                                      retry=retry)
+                if resp.status == 200:
+                    obj = await resp.json(content_type=None)
+                    x = self._edl_lookup_names(obj, names, fresh)
+                    results[ipaddr] = sorted(results[ipaddr] + x)
+                elif resp.status == 404:
+                    # address not in an EDL
+                    resp.release()
+                else:
+                    raise ApiError('edl %s: %s %s: %s' % (
+                        ipaddr, resp.status, resp.reason,
+                        await resp.text()))
+
+        self._log(DEBUG1, 'edl_lookup: %d addresses concurrency %d',
+                  len(ipaddrs), concurrency)
+        ipaddrs = iter(ipaddrs)
+        tasks = [asyncio.ensure_future(worker(ipaddrs))
+                 for _ in range(concurrency)]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+
+        return results
+
     async def threats2(self, *,
                        type=None,
                        id=None,
@@ -278,6 +558,50 @@ class ThreatVaultApi(mixin.AioMixin):
 
         return resp
 
+    async def threats2_bulk(self, *,
+                            type=None,
+                            id=None,
+                            name=None,
+                            sha256=None,
+                            md5=None,
+                            batch_size=None,
+                            concurrency=None,
+                            query_string=None,
+                            retry=False):
+        key, batches, results = self._threats2_batches(
+            id=id, name=name, sha256=sha256, md5=md5,
+            batch_size=batch_size)
+        concurrency = self._concurrency(concurrency)
+
+        async def worker(batches):
+            for batch in batches:
+                resp = await self.threats2(type=type,
+                                           query_string=query_string,
+                                           retry=retry,
+                                           **{key: batch})
+                if resp.status == 200:
+                    obj = await resp.json(content_type=None)
+                    _threats2_merge(key, obj, results)
+                elif resp.status == 404:
+                    # no threats found for batch
+                    resp.release()
+                else:
+                    raise ApiError('threats2: %s %s: %s' % (
+                        resp.status, resp.reason, await resp.text()))
+
+        self._log(DEBUG1, 'threats2_bulk: %s %d batches',
+                  key, len(batches))
+        batches = iter(batches)
+        tasks = [asyncio.ensure_future(worker(batches))
+                 for _ in range(concurrency)]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+
+        return results
+
     async def threats_history(self, *,
                               type=None,
                               id=None,
@@ -349,14 +673,15 @@ class ThreatVaultApi(mixin.AioMixin):
                   offset=None,
                   limit=None,
                   query_string=None,
-                  retry=False):
+                  retry=False,
+                  stream=False):
         args = locals()
         path = BASE_PATH + '/edl'
         url = self.url + path
 
         params = {}
         for x in args:
-            if (x not in ('self', 'query_string', 'retry') and
+            if (x not in ('self', 'query_string', 'retry', 'stream') and
                args[x] is not None):
                 params[x] = args[x]
 
@@ -370,6 +695,7 @@ class ThreatVaultApi(mixin.AioMixin):
         }
 
         resp = await self._request_retry(retry=retry,
+                                         stream=stream,
                                          func=self.session.get,
                                          **kwargs)
 
@@ -14,28 +14,43 @@
 # OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
 #
 
+import collections
+import concurrent.futures
+import contextvars
+import itertools
 import logging
 import requests
 import ssl
 import sys
+import threading
 import time
 
-from . import (mixin, ApiError, ArgsError,
+from . import (jsonstream, reqmixin, ApiError, ArgsError,
                DEBUG1, DEBUG2, DEBUG3,
                title, __version__,
                DEFAULT_URL)
+from .mixin import _threats2_merge
 
 
 BASE_PATH = '/service/v1'
 
 
-class ThreatVaultApi(mixin.Mixin):
+class ThreatVaultApi(reqmixin.Mixin):
     def __init__(self, *,
                  api_version=None,
                  url=None,
                  api_key=None,
                  verify=None,
-                 timeout=None):
+                 timeout=None,
+                 rate_limit=None,
+                 cache=None,
+                 metrics=None,
+                 tracer=None,
+                 pool_connections=None,
+                 pool_maxsize=None,
+                 pool_block=None,
+                 keepalive=None,
+                 thread_safe=False):
         self._log = logging.getLogger(__name__).log
         self._log(DEBUG2, '%s: %s, ThreatVaultApi: %s',
                   title, __version__, api_version)
@@ -49,29 +64,100 @@ class ThreatVaultApi(mixin.Mixin):
         else:
             self.url = url
         auth = self._auth(api_key)
-        self.session = self._session(auth=auth,
-                                     verify=verify,
-                                     timeout=timeout)
+        self.metrics = self._metrics(metrics)
+        adapter = self._adapter(timeout=timeout,
+                                connect_timing=self.metrics is not None,
+                                pool_connections=pool_connections,
+                                pool_maxsize=pool_maxsize,
+                                pool_block=pool_block)
+        self._session_kwargs = {
+            'auth': auth,
+            'verify': verify,
+            'adapter': adapter,
+            'keepalive': keepalive,
+        }
+        if thread_safe:
+            self._local = threading.local()
+        else:
+            self._local = None
+            self._shared_session = self._session(**self._session_kwargs)
+        self.rate_limiter = self._rate_limiter(rate_limit)
+        self.cache = self._cache(cache)
+        self.tracer = self._tracer(tracer)
+        self._revalidations = set()
 
     def _request_retry(self, *,
-                       retry=False,
-                       retry_timeout=False,
                        func=None,
                        **kwargs):
+        with self._request_span(func, kwargs) as span:
+            resp = self._request_retry_span(span, func=func, **kwargs)
+            span.set_attribute('http.response.status_code',
+                               resp.status_code)
+
+        return resp
+
+    def _request_retry_span(self, span, *,
+                            retry=False,
+                            retry_timeout=False,
+                            cache=True,
+                            func=None,
+                            **kwargs):
+        # retries and sleep time
+        counts = {}
         if retry_timeout:
             timeout_delay = 5
             timeout_retries = 3
+        # a cached response body is read in full
+        cache_key = (None if kwargs.get('stream')
+                     else self._cache_key(func, kwargs))
+        stale = None
+        if cache and cache_key is not None:
+            entry = self.cache.get(cache_key)
+            if entry is not None and entry.fresh():
+                self._on_cache(span, func, kwargs, 'hit')
+                return self._cached_response(entry, kwargs['url'])
+            elif entry is not None and entry.validators():
+                # conditional request
+                stale = entry
+                kwargs['headers'] = {**(kwargs.get('headers') or {}),
+                                     **entry.validators()}
+            elif entry is not None:
+                # serve stale while revalidating
+                self._cache_revalidate(func, kwargs, cache_key)
+                self._on_cache(span, func, kwargs, 'stale')
+                return self._cached_response(entry, kwargs['url'])
+
         while True:
+            if self.rate_limiter is not None:
+                delay = self.rate_limiter.reserve()
+                if delay > 0:
+                    self._log(DEBUG2, 'rate limit, sleep %.2fs', delay)
+                    self._on_sleep(span, counts, 'rate_limit', delay)
+                    time.sleep(delay)
+            start = time.perf_counter()
             try:
                 resp = func(**kwargs)
             except requests.Timeout:
+                if self.rate_limiter is not None:
+                    # no response
+                    self.rate_limiter.update(None)
                 if not (retry_timeout and timeout_retries):
                     raise
                 self._log(DEBUG2, 'timeout, sleep %.2fs', timeout_delay)
+                self._on_retry(span, counts, func, kwargs, 'timeout')
+                self._on_sleep(span, counts, 'timeout', timeout_delay)
                 time.sleep(timeout_delay)
                 timeout_delay *= 2
                 timeout_retries -= 1
+            except BaseException:
+                if self.rate_limiter is not None:
+                    self.rate_limiter.update(None)
+                raise
             else:
+                if self.metrics is not None:
+                    self._metrics_request(func, kwargs, resp, start)
+                if self.rate_limiter is not None:
+                    self.rate_limiter.update(resp.headers)
                 if retry and resp.status_code == 429:
                     now = time.time()
                     day_remaining = \
@@ -89,16 +175,51 @@ class ThreatVaultApi(mixin.Mixin):
                         self._log(DEBUG1, '%s', e)
                         break
 
+                    # release connection of unread (stream) response
+                    resp.close()
+                    self._on_retry(span, counts, func, kwargs, '429')
                     if minute_reset > now:
                         rate_limit_delay = minute_reset - now
                         self._log(DEBUG2, 'status code 429, sleep %.2fs',
                                   rate_limit_delay)
+                        self._on_sleep(span, counts, '429',
+                                       rate_limit_delay)
                         time.sleep(rate_limit_delay)
                 else:
                     break
 
+        if (cache_key is not None and resp.status_code == 304 and
+           stale is not None):
+            entry = stale.revalidated(resp.headers)
+            self.cache.put(cache_key, entry)
+            self._on_cache(span, func, kwargs, 'revalidated')
+            return self._cached_response(entry, kwargs['url'])
+        if cache_key is not None and resp.status_code == 200:
+            self.cache.put(cache_key,
+                           self.cache.entry(cache_key, resp.status_code,
+                                            resp.reason, resp.headers,
+                                            resp.content))
+
         return resp
 
+    def _cache_revalidate(self, func, kwargs, cache_key):
+        if not self.cache.claim(cache_key):
+            return
+
+        def revalidate():
+            try:
+                self._request_retry(func=func, cache=False, **kwargs)
+            except requests.RequestException as e:
+                self._log(DEBUG1, 'revalidate: %s', e)
+            finally:
+                self.cache.release(cache_key)
+                self._revalidations.discard(threading.current_thread())
+
+        thread = threading.Thread(target=revalidate,
+                                  name='pantv-revalidate')
+        self._revalidations.add(thread)
+        thread.start()
+
     def threats(self, *,
                 type=None,
                 id=None,
@@ -116,14 +237,15 @@ class ThreatVaultApi(mixin.Mixin):
                 offset=None,
                 limit=None,
                 query_string=None,
-                retry=False):
+                retry=False,
+                stream=False):
         args = locals()
         path = BASE_PATH + '/threats'
         url = self.url + path
 
         params = {}
         for x in args:
-            if (x not in ('self', 'query_string', 'retry') and
+            if (x not in ('self', 'query_string', 'retry', 'stream') and
                args[x] is not None):
                 params[x] = args[x]
 
@@ -134,6 +256,8 @@ class ThreatVaultApi(mixin.Mixin):
             'url': url,
             'params': params,
         }
+        if stream:
+            kwargs['stream'] = True
 
         resp = self._request_retry(retry=retry,
                                    func=self.session.get,
@@ -143,6 +267,8 @@ class ThreatVaultApi(mixin.Mixin):
 
     def _all(self, *,
              func,
+             concurrency=None,
+             stream=False,
              **kwargs):
         assert func == self.threats or func == self.edl, \
             'func not threats() or edl()'
@@ -164,56 +290,130 @@ class ThreatVaultApi(mixin.Mixin):
             except ValueError as e:
                 raise ArgsError('limit not int')
 
+        concurrency = self._concurrency(concurrency)
+
         total = 0
         while True:
-            resp = func(**kwargs)
+            with self._page_span(func, kwargs) as span:
+                if stream:
+                    resp = func(stream=True, **kwargs)
+                else:
+                    resp = func(**kwargs)
+                if resp.status_code == 200 and not stream:
+                    start = time.perf_counter()
+                    obj = resp.json()
+                    count, items = self._all_page(func == self.threats, obj)
+                    span.set_attributes({
+                        'pantv.count': count,
+                        'pantv.items': len(items),
+                        'pantv.decode_seconds': time.perf_counter() - start,
+                    })
             if resp.status_code == 200:
-                obj = resp.json()
-                if func == self.threats:
-                    try:
-                        threats = [obj['data'][k] for k in obj['data']]
-                        count = obj['count']
-                    except KeyError as e:
-                        raise ApiError('Malformed response, '
-                                       'missing key %s' % e)
-                    current = 0
-                    for threat in threats:
-                        current += len(threat)
-                    total += current
-                    self._log(DEBUG1, 'count %d current %d total %d',
-                              count, current, total)
-                    for threat in threats:
-                        for x in threat:
-                            yield True, x
-
-                elif func == self.edl:
-                    try:
-                        if isinstance(obj['data'], list):
-                            ips = obj['data']
-                        elif (isinstance(obj['data'], dict) and
-                              'ipaddr' in obj['data']):
-                            ips = obj['data']['ipaddr']
-                        else:
-                            raise ApiError('Malformed response, '
-                                           'data not list or dict')
-                        count = obj['count']
-                    except KeyError as e:
-                        raise ApiError('Malformed response, '
-                                       'missing key %s' % e)
-                    current = len(ips)
-                    total += current
-                    self._log(DEBUG1, 'count %d current %d total %d',
-                              count, current, total)
-                    for x in ips:
+                if stream:
+                    count, n = yield from self._all_stream(
+                        func == self.threats, resp)
+                else:
+                    n = len(items)
+                    for x in items:
                         yield True, x
+                total += n
+                self._log(DEBUG1, 'count %d current %d total %d',
+                          count, n, total)
 
                 if total >= count:
                     break
 
                 kwargs['offset'] += limit
+
+                if concurrency > 1:
+                    # remaining offsets are known after the first page
+                    pages = -(-(count - total) // limit)
+                    offsets = [kwargs['offset'] + limit * i
+                               for i in range(pages)]
+                    for resp, page in self._all_pages(
+                            func=func,
+                            kwargs=kwargs,
+                            offsets=offsets,
+                            concurrency=concurrency):
+                        if page is None:
+                            yield False, resp
+                            continue
+                        count, items = page
+                        total += len(items)
+                        self._log(DEBUG1, 'count %d current %d total %d',
+                                  count, len(items), total)
+                        for x in items:
+                            yield True, x
+
+                    if total >= count:
+                        break
+
+                    kwargs['offset'] += limit * pages
             else:
                 yield False, resp
 
+    def _all_stream(self, threats, resp):
+        # yield items as they are decoded from the response body
+        parser = self._all_parser(threats)
+        n = 0
+        for chunk in resp.iter_content(chunk_size=jsonstream.CHUNK_SIZE):
+            for x in self._all_feed(parser, chunk):
+                n += 1
+                yield True, x
+        for x in self._all_feed(parser, None):
+            n += 1
+            yield True, x
+
+        return self._all_count(threats, parser.meta), n
+
+    def _all_pages(self, *,
+                   func,
+                   kwargs,
+                   offsets,
+                   concurrency):
+        def fetch(offset):
+            kwargs_ = dict(kwargs, offset=offset)
+            with self._page_span(func, kwargs_) as span:
+                resp = func(**kwargs_)
+                if resp.status_code != 200:
+                    return resp, None
+                start = time.perf_counter()
+                obj = resp.json()
+                count, items = self._all_page(func == self.threats, obj)
+                span.set_attributes({
+                    'pantv.count': count,
+                    'pantv.items': len(items),
+                    'pantv.decode_seconds': time.perf_counter() - start,
+                })
+            return resp, (count, items)
+
+        offsets = iter(offsets)
+        pending = collections.deque()
+        executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=concurrency,
+            thread_name_prefix='pantv')
+
+        def schedule(n):
+            for offset in itertools.islice(offsets, n):
+                # spans in the worker have the caller's span as parent
+                future = executor.submit(contextvars.copy_context().run,
+                                         fetch, offset)
+                pending.append((offset, future))
+
+        try:
+            # prefetch window: at most concurrency pages outstanding
+            schedule(concurrency)
+            while pending:
+                offset, future = pending.popleft()
+                resp, page = future.result()
+                while page is None:
+                    yield resp, None
+                    resp, page = fetch(offset)
+                schedule(1)
+                yield resp, page
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+
     def threats_all(self,
                     **kwargs):
         return self._all(func=self.threats, **kwargs)
@@ -222,6 +422,100 @@ class ThreatVaultApi(mixin.Mixin):
                 **kwargs):
         return self._all(func=self.edl, **kwargs)
 
+    def edl_multi(self, *,
+                  names,
+                  version=None,
+                  listformat=None,
+                  concurrency=None,
+                  page_concurrency=None,
+                  query_string=None,
+                  retry=False):
+        names = self._edl_names(names)
+        concurrency = (len(names) if concurrency is None
+                       else self._concurrency(concurrency))
+
+        def fetch(name):
+            items = []
+            for ok, x in self.edl_all(name=name,
+                                      version=version,
+                                      listformat=listformat,
+                                      concurrency=page_concurrency,
+                                      query_string=query_string,
+                                      retry=retry):
+                if not ok:
+                    raise ApiError('edl_all %s: %s %s: %s' % (
+                        name, x.status_code, x.reason, x.text))
+                items.append(x)
+            return items
+
+        self._log(DEBUG1, 'edl_multi: %d names concurrency %d',
+                  len(names), concurrency)
+        results = {}
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=concurrency,
+                thread_name_prefix='pantv') as executor:
+            # spans in the worker have the caller's span as parent
+            futures = [executor.submit(contextvars.copy_context().run,
+                                       fetch, name)
+                       for name in names]
+            try:
+                for name, future in zip(names, futures):
+                    results[name] = future.result()
+            except BaseException:
+                executor.shutdown(wait=True, cancel_futures=True)
+                raise
+
+        return results
+
+    def edl_lookup(self, *,
+                   ipaddrs,
+                   names=None,
+                   version='latest',
+                   snapshot=None,
+                   max_age=300,
+                   concurrency=8,
+                   retry=False):
+        ipaddrs, names = self._edl_lookup_args(ipaddrs, names)
+        results, fresh = self._edl_lookup_snapshot(snapshot, ipaddrs, names,
+                                                   max_age)
+        if fresh is None:
+            return results
+
+        concurrency = self._concurrency(concurrency)
+
+        def lookup(ipaddr):
+            resp = self.edl(ipaddr=ipaddr,
+                            version=version,
+                            retry=retry)
+            if resp.status_code == 200:
+                return self._edl_lookup_names(resp.json(), names, fresh)
+            elif resp.status_code == 404:
+                # address not in an EDL
+                return []
+            raise ApiError('edl %s: %s %s: %s' % (ipaddr,
+                                                  resp.status_code,
+                                                  resp.reason,
+                                                  resp.text))
+
+        self._log(DEBUG1, 'edl_lookup: %d addresses concurrency %d',
+                  len(ipaddrs), concurrency)
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=concurrency,
+                thread_name_prefix='pantv') as executor:
+            # spans in the worker have the caller's span as parent
+            futures = [executor.submit(contextvars.copy_context().run,
+                                       lookup, ipaddr)
+                       for ipaddr in ipaddrs]
+            try:
+                for ipaddr, future in zip(ipaddrs, futures):
+                    results[ipaddr] = sorted(results[ipaddr] +
+                                             future.result())
+            except BaseException:
+                executor.shutdown(wait=True, cancel_futures=True)
+                raise
+
+        return results
+
     def threats2(self, *,
                  type=None,
                  id=None,
@@ -264,6 +558,55 @@ class ThreatVaultApi(mixin.Mixin):
 
         return resp
 
+    def threats2_bulk(self, *,
+                      type=None,
+                      id=None,
+                      name=None,
+                      sha256=None,
+                      md5=None,
+                      batch_size=None,
+                      concurrency=None,
+                      query_string=None,
+                      retry=False):
+        key, batches, results = self._threats2_batches(
+            id=id, name=name, sha256=sha256, md5=md5,
+            batch_size=batch_size)
+        concurrency = self._concurrency(concurrency)
+
+        def lookup(batch):
+            resp = self.threats2(type=type,
+                                 query_string=query_string,
+                                 retry=retry,
+                                 **{key: batch})
+            if resp.status_code == 200:
+                return resp.json()
+            elif resp.status_code == 404:
+                # no threats found for batch
+                return
+            raise ApiError('threats2: %s %s: %s' % (resp.status_code,
+                                                    resp.reason,
+                                                    resp.text))
+
+        self._log(DEBUG1, 'threats2_bulk: %s %d batches',
+                  key, len(batches))
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=concurrency,
+                thread_name_prefix='pantv') as executor:
+            # spans in the worker have the caller's span as parent
+            futures = [executor.submit(contextvars.copy_context().run,
+                                       lookup, batch)
+                       for batch in batches]
+            try:
+                for future in futures:
+                    obj = future.result()
+                    if obj is not None:
+                        _threats2_merge(key, obj, results)
+            except BaseException:
+                executor.shutdown(wait=True, cancel_futures=True)
+                raise
+
+        return results
+
     def threats_history(self, *,
                         type=None,
                         id=None,
@@ -333,14 +676,15 @@ class ThreatVaultApi(mixin.Mixin):
             offset=None,
             limit=None,
             query_string=None,
-            retry=False):
+            retry=False,
+            stream=False):
         args = locals()
         path = BASE_PATH + '/edl'
         url = self.url + path
 
         params = {}
         for x in args:
-            if (x not in ('self', 'query_string', 'retry') and
+            if (x not in ('self', 'query_string', 'retry', 'stream') and
                args[x] is not None):
                 params[x] = args[x]
 
@@ -351,6 +695,8 @@ class ThreatVaultApi(mixin.Mixin):
             'url': url,
             'params': params,
         }
+        if stream:
+            kwargs['stream'] = True
 
         resp = self._request_retry(retry=retry,
                                    func=self.session.get,
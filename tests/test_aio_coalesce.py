@@ -0,0 +1,34 @@
+import asyncio
+import hashlib
+import unittest
+
+from pantv.coalesce import ThreatsCoalescer
+from . import mixin
+
+
+class ThreatVaultApiTest(mixin.AioMixin, unittest.IsolatedAsyncioTestCase):
+    async def test_01(self):
+        ids = ['30000', '19999', 30000]
+        async with ThreatsCoalescer(self.api) as coalescer:
+            results = await asyncio.gather(
+                *[coalescer.threats(id=x) for x in ids])
+            self.assertEqual(coalescer.requests, 1)
+            self.assertEqual(coalescer.lookups, len(ids))
+
+        self.assertEqual(results[0][0]['cve'][0], 'CVE-2018-15984')
+        self.assertEqual(results[1][0]['name'],
+                         'Bot: Backdoor_Win32_Agobot_pnd_pnj')
+        self.assertEqual(results[0], results[2])
+
+    async def test_02(self):
+        args = []
+        for n in range(1, 151):
+            m = hashlib.sha256(b'threat vault' * n)
+            args.append(m.hexdigest())
+
+        async with ThreatsCoalescer(self.api, batch_size=50) as coalescer:
+            results = await asyncio.gather(
+                *[coalescer.threats(sha256=x) for x in args])
+            self.assertEqual(coalescer.requests, 3)
+
+        self.assertEqual(results, [[]] * len(args))
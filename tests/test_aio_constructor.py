@@ -1,6 +1,8 @@
 import asyncio
 import unittest
 
+import aiohttp
+
 import pantv
 
 
@@ -27,3 +29,60 @@ class ThreatVaultApiTest(unittest.IsolatedAsyncioTestCase):
             self.api = pantv.ThreatVaultApi(**kwargs)
         self.assertRegex(str(e.exception),
                          '^Invalid api_version')
+
+    async def test_03(self):
+        kwargs = {
+            'api_key': 'x',
+            'limit': '20',
+            'limit_per_host': 5,
+            'keepalive_timeout': 30,
+            'ttl_dns_cache': 60,
+        }
+        self.api = pantv.ThreatVaultApi(**kwargs)
+        connector = self.api.session.connector
+        self.assertIsInstance(connector, aiohttp.TCPConnector)
+        self.assertEqual(connector.limit, 20)
+        self.assertEqual(connector.limit_per_host, 5)
+        self.assertFalse(connector.force_close)
+        self.assertEqual(connector._keepalive_timeout, 30)
+        self.assertTrue(self.api.session.connector_owner)
+
+    async def test_04(self):
+        kwargs = {
+            'api_key': 'x',
+            'force_close': True,
+        }
+        self.api = pantv.ThreatVaultApi(**kwargs)
+        self.assertTrue(self.api.session.connector.force_close)
+
+        with self.assertRaises(pantv.ArgsError) as e:
+            pantv.ThreatVaultApi(keepalive_timeout=30, **kwargs)
+        self.assertEqual(str(e.exception),
+                         'keepalive_timeout not allowed with force_close')
+
+    async def test_05(self):
+        connector = aiohttp.TCPConnector(limit=3)
+        self.api = pantv.ThreatVaultApi(api_key='x', connector=connector)
+        self.assertIs(self.api.session.connector, connector)
+        self.assertFalse(self.api.session.connector_owner)
+
+        with self.assertRaises(pantv.ArgsError) as e:
+            pantv.ThreatVaultApi(api_key='x', connector=connector, limit=10)
+        self.assertEqual(str(e.exception),
+                         'connector options not allowed with connector')
+        with self.assertRaises(pantv.ArgsError) as e:
+            pantv.ThreatVaultApi(api_key='x', connector=object())
+        self.assertEqual(str(e.exception),
+                         'connector must be aiohttp.BaseConnector')
+        await self.api.session.close()
+        self.assertFalse(connector.closed)
+        await connector.close()
+
+    async def test_06(self):
+        for k, v, msg in (('limit', 'x', 'limit not int'),
+                          ('limit_per_host', -1,
+                           'limit_per_host must be 0 (no limit) or greater'),
+                          ('ttl_dns_cache', 'x', 'ttl_dns_cache not float')):
+            with self.assertRaises(pantv.ArgsError) as e:
+                self.api = pantv.ThreatVaultApi(api_key='x', **{k: v})
+            self.assertEqual(str(e.exception), msg)
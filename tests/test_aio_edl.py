@@ -1,6 +1,8 @@
 import random
 import unittest
 
+import pantv
+
 from . import mixin
 
 
@@ -110,3 +112,79 @@ class ThreatVaultApiTest(mixin.AioMixin, unittest.IsolatedAsyncioTestCase):
             self.assertTrue(isinstance(x, str))
             total += 1
         self.assertEqual(count, total)
+
+    async def test_05(self):
+        edl = 'panw-known-ip-list'
+        resp = await self.api.edl(name=edl,
+                                  version='latest',
+                                  limit=1)
+        self.assertEqual(resp.status, 200)
+        x = await resp.json()
+        version = x['data'][0]['version']
+
+        serial = []
+        async for result, x in self.api.edl_all(name=edl,
+                                                version=version,
+                                                listformat='array',
+                                                retry=True):
+            if not result:
+                self.assertTrue(result, '%s %s' % (x.status, x.reason))
+            serial.append(x)
+
+        limit = random.randrange(101, 500)
+        concurrent = []
+        async for result, x in self.api.edl_all(name=edl,
+                                                version=version,
+                                                limit=limit,
+                                                listformat='array',
+                                                concurrency=4,
+                                                retry=True):
+            if not result:
+                self.assertTrue(result, '%s %s' % (x.status, x.reason))
+            concurrent.append(x)
+        self.assertEqual(serial, concurrent)
+
+    async def test_06(self):
+        edls = [
+            'panw-known-ip-list',
+            'panw-highrisk-ip-list',
+            'panw-torexit-ip-list',
+            'panw-bulletproof-ip-list',
+        ]
+        x = await self.api.edl_multi(names=edls + edls[:1],
+                                     version='latest',
+                                     listformat='array',
+                                     retry=True)
+        self.assertEqual(list(x), edls)
+        for edl in edls:
+            self.assertGreater(len(x[edl]), 0, msg=edl)
+            self.assertTrue(isinstance(x[edl][0], str))
+
+        with self.assertRaises(pantv.ApiError):
+            await self.api.edl_multi(names=edls[:1] + ['xxx-invalid'])
+        with self.assertRaises(pantv.ArgsError):
+            await self.api.edl_multi(names=[])
+
+    async def test_07(self):
+        edl = 'panw-known-ip-list'
+        resp = await self.api.edl(name=edl,
+                                  version='latest',
+                                  listformat='array',
+                                  limit=10)
+        self.assertEqual(resp.status, 200)
+        x = await resp.json()
+        ips = [x for x in x['data']['ipaddr'] if '/' not in x]
+        ips.append('0.0.0.0')
+
+        x = await self.api.edl_lookup(ipaddrs=ips, concurrency=4,
+                                      retry=True)
+        self.assertEqual(list(x), ips)
+        for ip in ips[:-1]:
+            self.assertIn(edl, x[ip], msg=ip)
+        self.assertEqual(x['0.0.0.0'], [])
+
+        x = await self.api.edl_lookup(ipaddrs=ips[0], names=['xxx-invalid'])
+        self.assertEqual(x, {ips[0]: []})
+
+        with self.assertRaises(pantv.ApiError):
+            await self.api.edl_lookup(ipaddrs=['x-invalid'])
@@ -0,0 +1,57 @@
+import os
+import sys
+import unittest
+
+import pantv
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__),
+                                os.pardir, 'bench'))
+from mockserver import MockServer, Dataset  # noqa: E402
+
+COUNT = 500
+
+
+class ThreatVaultApiTest(unittest.IsolatedAsyncioTestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = MockServer(count=COUNT).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+
+    async def asyncSetUp(self):
+        self.api = pantv.ThreatVaultApi(url=self.server.url,
+                                        api_key='x')
+
+    async def asyncTearDown(self):
+        await self.api.session.close()
+
+    async def test_01(self):
+        threats = Dataset(COUNT).threats['antivirus']
+        args = [threats[0]['sha256'].upper(),
+                threats[1]['related_sha256_hashes'][0],
+                'f' * 64]
+        results = await self.api.threats2_bulk(sha256=args, batch_size=2,
+                                               concurrency=2)
+        self.assertEqual(results, {
+            args[0].lower(): [threats[0]],
+            args[1]: [threats[1]],
+            args[2]: [],
+        })
+
+    async def test_02(self):
+        threats = Dataset(COUNT).threats
+        ids = [threats['spyware'][0]['id'], int(threats['dns'][1]['id']),
+               '999']
+        results = await self.api.threats2_bulk(id=ids, batch_size=1,
+                                               concurrency=3)
+        self.assertEqual(results, {
+            ids[0]: [threats['spyware'][0]],
+            str(ids[1]): [threats['dns'][1]],
+            '999': [],
+        })
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,281 @@
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+import unittest
+
+import pantv
+from pantv.cache import DiskCache, ResponseCache
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__),
+                                os.pardir, 'bench'))
+from mockserver import MockServer  # noqa: E402
+
+PATH = '/service/v1/release-notes'
+
+
+class ResponseCacheTest(unittest.TestCase):
+    def put(self, cache, key, body=b'{}'):
+        cache.put(key, cache.entry(key, 200, 'OK', {}, body))
+
+    def test_01(self):
+        cache = ResponseCache()
+        key = cache.key('GET', PATH, {'version': 'latest', 'type': None})
+        self.assertEqual(key, cache.key('GET', PATH, {'version': 'latest'}))
+        self.assertNotEqual(key, cache.key('GET', PATH, {'version': '1'}))
+        self.assertIsNone(cache.key('POST', '/service/v1/threats', {}))
+        self.assertIsNone(cache.key('GET', '/service/v1/atp/reports/pcaps',
+                                    {'id': 'x'}))
+
+    def test_02(self):
+        cache = ResponseCache()
+        key = cache.key('GET', PATH, {})
+        self.assertIsNone(cache.get(key))
+        self.put(cache, key, b'{"x": 1}')
+        entry = cache.get(key)
+        self.assertEqual(entry.body, b'{"x": 1}')
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_03(self):
+        cache = ResponseCache(maxsize=2)
+        keys = [cache.key('GET', PATH, {'version': x}) for x in range(3)]
+        self.put(cache, keys[0])
+        self.put(cache, keys[1])
+        cache.get(keys[0])
+        self.put(cache, keys[2])
+        # least recently used evicted
+        self.assertIsNone(cache.get(keys[1]))
+        self.assertIsNotNone(cache.get(keys[0]))
+        self.assertEqual(len(cache), 2)
+
+    def test_04(self):
+        cache = ResponseCache(maxbytes=10)
+        keys = [cache.key('GET', PATH, {'version': x}) for x in range(3)]
+        self.put(cache, keys[0], b'x' * 6)
+        self.put(cache, keys[1], b'x' * 6)
+        self.assertIsNone(cache.get(keys[0]))
+        self.assertEqual(cache.nbytes, 6)
+        self.put(cache, keys[2], b'x' * 11)
+        self.assertIsNone(cache.get(keys[2]))
+
+    def test_05(self):
+        cache = ResponseCache(ttl={'/release-notes': 0.05, '/edl': None})
+        self.assertIsNone(cache.key('GET', '/service/v1/edl', {}))
+        key = cache.key('GET', PATH, {})
+        self.put(cache, key)
+        self.assertIsNotNone(cache.get(key))
+        time.sleep(0.1)
+        self.assertIsNone(cache.get(key))
+        self.assertEqual(len(cache), 0)
+
+    def test_06(self):
+        cache = ResponseCache(ttl={'/release-notes': 0.05}, max_stale=10)
+        key = cache.key('GET', PATH, {})
+        cache.put(key, cache.entry(key, 200, 'OK',
+                                   {'ETag': '"x"', 'Date': 'x'}, b'{}'))
+        time.sleep(0.1)
+        entry = cache.get(key)
+        self.assertFalse(entry.fresh())
+        self.assertEqual(cache.stale, 1)
+        self.assertEqual(entry.validators(), {'If-None-Match': '"x"'})
+        entry = entry.revalidated({'ETag': '"y"'})
+        self.assertTrue(entry.fresh())
+        self.assertEqual(entry.headers, {'ETag': '"y"', 'Date': 'x'})
+
+
+class DiskCacheTest(unittest.TestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+
+    def tearDown(self):
+        os.unlink(self.path)
+
+    def test_01(self):
+        cache = DiskCache(self.path)
+        key = cache.key('GET', PATH, {'version': 'latest'})
+        cache.put(key, cache.entry(key, 200, 'OK', {'x': 'y'}, b'{}'))
+        cache.close()
+
+        cache = DiskCache(self.path)
+        self.assertEqual(len(cache), 0)
+        entry = cache.get(key)
+        self.assertEqual(entry.body, b'{}')
+        self.assertEqual(entry.headers, {'x': 'y'})
+        self.assertEqual(len(cache), 1)
+        cache.close()
+
+    def test_02(self):
+        cache = DiskCache(self.path, ttl={'/release-notes': 0.05},
+                          max_stale=0.1)
+        key = cache.key('GET', PATH, {})
+        cache.put(key, cache.entry(key, 200, 'OK', {}, b'{}'))
+        cache.clear()
+        self.assertIsNone(cache.get(key))
+        cache.put(key, cache.entry(key, 200, 'OK', {}, b'{}'))
+        self.assertEqual(cache.purge(), 0)
+        time.sleep(0.2)
+        self.assertEqual(cache.purge(), 1)
+        cache.close()
+
+    def rows(self, cache):
+        return [x[0] for x in cache.db.execute('SELECT key FROM entries '
+                                               'ORDER BY time')]
+
+    def test_03(self):
+        now = time.time()
+        cache = DiskCache(self.path, maxsize=5)
+        keys = [cache.key('GET', PATH, {'offset': i}) for i in range(12)]
+        for i, key in enumerate(keys):
+            entry = cache.entry(key, 200, 'OK', {}, b'{}')
+            cache.put(key, entry._replace(time=now + i))
+        self.assertEqual(len(cache), 5)
+        # evicted entries are removed from disk
+        self.assertEqual(self.rows(cache), keys[-5:])
+        cache.close()
+
+        cache = DiskCache(self.path, maxsize=2)
+        self.assertEqual(self.rows(cache), keys[-2:])
+        cache.close()
+
+    def test_04(self):
+        now = time.time()
+        cache = DiskCache(self.path, maxbytes=250)
+        keys = [cache.key('GET', PATH, {'offset': i}) for i in range(6)]
+        for i, key in enumerate(keys):
+            entry = cache.entry(key, 200, 'OK', {}, b'x' * 100)
+            cache.put(key, entry._replace(time=now + i))
+        self.assertEqual(cache.nbytes, 200)
+        self.assertEqual(self.rows(cache), keys[-2:])
+        cache.close()
+
+
+class _ClientCacheTest:
+    @classmethod
+    def setUpClass(cls):
+        cls.server = MockServer(count=100).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+
+    def requests(self, status=None):
+        return sum(n for (method, path, status_), n in
+                   self.server.stats.items()
+                   if path == PATH and status in (None, status_))
+
+
+class ClientCacheTest(_ClientCacheTest, unittest.TestCase):
+    def test_01(self):
+        cache = ResponseCache()
+        api = pantv.ThreatVaultApi(url=self.server.url, api_key='x',
+                                   cache=cache, metrics=True)
+        n = self.requests()
+        resp = api.release_notes(type='content', version='8599')
+        self.assertEqual(resp.status_code, 200)
+        x = resp.json()
+        # repeated request is a cache hit without a network request
+        resp = api.release_notes(type='content', version='8599')
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.json(), x)
+        self.assertEqual(self.requests(), n + 1)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        self.assertEqual(sum(api.metrics.cache_hits.values()), 1)
+        self.assertEqual(sum(api.metrics.requests.values()), 1)
+        # different parameters
+        resp = api.release_notes(type='content', version='8598')
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(self.requests(), n + 2)
+        api.session.close()
+
+    def test_02(self):
+        cache = ResponseCache(ttl={'/release-notes': 0.1}, max_stale=60)
+        with pantv.ThreatVaultApi(url=self.server.url, api_key='x',
+                                  cache=cache) as api:
+            n = self.requests(304)
+            resp = api.release_notes(type='content', version='8597')
+            x = resp.json()
+            self.assertIn('ETag', resp.headers)
+            time.sleep(0.2)
+            # stale with ETag: conditional request, 304 Not Modified
+            resp = api.release_notes(type='content', version='8597')
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(resp.json(), x)
+            self.assertEqual(self.requests(304), n + 1)
+            self.assertEqual(cache.stale, 1)
+            # revalidated entry is fresh
+            resp = api.release_notes(type='content', version='8597')
+            self.assertEqual(self.requests(304), n + 1)
+            self.assertEqual(cache.hits, 1)
+
+    def test_03(self):
+        cache = ResponseCache(ttl={'/release-notes': 60}, max_stale=60)
+        with pantv.ThreatVaultApi(url=self.server.url, api_key='x',
+                                  cache=cache) as api:
+            # stale entry without validators
+            key = cache.key('GET', PATH, {'type': 'content',
+                                          'version': '8596'})
+            cache.put(key, cache.entry(key, 200, 'OK', {}, b'{"x": 1}'
+                                       )._replace(time=time.time() - 90))
+            n = self.requests()
+            resp = api.release_notes(type='content', version='8596')
+            # served stale while revalidating in the background
+            self.assertEqual(resp.json(), {'x': 1})
+        # revalidation is complete on exit
+        self.assertEqual(self.requests(), n + 1)
+        entry = cache.get(key)
+        self.assertTrue(entry.fresh())
+        self.assertEqual(json.loads(entry.body)['count'], 1)
+
+
+class AioClientCacheTest(_ClientCacheTest,
+                         unittest.IsolatedAsyncioTestCase):
+    async def test_01(self):
+        cache = ResponseCache()
+        async with pantv.ThreatVaultApi(url=self.server.url, api_key='x',
+                                        cache=cache) as api:
+            n = self.requests()
+            resp = await api.release_notes(type='content', version='8599')
+            self.assertEqual(resp.status, 200)
+            x = await resp.json()
+            resp = await api.release_notes(type='content', version='8599')
+            self.assertEqual(resp.status, 200)
+            self.assertEqual(await resp.json(), x)
+            self.assertEqual(self.requests(), n + 1)
+            self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    async def test_02(self):
+        cache = ResponseCache(ttl={'/release-notes': 0.1}, max_stale=60)
+        async with pantv.ThreatVaultApi(url=self.server.url, api_key='x',
+                                        cache=cache) as api:
+            n = self.requests(304)
+            resp = await api.release_notes(type='content', version='8595')
+            x = await resp.json()
+            await asyncio.sleep(0.2)
+            resp = await api.release_notes(type='content', version='8595')
+            self.assertEqual(resp.status, 200)
+            self.assertEqual(await resp.json(), x)
+            self.assertEqual(self.requests(304), n + 1)
+            self.assertEqual(cache.stale, 1)
+
+    async def test_03(self):
+        cache = ResponseCache(ttl={'/release-notes': 60}, max_stale=60)
+        async with pantv.ThreatVaultApi(url=self.server.url, api_key='x',
+                                        cache=cache) as api:
+            key = cache.key('GET', PATH, {'type': 'content',
+                                          'version': '8594'})
+            cache.put(key, cache.entry(key, 200, 'OK', {}, b'{"x": 1}'
+                                       )._replace(time=time.time() - 90))
+            n = self.requests()
+            resp = await api.release_notes(type='content', version='8594')
+            self.assertEqual(await resp.json(), {'x': 1})
+        self.assertEqual(self.requests(), n + 1)
+        entry = cache.get(key)
+        self.assertTrue(entry.fresh())
+        self.assertEqual(json.loads(entry.body)['count'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,173 @@
+import ipaddress
+import os
+import random
+import tempfile
+import unittest
+
+import pantv
+from pantv.edl import EdlIndex, EdlWriter
+
+
+class EdlIndexTest(unittest.TestCase):
+    def test_01(self):
+        index = EdlIndex([
+            '10.0.0.1',
+            {'ipaddr': '10.0.0.2', 'version': '500'},
+            '10.0.0.0/30',
+            '192.168.1.7/24',
+            ' 172.16.0.1 ',
+            '1.1.1.1-1.1.1.9',
+            '2001:db8::1',
+            '2001:db8:1::/48',
+            ipaddress.ip_address('2001:db8::2'),
+        ])
+        # 10.0.0.0/30 merged, 2001:db8::1-2001:db8::2 merged
+        self.assertEqual(len(index), 6)
+        self.assertEqual(index.num_addresses, 4 + 256 + 1 + 9 + 2 + 2 ** 80)
+
+        for x in ('10.0.0.3', '192.168.1.0', '192.168.1.255', '172.16.0.1',
+                  '1.1.1.5', '2001:db8::2', '2001:db8:1:ffff::1',
+                  ipaddress.ip_address('10.0.0.0')):
+            self.assertTrue(index.contains(x), msg=x)
+            self.assertIn(x, index)
+        for x in ('10.0.0.4', '0.0.0.0', '255.255.255.255', '1.1.1.10',
+                  '2001:db8::3', '2001:db8:2::', '::', '::ffff:10.0.0.1'):
+            self.assertFalse(index.contains(x), msg=x)
+
+        self.assertEqual([str(x) for x in index.networks()][:4],
+                         ['1.1.1.1/32', '1.1.1.2/31', '1.1.1.4/30',
+                          '1.1.1.8/31'])
+
+    def test_02(self):
+        index = EdlIndex()
+        self.assertEqual(len(index), 0)
+        self.assertEqual(index.nbytes, 0)
+        self.assertFalse(index.contains('10.0.0.1'))
+        self.assertFalse(index.contains('2001:db8::1'))
+        self.assertEqual(index.lookup(['10.0.0.1', '::1']), [False, False])
+        self.assertEqual(index.lookup([]), [])
+
+    def test_03(self):
+        for x in ('x', '10.0.0', '10.0.0.1/33', '10.0.0.9-10.0.0.1',
+                  '10.0.0.1-2001:db8::1', 100):
+            with self.assertRaises(pantv.ArgsError, msg=x):
+                EdlIndex([x])
+        with self.assertRaises(pantv.ApiError):
+            EdlIndex([{'version': '500'}])
+
+        index = EdlIndex(['10.0.0.1'])
+        for x in ('x', '10.0.0.0/24', None):
+            with self.assertRaises(pantv.ArgsError, msg=x):
+                index.contains(x)
+            with self.assertRaises(pantv.ArgsError, msg=x):
+                index.lookup(['10.0.0.1', x])
+
+    def test_04(self):
+        # bulk lookup and contains() agree with ipaddress
+        rand = random.Random(0)
+        nets = []
+        for i in range(500):
+            if i % 2:
+                x = rand.getrandbits(32), rand.randint(8, 32)
+            else:
+                x = (0x20010db8 << 96 | rand.getrandbits(24) << 72,
+                     rand.randint(48, 128))
+            nets.append(ipaddress.ip_network(x, strict=False))
+        index = EdlIndex(str(x) for x in nets)
+
+        ips = []
+        for net in nets:
+            ips.extend([net.network_address, net.broadcast_address])
+            if int(net.network_address) > 0:
+                ips.append(net.network_address - 1)
+        ips.extend(ipaddress.ip_address(rand.getrandbits(32))
+                   for _ in range(500))
+        rand.shuffle(ips)
+
+        expected = [any(x in net for net in nets if net.version == x.version)
+                    for x in ips]
+        self.assertEqual([index.contains(x) for x in ips], expected)
+        self.assertEqual(index.lookup(str(x) for x in ips), expected)
+        self.assertEqual(EdlIndex(index.networks()), index)
+
+    def test_05(self):
+        a = EdlIndex(['10.0.0.0/24', '10.0.2.0/24', '10.0.4.1',
+                      '2001:db8::/64'])
+        b = EdlIndex(['10.0.0.16/28', '10.0.1.0/24', '10.0.2.0/23',
+                      '2001:db8::1', '2001:db8:1::1'])
+        self.assertEqual([(str(x), str(y)) for x, y in (a - b).ranges()],
+                         [('10.0.0.0', '10.0.0.15'),
+                          ('10.0.0.32', '10.0.0.255'),
+                          ('10.0.4.1', '10.0.4.1'),
+                          ('2001:db8::', '2001:db8::'),
+                          ('2001:db8::2', '2001:db8::ffff:ffff:ffff:ffff')])
+        self.assertEqual([(str(x), str(y)) for x, y in (b - a).ranges()],
+                         [('10.0.1.0', '10.0.1.255'),
+                          ('10.0.3.0', '10.0.3.255'),
+                          ('2001:db8:1::1', '2001:db8:1::1')])
+        self.assertEqual(len(a - a), 0)
+        self.assertEqual(a - EdlIndex(), a)
+        self.assertEqual(a.difference(b), a - b)
+
+    def test_06(self):
+        index = EdlIndex(['10.0.0.0/24', '10.1.0.1', '2001:db8::1'])
+        x = index.tobytes()
+        self.assertEqual(EdlIndex.frombytes(x), index)
+        self.assertEqual(EdlIndex.frombytes(EdlIndex().tobytes()),
+                         EdlIndex())
+        for x in (b'', x[:-1], b'\xff' + x[1:]):
+            with self.assertRaises(pantv.ArgsError):
+                EdlIndex.frombytes(x)
+
+
+class EdlWriterTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, 'edl.txt')
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def read(self):
+        with open(self.path) as f:
+            return f.read()
+
+    def test_01(self):
+        items = ['10.0.0.1', {'ipaddr': '10.0.0.0', 'version': '1'},
+                 '2001:db8::/64', '10.0.0.2']
+        with EdlWriter(self.path) as writer:
+            writer.write(items)
+        self.assertEqual(self.read(),
+                         '10.0.0.1\n10.0.0.0\n2001:db8::/64\n10.0.0.2\n')
+        self.assertEqual(os.listdir(self.dir.name), ['edl.txt'])
+
+        writer = EdlWriter(self.path)
+        writer.write(items)
+        x = writer.close()
+        self.assertFalse(x.changed)
+        self.assertEqual(x.count, 4)
+
+        writer = EdlWriter(self.path, collapse=True)
+        writer.write(items)
+        x = writer.close()
+        self.assertTrue(x.changed)
+        self.assertEqual(x.count, 3)
+        self.assertEqual(self.read(),
+                         '10.0.0.0/31\n10.0.0.2\n2001:db8::/64\n')
+
+    def test_02(self):
+        with EdlWriter(self.path) as writer:
+            writer.write(['10.0.0.1'])
+        with self.assertRaises(pantv.ApiError):
+            with EdlWriter(self.path) as writer:
+                writer.write(['10.0.0.2', '10.0.0.3\n10.0.0.4'])
+        # unchanged on error
+        self.assertEqual(self.read(), '10.0.0.1\n')
+        self.assertEqual(os.listdir(self.dir.name), ['edl.txt'])
+
+        with self.assertRaises(pantv.ArgsError):
+            EdlWriter(os.path.join(self.dir.name, 'x', 'edl.txt'))
+
+
+if __name__ == '__main__':
+    unittest.main()
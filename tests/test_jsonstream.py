@@ -0,0 +1,242 @@
+import http.server
+import json
+import os
+import sys
+import threading
+import unittest
+
+import pantv
+import pantv.v1aioapi
+from pantv.cache import ResponseCache
+from pantv.jsonstream import PageParser
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__),
+                                os.pardir, 'bench'))
+from mockserver import MockServer, EDL_NAMES  # noqa: E402
+
+COUNT = 2500
+
+THREATS = {
+    'success': True,
+    'count': 12,
+    'data': {
+        'vulnerability': [{'id': str(i), 'name': 'é' * i, 'x': [1.5, None]}
+                          for i in range(5)],
+        'spyware': [],
+        'antivirus': [{'id': '99'}],
+    },
+    'message': 'Successful',
+}
+
+EDL = {
+    'data': ['10.0.0.%d' % i for i in range(7)],
+    'count': 70000,
+}
+
+
+def parse(body, size):
+    parser = PageParser()
+    items = []
+    for i in range(0, len(body), size):
+        items.extend(parser.feed(body[i:i + size]))
+    items.extend(parser.close())
+    return parser, items
+
+
+class PageParserTest(unittest.TestCase):
+    def test_01(self):
+        body = json.dumps(THREATS, indent=2, ensure_ascii=False).encode()
+        expected = [x for k in THREATS['data'] for x in THREATS['data'][k]]
+        for size in (1, 2, 3, 7, 64, len(body)):
+            parser, items = parse(body, size)
+            self.assertEqual(items, expected)
+            self.assertEqual(parser.meta['count'], 12)
+            self.assertEqual(parser.meta['message'], 'Successful')
+
+    def test_02(self):
+        body = json.dumps(EDL).encode()
+        for size in (1, 5, len(body)):
+            parser, items = parse(body, size)
+            self.assertEqual(items, EDL['data'])
+            # number split across chunks
+            self.assertEqual(parser.meta['count'], 70000)
+
+    def test_03(self):
+        parser = PageParser()
+        items = parser.feed(b'{"count": 2, "data": [{"a": 1}, {"a"')
+        self.assertEqual(items, [{'a': 1}])
+        items = parser.feed(b': 2}]}')
+        self.assertEqual(items, [{'a': 2}])
+        self.assertEqual(parser.close(), [])
+
+    def test_04(self):
+        for body in (b'[1]', b'{"data": [1, 2', b'{"count": 1}x'):
+            parser = PageParser()
+            with self.assertRaises(ValueError):
+                parser.feed(body)
+                parser.close()
+
+    def test_05(self):
+        # only the selected arrays of a data object are streamed
+        parser = PageParser(('ipaddr',))
+        items = parser.feed(b'{"count": 2, "data": {"x": [1], '
+                            b'"ipaddr": ["a", "b"]}}')
+        self.assertEqual(items, ['a', 'b'])
+        self.assertEqual(parser.meta['data'], {'x': [1], 'ipaddr': []})
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = b'{"count": 2, "data": [{"a": 1}, {"a"'
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class _ClientStreamTest:
+    @classmethod
+    def setUpClass(cls):
+        cls.server = MockServer(count=COUNT).start()
+        cls.bad = http.server.ThreadingHTTPServer(('127.0.0.1', 0),
+                                                  _Handler)
+        threading.Thread(target=cls.bad.serve_forever, daemon=True).start()
+        cls.bad_url = 'http://127.0.0.1:%d' % cls.bad.server_address[1]
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.bad.shutdown()
+        cls.bad.server_close()
+        cls.server.stop()
+
+    def requests(self):
+        return sum(n for (method, path, status), n in
+                   self.server.stats.items()
+                   if path == '/service/v1/threats')
+
+
+class ClientStreamTest(_ClientStreamTest, unittest.TestCase):
+    def setUp(self):
+        self.api = pantv.ThreatVaultApi(url=self.server.url,
+                                        api_key='x')
+
+    def tearDown(self):
+        self.api.session.close()
+
+    def all(self, func, **kwargs):
+        items = []
+        for ok, x in func(**kwargs):
+            self.assertTrue(ok, x)
+            items.append(x)
+        return items
+
+    def test_01(self):
+        for concurrency in (1, 4):
+            expected = self.all(self.api.threats_all, type='vulnerability',
+                                concurrency=concurrency)
+            self.assertEqual(len(expected), COUNT)
+            items = self.all(self.api.threats_all, type='vulnerability',
+                             concurrency=concurrency, stream=True)
+            self.assertEqual(items, expected)
+
+    def test_02(self):
+        for listformat in (None, 'array'):
+            expected = self.all(self.api.edl_all, name=EDL_NAMES[0],
+                                listformat=listformat)
+            self.assertGreater(len(expected), 1000)
+            items = self.all(self.api.edl_all, name=EDL_NAMES[0],
+                             listformat=listformat, stream=True)
+            self.assertEqual(items, expected)
+            if listformat == 'array':
+                self.assertTrue(all(isinstance(x, str) for x in items))
+
+    def test_03(self):
+        api = pantv.ThreatVaultApi(url=self.bad_url, api_key='x')
+        with self.assertRaisesRegex(pantv.ApiError, 'Malformed response'):
+            self.all(api.threats_all, stream=True)
+        api.session.close()
+
+    def test_04(self):
+        cache = ResponseCache()
+        api = pantv.ThreatVaultApi(url=self.server.url, api_key='x',
+                                   cache=cache)
+        expected = self.all(api.threats_all, type='vulnerability')
+        self.assertGreater(len(cache), 0)
+        cache.clear()
+        for _ in range(2):
+            n = self.requests()
+            items = self.all(api.threats_all, type='vulnerability',
+                             stream=True)
+            self.assertEqual(items, expected)
+            # streamed pages are not cached
+            self.assertEqual(len(cache), 0)
+            self.assertEqual(self.requests(), n + -(-COUNT // 1000))
+        api.session.close()
+
+
+class AioClientStreamTest(_ClientStreamTest,
+                          unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.api = pantv.v1aioapi.ThreatVaultApi(url=self.server.url,
+                                                 api_key='x')
+
+    async def asyncTearDown(self):
+        await self.api.session.close()
+
+    async def all(self, func, **kwargs):
+        items = []
+        async for ok, x in func(**kwargs):
+            self.assertTrue(ok, x)
+            items.append(x)
+        return items
+
+    async def test_01(self):
+        for concurrency in (1, 4):
+            expected = await self.all(self.api.threats_all,
+                                      type='vulnerability',
+                                      concurrency=concurrency)
+            self.assertEqual(len(expected), COUNT)
+            items = await self.all(self.api.threats_all,
+                                   type='vulnerability',
+                                   concurrency=concurrency, stream=True)
+            self.assertEqual(items, expected)
+
+    async def test_02(self):
+        for listformat in (None, 'array'):
+            expected = await self.all(self.api.edl_all, name=EDL_NAMES[0],
+                                      listformat=listformat)
+            self.assertGreater(len(expected), 1000)
+            items = await self.all(self.api.edl_all, name=EDL_NAMES[0],
+                                   listformat=listformat, stream=True)
+            self.assertEqual(items, expected)
+
+    async def test_03(self):
+        api = pantv.v1aioapi.ThreatVaultApi(url=self.bad_url, api_key='x')
+        with self.assertRaisesRegex(pantv.ApiError, 'Malformed response'):
+            await self.all(api.threats_all, stream=True)
+        await api.session.close()
+
+    async def test_04(self):
+        cache = ResponseCache()
+        api = pantv.v1aioapi.ThreatVaultApi(url=self.server.url,
+                                            api_key='x', cache=cache)
+        expected = await self.all(api.threats_all, type='vulnerability')
+        self.assertGreater(len(cache), 0)
+        cache.clear()
+        for _ in range(2):
+            n = self.requests()
+            items = await self.all(api.threats_all, type='vulnerability',
+                                   stream=True)
+            self.assertEqual(items, expected)
+            # streamed pages are not cached
+            self.assertEqual(len(cache), 0)
+            self.assertEqual(self.requests(), n + -(-COUNT // 1000))
+        await api.session.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
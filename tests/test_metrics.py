@@ -0,0 +1,153 @@
+import asyncio
+import http.server
+import threading
+import unittest
+
+import pantv
+import pantv.v1aioapi
+from pantv import ArgsError
+from pantv.metrics import Histogram, Metrics
+
+BODY = b'{"success": true, "count": 1, "data": {"spyware": [{"id": "1"}]}}'
+
+
+class HistogramTest(unittest.TestCase):
+    def test_01(self):
+        h = Histogram((0.1, 1.0))
+        for x in (0.05, 0.1, 0.5, 2.0):
+            h.observe(x)
+        self.assertEqual(h.count, 4)
+        self.assertAlmostEqual(h.sum, 2.65)
+        # le is inclusive
+        self.assertEqual(list(h.cumulative()),
+                         [(0.1, 2), (1.0, 3), (float('inf'), 4)])
+
+
+class MetricsTest(unittest.TestCase):
+    def test_01(self):
+        with self.assertRaises(ArgsError):
+            Metrics(callback='x')
+        with self.assertRaises(ArgsError):
+            Metrics(buckets=['x'])
+
+    def test_02(self):
+        events = []
+        m = Metrics(callback=events.append)
+        m.request(method='GET', endpoint='/service/v1/edl', status=200,
+                  connect=0.01, ttfb=0.02, total=0.03,
+                  bytes_received=100)
+        m.request(method='GET', endpoint='/service/v1/edl', status=429,
+                  ttfb=0.02, total=0.02)
+        m.retry(method='GET', endpoint='/service/v1/edl', reason='429')
+        m.sleep(reason='429', seconds=1.5)
+        m.cache_hit(method='GET', endpoint='/service/v1/edl')
+
+        key = ('GET', '/service/v1/edl')
+        self.assertEqual(m.requests[key + (200,)], 1)
+        self.assertEqual(m.requests[key + (429,)], 1)
+        self.assertEqual(m.latency[key + ('connect',)].count, 1)
+        self.assertEqual(m.latency[key + ('total',)].count, 2)
+        self.assertEqual(m.bytes_received[key], 100)
+        self.assertEqual(m.retries[key + ('429',)], 1)
+        self.assertEqual(m.sleep_seconds['429'], 1.5)
+        self.assertEqual(m.cache_hits[key], 1)
+        self.assertEqual([x['event'] for x in events],
+                         ['request', 'request', 'retry', 'sleep',
+                          'cache_hit'])
+        self.assertEqual(events[0]['status'], 200)
+
+        m.reset()
+        self.assertEqual(len(m.requests), 0)
+        self.assertEqual(len(m.latency), 0)
+
+    def test_03(self):
+        m = Metrics(buckets=[1, 0.1])
+        m.request(method='GET', endpoint='/service/v1/threats',
+                  status=200, ttfb=0.05, total=0.5)
+        m.sleep(reason='rate_limit', seconds=2)
+        lines = m.prometheus().splitlines()
+        labels = 'method="GET",endpoint="/service/v1/threats"'
+        for x in [
+                '# TYPE pantv_requests_total counter',
+                'pantv_requests_total{%s,status="200"} 1' % labels,
+                '# TYPE pantv_request_total_seconds histogram',
+                'pantv_request_total_seconds_bucket{%s,le="0.1"} 0' % labels,
+                'pantv_request_total_seconds_bucket{%s,le="1.0"} 1' % labels,
+                'pantv_request_total_seconds_bucket{%s,le="+Inf"} 1' % labels,
+                'pantv_request_total_seconds_count{%s} 1' % labels,
+                'pantv_request_total_seconds_sum{%s} 0.5' % labels,
+                'pantv_sleep_seconds_total{reason="rate_limit"} 2',
+        ]:
+            self.assertIn(x, lines)
+        # no connect time observed
+        self.assertFalse([x for x in lines
+                          if x.startswith('pantv_request_connect_seconds{')])
+
+        x = m.prometheus(prefix='tv')
+        self.assertIn('tv_requests_total{%s,status="200"} 1' % labels,
+                      x.splitlines())
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    # chunked response without Content-Length
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        for i in range(0, len(BODY), 16):
+            x = BODY[i:i + 16]
+            self.wfile.write(b'%x\r\n%s\r\n' % (len(x), x))
+        self.wfile.write(b'0\r\n\r\n')
+
+    def log_message(self, *args):
+        pass
+
+
+class ClientMetricsTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0),
+                                                     _Handler)
+        threading.Thread(target=cls.server.serve_forever,
+                         daemon=True).start()
+        cls.url = 'http://127.0.0.1:%d' % cls.server.server_address[1]
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def check(self, metrics, bytes_received):
+        key = ('GET', '/service/v1/threats')
+        self.assertEqual(metrics.requests[key + (200,)], 1)
+        if bytes_received is None:
+            # length unknown: not counted as 0 bytes
+            self.assertNotIn(key, metrics.bytes_received)
+        else:
+            self.assertEqual(metrics.bytes_received[key], bytes_received)
+
+    def test_01(self):
+        for stream, bytes_received in ((False, len(BODY)), (True, None)):
+            api = pantv.ThreatVaultApi(url=self.url, api_key='x',
+                                       metrics=True)
+            resp = api.threats(id='1', stream=stream)
+            self.assertEqual(resp.content, BODY)
+            api.session.close()
+            self.check(api.metrics, bytes_received)
+
+    def test_02(self):
+        async def threats():
+            async with pantv.v1aioapi.ThreatVaultApi(
+                    url=self.url, api_key='x', metrics=True) as api:
+                resp = await api.threats(id='1')
+                self.assertEqual(await resp.read(), BODY)
+            return api.metrics
+
+        self.check(asyncio.run(threats()), None)
+
+
+if __name__ == '__main__':
+    unittest.main()
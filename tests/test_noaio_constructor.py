@@ -27,3 +27,40 @@ class ThreatVaultApiTest(unittest.TestCase):
             self.api = pantv.ThreatVaultApi(**kwargs)
         self.assertRegex(str(e.exception),
                          '^Invalid api_version')
+
+    def test_03(self):
+        kwargs = {
+            'api_key': 'x',
+            'timeout': 5,
+            'pool_connections': 2,
+            'pool_maxsize': '20',
+            'pool_block': True,
+        }
+        self.api = pantv.ThreatVaultApi(**kwargs)
+        adapter = self.api.session.get_adapter(self.api.url)
+        self.assertIs(adapter,
+                      self.api.session.get_adapter('http://localhost'))
+        self.assertEqual(adapter.timeout, 5)
+        self.assertEqual(adapter._pool_connections, 2)
+        self.assertEqual(adapter._pool_maxsize, 20)
+        self.assertTrue(adapter._pool_block)
+        self.assertEqual(self.api.session.headers['Connection'], 'keep-alive')
+
+    def test_04(self):
+        kwargs = {
+            'api_key': 'x',
+            'keepalive': False,
+        }
+        self.api = pantv.ThreatVaultApi(**kwargs)
+        self.assertEqual(self.api.session.headers['Connection'], 'close')
+        adapter = self.api.session.get_adapter(self.api.url)
+        self.assertEqual(adapter._pool_maxsize, 10)
+        self.assertFalse(adapter._pool_block)
+
+    def test_05(self):
+        for k, v, msg in (('pool_maxsize', 'x', 'pool_maxsize not int'),
+                          ('pool_connections', 0,
+                           'pool_connections must be greater than 0')):
+            with self.assertRaises(pantv.ArgsError) as e:
+                self.api = pantv.ThreatVaultApi(api_key='x', **{k: v})
+            self.assertEqual(str(e.exception), msg)
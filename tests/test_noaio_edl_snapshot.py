@@ -0,0 +1,169 @@
+import os
+import sys
+import tempfile
+import unittest
+
+import pantv
+from pantv.edl import EdlIndex, EdlSnapshot
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__),
+                                os.pardir, 'bench'))
+from mockserver import (MockServer, Dataset,  # noqa: E402
+                        EDL_NAMES, EDL_VERSION)
+
+COUNT = 2000
+NAME = 'panw-known-ip-list'
+
+
+class ThreatVaultApiTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = MockServer(count=COUNT).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        self.api = pantv.ThreatVaultApi(url=self.server.url,
+                                        api_key='x',
+                                        metrics=True)
+
+    def tearDown(self):
+        self.api.session.close()
+        os.unlink(self.path)
+
+    def requests(self):
+        return sum(self.api.metrics.requests.values())
+
+    def test_01(self):
+        dataset = Dataset(COUNT)
+        latest = EdlIndex(dataset.edl(NAME, EDL_VERSION))
+
+        with EdlSnapshot(self.path) as snapshot:
+            self.assertIsNone(snapshot.version(NAME))
+            self.assertIsNone(snapshot.index(NAME))
+
+            x = snapshot.update(self.api, name=NAME)
+            self.assertIsNone(x.old_version)
+            self.assertEqual(x.version, str(EDL_VERSION))
+            self.assertEqual(x.added, latest)
+            self.assertEqual(len(x.removed), 0)
+            self.assertTrue(x.changed)
+            self.assertEqual(snapshot.index(NAME), latest)
+            self.assertEqual(snapshot.names(), [NAME])
+
+            # unchanged version: only the latest version is requested
+            x = snapshot.update(self.api, name=NAME)
+            self.assertEqual(x.old_version, x.version)
+            self.assertFalse(x.changed)
+
+    def test_02(self):
+        dataset = Dataset(COUNT)
+        old = set(dataset.edl(NAME, EDL_VERSION - 1))
+        new = set(dataset.edl(NAME, EDL_VERSION))
+
+        with EdlSnapshot(self.path) as snapshot:
+            snapshot.update(self.api, name=NAME)
+        # previous version in the snapshot
+        with EdlSnapshot(self.path) as snapshot:
+            with snapshot.db:
+                snapshot.db.execute('UPDATE edls SET version = ?, data = ?',
+                                    (str(EDL_VERSION - 1),
+                                     EdlIndex(old).tobytes()))
+            x = snapshot.update(self.api, name=NAME, concurrency=4)
+            self.assertEqual(x.old_version, str(EDL_VERSION - 1))
+            self.assertEqual(x.version, str(EDL_VERSION))
+            self.assertEqual(x.added, EdlIndex(new) - EdlIndex(old))
+            self.assertEqual(x.removed, EdlIndex(old) - EdlIndex(new))
+            self.assertGreater(len(x.added), 0)
+            self.assertGreater(len(x.removed), 0)
+
+    def test_03(self):
+        with EdlSnapshot(self.path) as snapshot:
+            with self.assertRaises(pantv.ApiError):
+                snapshot.update(self.api, name='xxx-invalid')
+            self.assertEqual(snapshot.names(), [])
+
+    def test_04(self):
+        dataset = Dataset(COUNT)
+        ips = ['10.255.0.1', '2001:db8:ffff::1']
+        for name in EDL_NAMES:
+            ips.extend(x for x in dataset.edl(name, EDL_VERSION)[:3]
+                       if '/' not in x)
+        expected = {x: sorted(name for name in EDL_NAMES
+                              if x in dataset.edl_set(name, EDL_VERSION))
+                    for x in ips}
+
+        with EdlSnapshot(self.path) as snapshot:
+            # empty snapshot
+            x = self.api.edl_lookup(ipaddrs=ips, snapshot=snapshot,
+                                    concurrency=4)
+            self.assertEqual(x, expected)
+
+            for name in EDL_NAMES:
+                snapshot.update(self.api, name=name)
+            n = self.requests()
+            x = self.api.edl_lookup(ipaddrs=ips, snapshot=snapshot)
+            self.assertEqual(x, expected)
+            self.assertEqual(self.requests(), n)
+
+            names = EDL_NAMES[:2]
+            x = self.api.edl_lookup(ipaddrs=ips, snapshot=snapshot,
+                                    names=names)
+            self.assertEqual(x, {k: [y for y in v if y in names]
+                                 for k, v in expected.items()})
+            self.assertEqual(self.requests(), n)
+
+            # stale snapshot
+            x = self.api.edl_lookup(ipaddrs=ips, snapshot=snapshot,
+                                    names=names, max_age=0)
+            self.assertEqual(x, {k: [y for y in v if y in names]
+                                 for k, v in expected.items()})
+            self.assertEqual(self.requests(), n + len(ips))
+
+    def test_05(self):
+        dataset = Dataset(COUNT)
+        ips = [x for name in EDL_NAMES
+               for x in dataset.edl(name, EDL_VERSION)[:3]
+               if '/' not in x]
+        expected = {x: sorted(name for name in EDL_NAMES
+                              if x in dataset.edl_set(name, EDL_VERSION))
+                    for x in ips}
+        self.assertEqual(pantv.EDL_NAMES, EDL_NAMES)
+
+        with EdlSnapshot(self.path) as snapshot:
+            # snapshot without all EDLs: API requests for the others
+            for name in EDL_NAMES[:2]:
+                snapshot.update(self.api, name=name)
+            n = self.requests()
+            x = self.api.edl_lookup(ipaddrs=ips, snapshot=snapshot,
+                                    concurrency=4)
+            self.assertEqual(x, expected)
+            self.assertEqual(self.requests(), n + len(ips))
+
+            # all EDLs named in the snapshot
+            n = self.requests()
+            x = self.api.edl_lookup(ipaddrs=ips, snapshot=snapshot,
+                                    names=EDL_NAMES[:2])
+            self.assertEqual(x, {k: [y for y in v if y in EDL_NAMES[:2]]
+                                 for k, v in expected.items()})
+            self.assertEqual(self.requests(), n)
+
+            # fresh EDLs are from the snapshot
+            with snapshot.db:
+                snapshot.db.execute('UPDATE edls SET data = ? '
+                                    'WHERE name = ?',
+                                    (EdlIndex().tobytes(), EDL_NAMES[0]))
+            x = self.api.edl_lookup(ipaddrs=ips, snapshot=snapshot)
+            self.assertEqual(x, {k: [y for y in v if y != EDL_NAMES[0]]
+                                 for k, v in expected.items()})
+            x = self.api.edl_lookup(ipaddrs=ips, snapshot=snapshot,
+                                    max_age=0)
+            self.assertEqual(x, expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
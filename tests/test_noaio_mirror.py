@@ -0,0 +1,48 @@
+import os
+import tempfile
+import unittest
+
+from pantv.mirror import ThreatMirror
+from . import mixin
+
+
+class ThreatVaultApiTest(mixin.Mixin, unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        fd, self.path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+
+    def tearDown(self):
+        os.unlink(self.path)
+        super().tearDown()
+
+    def test_01(self):
+        type_ = 'vulnerability'
+        with ThreatMirror(self.path) as mirror:
+            totals = mirror.sync(self.api, types=[type_], concurrency=4)
+            self.assertGreater(totals[type_], 0)
+            self.assertEqual(mirror.count(type_), totals[type_])
+            version = mirror.release_version(type_)
+            self.assertIsNotNone(version)
+
+            x = mirror.threats(id=30000)
+            self.assertEqual(len(x), 1)
+            self.assertEqual(x[0]['id'], '30000')
+            self.assertEqual(x[0]['cve'][0], 'CVE-2018-15984')
+
+            x = mirror.threats(cve='CVE-2018-15984')
+            self.assertIn('30000', [item['id'] for item in x])
+
+            x = mirror.threats(cve='CVE-2018')
+            self.assertIn('30000', [item['id'] for item in x])
+
+            # incremental sync from last release version
+            totals2 = mirror.sync(self.api, types=[type_])
+            self.assertLess(totals2[type_], totals[type_])
+            self.assertEqual(mirror.count(type_), totals[type_])
+            self.assertGreaterEqual(mirror.release_version(type_), version)
+
+    def test_02(self):
+        with ThreatMirror(self.path) as mirror:
+            self.assertEqual(mirror.threats(id=30000), [])
+            self.assertIsNone(mirror.release_version('vulnerability'))
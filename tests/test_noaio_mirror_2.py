@@ -0,0 +1,111 @@
+import os
+import sys
+import tempfile
+import unittest
+
+import pantv
+from pantv.mirror import ThreatMirror, DEFAULT_TYPES
+
+TYPES = DEFAULT_TYPES + ('antivirus',)
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__),
+                                os.pardir, 'bench'))
+from mockserver import MockServer, Dataset  # noqa: E402
+
+COUNT = 2000
+
+
+class ThreatVaultApiTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = MockServer(count=COUNT).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        self.api = pantv.ThreatVaultApi(url=self.server.url,
+                                        api_key='x')
+
+    def tearDown(self):
+        self.api.session.close()
+        os.unlink(self.path)
+
+    def test_01(self):
+        dataset = Dataset(COUNT)
+        with ThreatMirror(self.path) as mirror:
+            totals = mirror.sync(self.api, types=TYPES, concurrency=4)
+            self.assertEqual(totals, {x: COUNT for x in TYPES})
+            self.assertEqual(mirror.count(), COUNT * len(TYPES))
+
+            threats = dataset.threats['vulnerability']
+            version = max(int(x['latest_release_version'])
+                          for x in threats)
+            self.assertEqual(mirror.release_version('vulnerability'),
+                             version)
+            threats = dataset.threats['antivirus']
+            release_time = max(x['latest_release_time'] for x in threats)
+            self.assertEqual(mirror.release_time('antivirus'),
+                             release_time)
+
+            x = dataset.threats['antivirus'][10]
+            self.assertEqual(mirror.threats(sha256=x['sha256'].upper()),
+                             [x])
+            self.assertEqual(mirror.threats(md5=x['md5']), [x])
+
+            # incremental sync: IPS types from the latest release
+            # version, virus types from the latest release date
+            totals = mirror.sync(self.api, types=TYPES)
+            threats = dataset.threats['vulnerability']
+            self.assertEqual(totals['vulnerability'],
+                             sum(1 for x in threats
+                                 if int(x['latest_release_version']) >=
+                                 version))
+            threats = dataset.threats['antivirus']
+            self.assertEqual(totals['antivirus'],
+                             sum(1 for x in threats
+                                 if x['latest_release_time'][:10] >=
+                                 release_time[:10]))
+            for x in TYPES:
+                self.assertGreater(totals[x], 0)
+                self.assertLess(totals[x], COUNT)
+            self.assertEqual(mirror.count(), COUNT * len(TYPES))
+
+    def test_02(self):
+        with ThreatMirror(self.path) as mirror:
+            self.assertIsNone(mirror.release_time('antivirus'))
+            with self.assertRaises(pantv.ApiError):
+                mirror.sync(self.api, types=['xxx-invalid'])
+
+    def test_03(self):
+        deleted = {'id': '1', 'name': 'deleted', 'cve': ['CVE-2000-0001'],
+                   'latest_release_version': '1'}
+        with ThreatMirror(self.path) as mirror:
+            totals = mirror.sync(self.api)
+            self.assertEqual(totals, {x: COUNT for x in DEFAULT_TYPES})
+            self.assertIsNone(mirror.last_sync('antivirus'))
+            with mirror.db:
+                mirror._store('vulnerability', deleted, False)
+            n = mirror.count()
+
+            # incremental sync does not remove signatures
+            mirror.sync(self.api, types=['vulnerability'])
+            self.assertEqual(mirror.count(), n)
+
+            totals = mirror.sync(self.api, types=['vulnerability'],
+                                 full=True)
+            self.assertEqual(totals, {'vulnerability': COUNT})
+            self.assertEqual(mirror.count(), n - 1)
+            self.assertEqual(mirror.count('vulnerability'), COUNT)
+            self.assertEqual(mirror.threats(id='1'), [])
+            self.assertEqual(mirror.threats(cve='CVE-2000-0001'), [])
+            x = mirror.db.execute('SELECT COUNT(*) FROM keys WHERE '
+                                  'id = ?', ('1',)).fetchone()
+            self.assertEqual(x[0], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,115 @@
+import concurrent.futures
+import os
+import sys
+import threading
+import unittest
+
+import requests
+
+import pantv
+from pantv.metrics import Metrics
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__),
+                                os.pardir, 'bench'))
+from mockserver import MockServer, ID_BASE  # noqa: E402
+
+THREADS = 32
+POOL_MAXSIZE = 8
+
+
+class ThreatVaultApiTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = MockServer(count=2000).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+
+    def tvapi(self, **kwargs):
+        self.metrics = Metrics()
+        return pantv.ThreatVaultApi(url=self.server.url,
+                                    api_key='x',
+                                    metrics=self.metrics,
+                                    **kwargs)
+
+    def connections(self):
+        return sum(x.count for k, x in self.metrics.latency.items()
+                   if k[2] == 'connect')
+
+    def test_01(self):
+        with self.tvapi(thread_safe=True) as api:
+            sessions = set()
+            lock = threading.Lock()
+
+            def f():
+                with lock:
+                    sessions.add(id(api.session))
+                return api.session.get_adapter(api.url)
+
+            with concurrent.futures.ThreadPoolExecutor(
+                    max_workers=4) as executor:
+                adapters = list(executor.map(lambda x: f(), range(20)))
+            # session per thread, one adapter
+            self.assertGreater(len(sessions), 1)
+            self.assertEqual(len(set(id(x) for x in adapters)), 1)
+            self.assertIs(api.session.get_adapter(api.url), adapters[0])
+
+    def test_02(self):
+        ids = [str(ID_BASE['vulnerability'] + i) for i in range(2000)]
+
+        with self.tvapi(thread_safe=True,
+                        pool_maxsize=POOL_MAXSIZE,
+                        pool_block=True) as api:
+            def lookup(id_):
+                resp = api.threats(id=id_)
+                resp.raise_for_status()
+                x = resp.json()['data']['vulnerability']
+                return x[0]['id']
+
+            with concurrent.futures.ThreadPoolExecutor(
+                    max_workers=THREADS) as executor:
+                results = list(executor.map(lookup, ids))
+
+        self.assertEqual(results, ids)
+        self.assertEqual(
+            self.metrics.requests[('GET', '/service/v1/threats', 200)],
+            len(ids))
+        # connections are reused, no reconnect storm
+        self.assertLessEqual(self.connections(), POOL_MAXSIZE)
+
+    def test_03(self):
+        with self.tvapi(thread_safe=True,
+                        pool_maxsize=THREADS) as api:
+            x = [x for ok, x in api.threats_all(type='ips', limit=100,
+                                                concurrency=THREADS)
+                 if ok]
+        self.assertEqual(len(x), 3 * 2000)
+        self.assertEqual(len(set(y['id'] for y in x)), len(x))
+        self.assertLessEqual(self.connections(), THREADS)
+
+    def test_04(self):
+        for thread_safe in (False, True):
+            with self.tvapi(thread_safe=thread_safe) as api:
+                old = api.session
+                session = requests.Session()
+                session.headers.update(old.headers)
+                api.session = session
+                self.assertIs(api.session, session)
+                resp = api.threats(id=str(ID_BASE['vulnerability']))
+                self.assertEqual(resp.status_code, 200)
+                old.close()
+
+                with concurrent.futures.ThreadPoolExecutor(
+                        max_workers=1) as executor:
+                    other = executor.submit(lambda: api.session).result()
+                if thread_safe:
+                    # only the current thread's session is replaced
+                    self.assertIsNot(other, session)
+                    other.close()
+                else:
+                    self.assertIs(other, session)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,40 @@
+import hashlib
+import unittest
+
+from . import mixin
+
+
+class ThreatVaultApiTest(mixin.Mixin, unittest.TestCase):
+    def test_01(self):
+        resp = self.api.threats2(id=['280392504'])
+        self.assertEqual(resp.status_code, 200)
+        x = resp.json()
+        hashes = x['data']['antivirus'][0]['related_sha256_hashes']
+
+        args = []
+        for n in range(1, 250):
+            m = hashlib.sha256(b'threat vault' * n)
+            args.append(m.hexdigest())
+        args[10:10] = hashes
+        # duplicates are removed
+        args.extend(x.upper() for x in hashes)
+
+        results = self.api.threats2_bulk(sha256=args,
+                                         concurrency=3,
+                                         retry=True)
+        self.assertEqual(len(results), len(args) - len(hashes))
+        self.assertEqual(list(results)[10:10+len(hashes)],
+                         [x.lower() for x in hashes])
+        for k, v in results.items():
+            if k in hashes:
+                self.assertGreater(len(v), 0, k)
+            else:
+                self.assertEqual(v, [], k)
+
+    def test_02(self):
+        results = self.api.threats2_bulk(id=['30000', 30000, '19999'],
+                                         batch_size=1)
+        self.assertEqual(list(results), ['30000', '19999'])
+        self.assertEqual(results['30000'][0]['cve'][0], 'CVE-2018-15984')
+        self.assertEqual(results['19999'][0]['name'],
+                         'Bot: Backdoor_Win32_Agobot_pnd_pnj')
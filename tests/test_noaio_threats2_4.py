@@ -0,0 +1,60 @@
+import os
+import sys
+import unittest
+
+import pantv
+from pantv.mixin import _threats2_merge
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__),
+                                os.pardir, 'bench'))
+from mockserver import MockServer, Dataset  # noqa: E402
+
+COUNT = 500
+
+
+class ThreatVaultApiTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = MockServer(count=COUNT).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+
+    def setUp(self):
+        self.api = pantv.ThreatVaultApi(url=self.server.url,
+                                        api_key='x')
+
+    def tearDown(self):
+        self.api.session.close()
+
+    def test_01(self):
+        threats = Dataset(COUNT).threats['antivirus']
+        args = [threats[0]['sha256'].upper(),
+                threats[1]['related_sha256_hashes'][0],
+                'f' * 64]
+        results = self.api.threats2_bulk(sha256=args, batch_size=2,
+                                         concurrency=2)
+        self.assertEqual(results, {
+            args[0].lower(): [threats[0]],
+            args[1]: [threats[1]],
+            args[2]: [],
+        })
+
+    def test_02(self):
+        hash_ = 'a' * 64
+        threat = {
+            'id': '1',
+            'sha256': 'b' * 64,
+            'description': hash_,
+            'reference': [hash_],
+        }
+        obj = {'count': 1, 'data': {'antivirus': [threat]}}
+        results = {hash_: [], 'b' * 64: []}
+        # only hash fields are matched
+        _threats2_merge('sha256', obj, results)
+        self.assertEqual(results, {hash_: [], 'b' * 64: [threat]})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,258 @@
+import asyncio
+import collections
+import multiprocessing
+import os
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+import aiohttp
+
+import pantv
+import pantv.v1aioapi
+from pantv import ratelimit
+from pantv.ratelimit import RateLimiter, SharedRateLimiter
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__),
+                                os.pardir, 'bench'))
+from mockserver import MockServer  # noqa: E402
+
+
+def headers(limit, remaining, reset, day_remaining=None):
+    x = {
+        'x-minute-ratelimit-limit': str(limit),
+        'x-minute-ratelimit-remaining': str(remaining),
+        'x-minute-ratelimit-reset': str(reset),
+    }
+    if day_remaining is not None:
+        x['x-day-ratelimit-remaining'] = str(day_remaining)
+    return x
+
+
+class RateLimiterTest(unittest.TestCase):
+    def test_01(self):
+        limiter = RateLimiter()
+        for _ in range(100):
+            self.assertEqual(limiter.reserve(), 0)
+
+    def test_02(self):
+        limiter = RateLimiter()
+        reset = int(time.time()) + 30
+        limiter.update(headers(10, 9, reset))
+        delays = [limiter.reserve() for _ in range(9)]
+        self.assertEqual(delays[0], 0)
+        self.assertEqual(delays, sorted(delays))
+        # spread evenly over the remaining window
+        self.assertLess(delays[-1], reset - time.time())
+        # budget spent: next request waits for the window reset
+        self.assertGreaterEqual(limiter.reserve(), reset - time.time() - 1)
+
+    def test_03(self):
+        limiter = RateLimiter(burst=5)
+        limiter.update(headers(60, 60, int(time.time()) + 60))
+        delays = [limiter.reserve() for _ in range(5)]
+        self.assertEqual(delays, [0] * 5)
+        self.assertGreater(limiter.reserve(), 0)
+
+    def test_04(self):
+        limiter = RateLimiter()
+        limiter.update(headers(10, 10, int(time.time()) + 60, 0))
+        self.assertEqual(limiter.reserve(), 0)
+
+    def test_05(self):
+        limiter = RateLimiter()
+        reset = int(time.time()) + 60
+        limiter.update(headers(10, 5, reset))
+        # older response arriving late does not raise remaining
+        limiter.update(headers(10, 8, reset))
+        for _ in range(5):
+            limiter.reserve()
+        self.assertGreaterEqual(limiter.reserve(), reset - time.time() - 1)
+
+    def test_06(self):
+        limiter = RateLimiter()
+        limiter.update({})
+        limiter.update(headers('x', 1, 1))
+        self.assertEqual(limiter.reserve(), 0)
+
+    def test_07(self):
+        limiter = RateLimiter()
+        reset = int(time.time()) + 60
+        # concurrent requests before the quota is known
+        for _ in range(3):
+            self.assertEqual(limiter.reserve(), 0)
+        # first response: 2 requests are still in flight
+        limiter.update(headers(10, 9, reset))
+        for _ in range(7):
+            self.assertLess(limiter.reserve(), reset - time.time() - 1)
+        self.assertGreaterEqual(limiter.reserve(), reset - time.time() - 1)
+
+    def test_08(self):
+        limiter = RateLimiter()
+        reset = int(time.time()) + 60
+        limiter.update(headers(10, 10, reset))
+        limiter.reserve()
+        # request failed without a response
+        limiter.update(None)
+        limiter.reserve()
+        limiter.update(headers(10, 8, reset))
+        for _ in range(8):
+            self.assertLess(limiter.reserve(), reset - time.time() - 1)
+        self.assertGreaterEqual(limiter.reserve(), reset - time.time() - 1)
+
+
+class RateLimiterClientTest(unittest.TestCase):
+    def setUp(self):
+        # short rate limit window
+        self.server = MockServer(count=100, rate_limit=10, window=2,
+                                 latency=0.01).start()
+        self.window = ratelimit.WINDOW
+        ratelimit.WINDOW = 2
+
+    def tearDown(self):
+        ratelimit.WINDOW = self.window
+        self.server.stop()
+
+    def statuses(self):
+        x = collections.Counter()
+        for (method, path, status), n in self.server.stats.items():
+            x[status] += n
+        return x
+
+    def test_01(self):
+        api = pantv.ThreatVaultApi(url=self.server.url, api_key='x',
+                                   rate_limit=RateLimiter(burst=10))
+        ids = [str(1000000 + i) for i in range(35)]
+        x = api.threats2_bulk(id=ids, batch_size=1, concurrency=8)
+        api.session.close()
+        self.assertEqual(len(x), len(ids))
+        self.assertEqual(self.statuses(), {200: len(ids)})
+
+    def test_02(self):
+        async def bulk(ids):
+            async with pantv.ThreatVaultApi(
+                    url=self.server.url, api_key='x',
+                    rate_limit=RateLimiter(burst=10)) as api:
+                return await api.threats2_bulk(id=ids, batch_size=1,
+                                               concurrency=8)
+
+        ids = [str(1000000 + i) for i in range(35)]
+        x = asyncio.run(bulk(ids))
+        self.assertEqual(len(x), len(ids))
+        self.assertEqual(self.statuses(), {200: len(ids)})
+
+    def test_03(self):
+        class Limiter(SharedRateLimiter):
+            def _locked(self):
+                threads.add(threading.get_ident())
+                return super()._locked()
+
+        async def bulk(ids):
+            async with pantv.ThreatVaultApi(
+                    url=self.server.url, api_key='x',
+                    rate_limit=Limiter(path, burst=10)) as api:
+                return await api.threats2_bulk(id=ids, batch_size=1,
+                                               concurrency=8)
+
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        threads = set()
+        ids = [str(1000000 + i) for i in range(35)]
+        try:
+            x = asyncio.run(bulk(ids))
+        finally:
+            os.unlink(path)
+        self.assertEqual(len(x), len(ids))
+        self.assertEqual(self.statuses(), {200: len(ids)})
+        # file lock is not acquired in the event loop thread
+        self.assertNotIn(threading.get_ident(), threads)
+
+    def test_04(self):
+        class Api(pantv.v1aioapi.ThreatVaultApi):
+            def _on_sleep(self, span, counts, reason, seconds):
+                if reason == '429':
+                    released.extend(x._released for x in responses
+                                    if x.status == 429)
+                super()._on_sleep(span, counts, reason, seconds)
+
+        async def on_request_end(session, ctx, params):
+            responses.append(params.response)
+
+        async def lookup(ids):
+            async with Api(url=self.server.url, api_key='x',
+                           limit=1) as api:
+                trace_config = aiohttp.TraceConfig()
+                trace_config.on_request_end.append(on_request_end)
+                trace_config.freeze()
+                api.session._trace_configs.append(trace_config)
+                for x in ids:
+                    resp = await api.threats(id=x, retry=True)
+                    self.assertEqual(resp.status, 200)
+                    resp.release()
+
+        responses = []
+        released = []
+        ids = [str(1000000 + i) for i in range(12)]
+        asyncio.run(lookup(ids))
+        self.assertGreater(self.statuses()[429], 0)
+        # 429 response connection released before the retry sleep
+        self.assertTrue(released)
+        self.assertTrue(all(released))
+
+
+def _reserve(path, n, queue):
+    limiter = SharedRateLimiter(path)
+    queue.put([limiter.reserve() for _ in range(n)])
+
+
+class SharedRateLimiterTest(unittest.TestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp()
+        os.close(fd)
+
+    def tearDown(self):
+        os.unlink(self.path)
+
+    def test_01(self):
+        limiter1 = SharedRateLimiter(self.path)
+        limiter2 = SharedRateLimiter(self.path)
+        self.assertEqual(limiter1.reserve(), 0)
+        limiter1.update(headers(10, 10, int(time.time()) + 60))
+        self.assertEqual(limiter2.reserve(), 0)
+        # second reservation is paced by the first
+        delay1 = limiter1.reserve()
+        delay2 = limiter2.reserve()
+        self.assertGreater(delay1, 0)
+        self.assertGreater(delay2, delay1)
+
+    def test_02(self):
+        limiter = SharedRateLimiter(self.path)
+        limiter.update(headers(30, 30, int(time.time()) + 60))
+
+        queue = multiprocessing.Queue()
+        procs = [multiprocessing.Process(target=_reserve,
+                                         args=(self.path, 10, queue))
+                 for _ in range(3)]
+        for p in procs:
+            p.start()
+        delays = []
+        for _ in procs:
+            delays.extend(queue.get(timeout=10))
+        for p in procs:
+            p.join()
+
+        # 30 slots spread over the window without duplicates
+        self.assertEqual(len(set(round(x, 3) for x in delays)), 30)
+        self.assertLess(max(delays), 60)
+
+    def test_03(self):
+        with open(self.path, 'w') as f:
+            f.write('invalid')
+        limiter = SharedRateLimiter(self.path)
+        self.assertEqual(limiter.reserve(), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
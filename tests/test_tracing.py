@@ -0,0 +1,175 @@
+import asyncio
+import os
+import sys
+import unittest
+
+import pantv
+import pantv.v1aioapi
+from pantv.tracing import NoopTracer, RecordingTracer
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__),
+                                os.pardir, 'bench'))
+from mockserver import MockServer, Dataset, EDL_VERSION  # noqa: E402
+
+COUNT = 2500
+LIMIT = 1000
+
+
+class NoopTracerTest(unittest.TestCase):
+    def test_01(self):
+        tracer = NoopTracer()
+        with tracer.start_as_current_span('x', attributes={'a': 1}) as span:
+            span.set_attribute('b', 2)
+            span.add_event('e', {'c': 3})
+            self.assertFalse(span.is_recording())
+
+
+class RecordingTracerTest(unittest.TestCase):
+    def test_01(self):
+        tracer = RecordingTracer()
+        with tracer.start_as_current_span('outer') as outer:
+            with tracer.start_as_current_span(
+                    'inner', attributes={'pantv.offset': 0}) as inner:
+                inner.set_attribute('pantv.count', 10)
+                inner.add_event('sleep', {'pantv.seconds': 1.5})
+        self.assertEqual([x.name for x in tracer.spans], ['inner', 'outer'])
+        self.assertIs(inner.parent, outer)
+        self.assertIsNone(outer.parent)
+        self.assertEqual(inner.attributes,
+                         {'pantv.offset': 0, 'pantv.count': 10})
+        self.assertEqual(inner.events[0][:2],
+                         ('sleep', {'pantv.seconds': 1.5}))
+        self.assertGreaterEqual(outer.duration, inner.duration)
+        self.assertFalse(outer.is_recording())
+
+    def test_02(self):
+        tracer = RecordingTracer()
+        with self.assertRaises(ValueError):
+            with tracer.start_as_current_span('x'):
+                raise ValueError('x')
+        self.assertIsInstance(tracer.spans[0].exception, ValueError)
+        self.assertIsNotNone(tracer.spans[0].end_time)
+
+    def test_03(self):
+        tracer = RecordingTracer()
+
+        async def task(name):
+            with tracer.start_as_current_span(name):
+                await asyncio.sleep(0.01)
+
+        async def main():
+            with tracer.start_as_current_span('outer') as outer:
+                await asyncio.gather(task('a'), task('b'))
+            return outer
+
+        outer = asyncio.run(main())
+        # concurrent tasks have the same parent
+        for x in tracer.spans:
+            if x.name != 'outer':
+                self.assertIs(x.parent, outer)
+
+
+class _ClientTracingTest:
+    @classmethod
+    def setUpClass(cls):
+        cls.server = MockServer(count=COUNT).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+
+    def check(self, outer):
+        pages = [x for x in self.tracer.spans
+                 if x.name == 'pantv.threats_all.page']
+        requests = [x for x in self.tracer.spans
+                    if x.name == 'pantv.threats']
+        self.assertEqual(len(self.tracer.spans), 1 + len(pages) +
+                         len(requests))
+        self.assertEqual(sorted(x.attributes['pantv.offset'] for x in pages),
+                         list(range(0, COUNT, LIMIT)))
+        self.assertEqual(len(requests), len(pages))
+        for x in pages:
+            # worker thread and task spans have the caller's span
+            # as parent
+            self.assertIs(x.parent, outer)
+            self.assertEqual(x.attributes['pantv.limit'], LIMIT)
+            self.assertEqual(x.attributes['pantv.count'], COUNT)
+            self.assertEqual(x.attributes['pantv.items'],
+                             min(LIMIT, COUNT - x.attributes['pantv.offset']))
+        for x in requests:
+            self.assertIn(x.parent, pages)
+            self.assertEqual(x.attributes['http.request.method'], 'GET')
+            self.assertEqual(x.attributes['url.path'],
+                             '/service/v1/threats')
+            self.assertEqual(x.attributes['http.response.status_code'], 200)
+            self.assertEqual(int(x.attributes['pantv.offset']),
+                             x.parent.attributes['pantv.offset'])
+            self.assertIsNotNone(x.end_time)
+        self.assertIsNone(outer.parent)
+
+
+class ClientTracingTest(_ClientTracingTest, unittest.TestCase):
+    def test_01(self):
+        self.tracer = RecordingTracer()
+        api = pantv.ThreatVaultApi(url=self.server.url, api_key='x',
+                                   tracer=self.tracer)
+        with self.tracer.start_as_current_span('outer') as outer:
+            n = 0
+            for ok, x in api.threats_all(type='vulnerability',
+                                         concurrency=4):
+                self.assertTrue(ok, x)
+                n += 1
+        api.session.close()
+        self.assertEqual(n, COUNT)
+        self.check(outer)
+
+    def test_02(self):
+        self.tracer = RecordingTracer()
+        api = pantv.ThreatVaultApi(url=self.server.url, api_key='x',
+                                   tracer=self.tracer)
+        ips = Dataset(COUNT).edl(pantv.EDL_NAMES[0], EDL_VERSION)[:8]
+        with self.tracer.start_as_current_span('outer') as outer:
+            api.edl_lookup(ipaddrs=ips, concurrency=4)
+        api.session.close()
+        spans = [x for x in self.tracer.spans if x.name == 'pantv.edl']
+        self.assertEqual(len(spans), len(ips))
+        # worker thread spans have the caller's span as parent
+        for x in spans:
+            self.assertIs(x.parent, outer)
+
+    def test_03(self):
+        self.tracer = RecordingTracer()
+        api = pantv.ThreatVaultApi(url=self.server.url, api_key='x',
+                                   tracer=self.tracer)
+        ids = [str(1000000 + i) for i in range(8)]
+        with self.tracer.start_as_current_span('outer') as outer:
+            api.threats2_bulk(id=ids, batch_size=2, concurrency=4)
+        api.session.close()
+        spans = [x for x in self.tracer.spans if x.name == 'pantv.threats2']
+        self.assertEqual(len(spans), 4)
+        # worker thread spans have the caller's span as parent
+        for x in spans:
+            self.assertIs(x.parent, outer)
+            self.assertEqual(x.attributes['http.request.method'], 'POST')
+
+
+class AioClientTracingTest(_ClientTracingTest,
+                           unittest.IsolatedAsyncioTestCase):
+    async def test_01(self):
+        self.tracer = RecordingTracer()
+        api = pantv.v1aioapi.ThreatVaultApi(url=self.server.url,
+                                            api_key='x',
+                                            tracer=self.tracer)
+        with self.tracer.start_as_current_span('outer') as outer:
+            n = 0
+            async for ok, x in api.threats_all(type='vulnerability',
+                                               concurrency=4):
+                self.assertTrue(ok, x)
+                n += 1
+        await api.session.close()
+        self.assertEqual(n, COUNT)
+        self.check(outer)
+
+
+if __name__ == '__main__':
+    unittest.main()
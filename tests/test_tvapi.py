@@ -0,0 +1,79 @@
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__),
+                                os.pardir, 'bench'))
+from mockserver import MockServer, Dataset  # noqa: E402
+
+TVAPI = os.path.join(os.path.dirname(__file__), os.pardir,
+                     'bin', 'tvapi.py')
+COUNT = 100
+
+
+class TvapiTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = MockServer(count=COUNT).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+
+    def tvapi(self, *args):
+        x = subprocess.run([sys.executable, TVAPI,
+                            '--url', self.server.url, '--api-key', 'x',
+                            *args],
+                           capture_output=True, text=True, timeout=60)
+        self.assertEqual(x.returncode, 0, x.stderr)
+        return x.stdout
+
+    def requests(self, path):
+        return sum(n for (method, path_, status), n in
+                   self.server.stats.items()
+                   if path_ == '/service/v1/' + path)
+
+    def test_01(self):
+        fd, path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        try:
+            for aio in ['--noaio', '--aio']:
+                args = [aio, '--release-notes', '--type', 'content',
+                        '--content-version', '8599' if aio == '--aio'
+                        else '8598', '-j', '--cache', path]
+                n = self.requests('release-notes')
+                x = self.tvapi(*args)
+                self.assertIn('"content_version"', x)
+                # second run is served from the cache
+                self.assertEqual(self.tvapi(*args), x)
+                self.assertEqual(self.requests('release-notes'), n + 1)
+        finally:
+            os.unlink(path)
+
+    def test_02(self):
+        threats = Dataset(COUNT).threats
+        ids = [threats['spyware'][1]['id'], threats['antivirus'][2]['id'],
+               '999']
+        for aio in ['--noaio', '--aio']:
+            x = self.tvapi(aio, '--threats2', '--all', '-N',
+                           '--id', ids[0], '--id', ids[1], '--id', ids[2])
+            x = [json.loads(y) for y in x.splitlines()]
+            self.assertEqual(x, [
+                {'value': ids[0], 'data': [threats['spyware'][1]]},
+                {'value': ids[1], 'data': [threats['antivirus'][2]]},
+                {'value': '999', 'data': []},
+            ])
+
+    def test_03(self):
+        for aio in ['--noaio', '--aio']:
+            x = self.tvapi(aio, '--release-notes', '--type', 'content',
+                           '--content-version', '8599', '-j',
+                           '-J', 'data[0].content_version')
+            self.assertEqual(json.loads(x), '8599-7399')
+
+
+if __name__ == '__main__':
+    unittest.main()